@@ -0,0 +1,179 @@
+"""
+Client benchmarks against the local mock server (tdw_mock_server)
+
+Runs the mock queue in a separate process and measures
+    - handshake: seconds to create and join one environment, and to
+      provision --envs environments concurrently
+    - step: round trip latency of client.step()
+    - throughput: frames and megabytes per second received, with one
+      request in flight and pipelined
+
+    python benchmarks/bench_client.py [--frame-shape H W C] [--steps N]
+"""
+import os, sys, time, argparse, multiprocessing
+from contextlib import contextmanager
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from tdw_client import TDW_Client
+from tdw_mock_server import MockQueue
+from tdw_provision import create_environments
+
+
+def serve(port, frame_shape, fps, launch_delay, pattern="noise"):
+    queue = MockQueue(port=port, frame_shape=frame_shape, fps=fps,
+                      launch_delay=launch_delay, pattern=pattern)
+    queue.start()
+    while True:
+        time.sleep(1)
+
+
+@contextmanager
+def mock_server(port, frame_shape, fps=None, launch_delay=0.0,
+                pattern="noise"):
+    process = multiprocessing.Process(target=serve, args=(port, frame_shape,
+                                                          fps, launch_delay,
+                                                          pattern))
+    process.daemon = True
+    process.start()
+    time.sleep(0.5)
+    try:
+        yield process
+    finally:
+        process.terminate()
+        process.join()
+
+
+@contextmanager
+def quiet():
+    """
+    Silences the setup output of the clients
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def client_kwargs(args, **kwargs):
+    kwargs.update({"queue_port_num": str(args.port),
+                   "username": "bench",
+                   "frame_shape": tuple(args.frame_shape),
+                   "transport": args.transport})
+    return kwargs
+
+
+def create_client(args, **kwargs):
+    with quiet():
+        client = TDW_Client("127.0.0.1",
+                            initial_command="request_create_environment",
+                            selected_build=MockQueue.BUILD,
+                            description="benchmark",
+                            **client_kwargs(args, **kwargs))
+        client.run()
+    return client
+
+
+def report(label, values, unit="ms", scale=1e3):
+    values = np.asarray(values) * scale
+    print "%-32s mean %8.2f  p50 %8.2f  p99 %8.2f  max %8.2f %s" % (
+        label, values.mean(), np.percentile(values, 50),
+        np.percentile(values, 99), values.max(), unit)
+
+
+def bench_handshake(args):
+    times = []
+    for _ in range(args.handshakes):
+        start = time.time()
+        client = create_client(args)
+        client.recv_frames()
+        times.append(time.time() - start)
+        client.sock.close(linger=0)
+    report("create + join + first frame", times)
+
+    start = time.time()
+    with quiet():
+        clients = create_environments("127.0.0.1", args.envs,
+                                      MockQueue.BUILD, "benchmark",
+                                      **client_kwargs(args))
+    for client in clients:
+        client.recv_frames()
+    print "%-32s %8.2f ms for %d environments" % (
+        "concurrent provisioning", (time.time() - start) * 1e3, args.envs)
+    for client in clients:
+        client.sock.close(linger=0)
+
+
+def bench_steps(args):
+    client = create_client(args)
+    out = dict((name, np.empty(tuple(args.frame_shape), np.uint8))
+               for name in client.frame_names)
+    client.recv_frames()
+
+    times = []
+    start = time.time()
+    for _ in range(args.steps):
+        t = time.time()
+        client.step(out=out)
+        times.append(time.time() - t)
+    total = time.time() - start
+    report("step round trip", times)
+    throughput("throughput, depth 1", args, total, client)
+    client.sock.close(linger=0)
+
+
+def bench_pipelined(args):
+    client = create_client(args, pipeline_depth=args.depth)
+    client.recv_frames()
+
+    start = time.time()
+    for _ in range(args.depth):
+        client.submit_action()
+    for _ in range(args.steps - args.depth):
+        client.collect_frames()
+        client.submit_action()
+    for _ in range(args.depth):
+        client.collect_frames()
+    total = time.time() - start
+    throughput("throughput, depth %d" % args.depth, args, total, client)
+    client.sock.close(linger=0)
+
+
+def throughput(label, args, total, client):
+    frames = args.steps * len(client.frame_names)
+    megabytes = frames * np.prod(args.frame_shape) / 1e6
+    print "%-32s %8.1f steps/s %8.1f frames/s %8.1f MB/s" % (
+        label, args.steps / total, frames / total, megabytes / total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=23502)
+    parser.add_argument("--frame-shape", type=int, nargs=3, default=[256, 256, 3])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--handshakes", type=int, default=10)
+    parser.add_argument("--envs", type=int, default=16)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fps", type=float, default=None,
+                        help="limit the replies per second of every environment")
+    parser.add_argument("--launch-delay", type=float, default=0.0,
+                        help="seconds the mock queue takes to launch a build")
+    parser.add_argument("--transport", default="tcp",
+                        choices=["tcp", "ipc", "shm", "auto"])
+    args = parser.parse_args()
+
+    print "frames %s, %d steps, %s" % ("x".join(map(str, args.frame_shape)),
+                                       args.steps, args.transport)
+    with mock_server(args.port, args.frame_shape, args.fps, args.launch_delay):
+        bench_handshake(args)
+        bench_steps(args)
+        bench_pipelined(args)
+
+
+if __name__ == "__main__":
+    main()
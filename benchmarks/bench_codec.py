@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the message codecs in tdw_codec
+
+Times encoding and decoding of typical messages of growing size with every
+codec whose dependencies are installed. The 'double_json' row is the old
+path that encoded every queue message twice.
+
+    python benchmarks/bench_codec.py [--repeat N]
+"""
+import os, sys, json, timeit, argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import tdw_codec
+
+
+def make_messages():
+    """
+    Returns (label, message) pairs ordered by size
+    """
+    action = {"n": 4, "msg": {"msg_type": "CLIENT_INPUT",
+                              "get_obj_data": False,
+                              "send_scene_info": False,
+                              "vel": [0.1, 0.0, 0.2],
+                              "ang_vel": [0.0, 0.3, 0.0]}}
+    processes = {"msg": {"msg_type": "ACTIVE_PROCESSES"},
+                 "processes": [{"env_owner": "user%d" % i,
+                                "proc_pid": 1000 + i,
+                                "port_num": 5556 + i,
+                                "proc_create_time": "1500000000.0",
+                                "env_desc": "environment %d" % i}
+                               for i in range(64)]}
+
+    def objects(count):
+        return {"msg": {"msg_type": "CLIENT_INPUT"},
+                "observed_objects": [["obj%d" % i, i,
+                                      [1.0 * i, 2.0, 3.0],
+                                      [0.0, 0.0, 0.0, 1.0],
+                                      [0.0, 0.0, 0.0], False]
+                                     for i in range(count)]}
+
+    return [("action", action),
+            ("64 processes", processes),
+            ("100 objects", objects(100)),
+            ("2000 objects", objects(2000))]
+
+
+class DoubleJSON(object):
+    name = "double_json"
+
+    def encode(self, msg):
+        return json.dumps(json.dumps(msg))
+
+    def decode(self, data):
+        return json.loads(json.loads(data))
+
+
+def bench(codec, msg, repeat):
+    data = codec.encode(msg)
+    enc = min(timeit.repeat(lambda: codec.encode(msg), number=repeat,
+                            repeat=3)) / repeat
+    dec = min(timeit.repeat(lambda: codec.decode(data), number=repeat,
+                            repeat=3)) / repeat
+    return len(data), enc, dec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    codecs = [DoubleJSON()]
+    codecs += [tdw_codec.get_codec(name)
+               for name in tdw_codec.available_codecs()
+               if name != tdw_codec.LegacyJSONCodec.name]
+
+    print "%-14s %-12s %10s %12s %12s" % ("message", "codec", "bytes",
+                                          "encode (us)", "decode (us)")
+    print "-" * 64
+    for label, msg in make_messages():
+        for codec in codecs:
+            size, enc, dec = bench(codec, msg, args.repeat)
+            print "%-14s %-12s %10d %12.1f %12.1f" % (label, codec.name, size,
+                                                      enc * 1e6, dec * 1e6)
+        print
+
+    # actions holding arrays are where the binary codec differs from msgpack
+    if ("binary" in tdw_codec.available_codecs()):
+        action = {"msg": {"msg_type": "CLIENT_INPUT",
+                          "actions": np.random.rand(64, 6)}}
+        size, enc, dec = bench(tdw_codec.get_codec("binary"), action,
+                               args.repeat)
+        print "%-14s %-12s %10d %12.1f %12.1f" % ("64x6 array", "binary", size,
+                                                  enc * 1e6, dec * 1e6)
+
+
+if __name__ == "__main__":
+    main()
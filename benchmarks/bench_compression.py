@@ -0,0 +1,103 @@
+"""
+Frame encoding benchmarks against the local mock server (tdw_mock_server)
+
+Steps one environment over tcp in every mode of frame_encoding (see
+tdw_compression) that can be decoded here, with frames of the scene pattern
+that compress about as well as rendered ones, and reports per step
+    - the bytes received and their ratio to raw frames
+    - round trip latency, and the part of it spent decoding
+    - steps per second on this machine, and estimated for a link of
+      --link-mbps where the transfer time of the bytes is added
+
+    python benchmarks/bench_compression.py [--frame-shape H W C] [--steps N]
+"""
+import os, sys, time, argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import tdw_compression
+from tdw_metrics import Metrics
+from bench_client import mock_server, create_client
+
+
+def modes(args):
+    """
+    Returns (label, frame_encoding) of every mode to compare
+    """
+    height, width = args.frame_shape[:2]
+    roi = [height // 4, width // 4, height // 2, width // 2]
+    available = tdw_compression.available_encodings()
+    result = [("raw", None)]
+    for encoding in tdw_compression.LOSSLESS_ENCODINGS:
+        if (encoding in available):
+            result.append((encoding, encoding))
+    if ("jpeg" in available):
+        for quality in args.quality:
+            result.append(("jpeg q%d" % quality,
+                           {"encoding": "jpeg", "quality": quality}))
+    result.append(("raw, scale 0.5", {"scale": 0.5}))
+    result.append(("raw, roi 1/4", {"roi": roi}))
+    lossless = [e for e in tdw_compression.LOSSLESS_ENCODINGS if e in available]
+    if (lossless):
+        result.append(("%s, scale 0.5" % lossless[0],
+                       {"encoding": lossless[0], "scale": 0.5}))
+    return result
+
+
+def bench_mode(args, label, frame_encoding):
+    metrics = Metrics()
+    client = create_client(args, frame_encoding=frame_encoding,
+                           metrics=metrics)
+    client.recv_frames()
+    metrics.reset()
+
+    times = []
+    for _ in range(args.steps):
+        start = time.time()
+        client.step()
+        times.append(time.time() - start)
+    client.sock.close(linger=0)
+
+    recv = metrics.types["CLIENT_INPUT"]
+    step_bytes = float(recv.bytes_received) / recv.received
+    decode = recv.decode_seconds / recv.received
+    latency = np.mean(times)
+    link = latency + step_bytes * 8 / (args.link_mbps * 1e6)
+    return {"label": label, "bytes": step_bytes, "decode": decode,
+            "p50": np.percentile(times, 50), "rate": 1.0 / latency,
+            "link_rate": 1.0 / link}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=23702)
+    parser.add_argument("--frame-shape", type=int, nargs=3, default=[256, 256, 3])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--link-mbps", type=float, default=100.0,
+                        help="bandwidth of the link to estimate remote steps per second for")
+    parser.add_argument("--quality", type=int, nargs="+", default=[90, 50],
+                        help="jpeg qualities to compare")
+    args = parser.parse_args()
+    args.transport = "tcp"
+
+    print "frames %s, %d steps, link %.0f Mbit/s" % (
+        "x".join(map(str, args.frame_shape)), args.steps, args.link_mbps)
+    print "%-20s %10s %6s %10s %10s %10s %12s" % (
+        "mode", "KB/step", "ratio", "p50 ms", "decode ms", "steps/s",
+        "link steps/s")
+    with mock_server(args.port, args.frame_shape, pattern="scene"):
+        raw = None
+        for label, frame_encoding in modes(args):
+            result = bench_mode(args, label, frame_encoding)
+            if (raw is None):
+                raw = result["bytes"]
+            print "%-20s %10.1f %6.2f %10.2f %10.2f %10.1f %12.1f" % (
+                label, result["bytes"] / 1e3, result["bytes"] / raw,
+                result["p50"] * 1e3, result["decode"] * 1e3,
+                result["rate"], result["link_rate"])
+
+
+if __name__ == "__main__":
+    main()
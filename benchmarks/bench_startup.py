@@ -0,0 +1,122 @@
+"""
+Startup benchmarks of short-lived workers against the local mock server
+(tdw_mock_server)
+
+Every sample is a fresh interpreter, as a batch worker would be, measuring
+    - import: seconds to import tdw_client, above a bare interpreter, and
+      whether the menu libraries (pick, tabulate) were loaded with it
+    - cold start: process start to first frame of a new environment, with a
+      non-interactive client
+    - warm restart: process start to first frame when reattaching to the
+      environment saved in a session file by the previous worker
+
+    python benchmarks/bench_startup.py [--samples N]
+"""
+import os, sys, time, json, argparse, subprocess, tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+UI_MODULES = ["pick", "tabulate"]
+
+
+def worker(args):
+    """
+    Runs in the measured process, prints its timings as json
+    """
+    start = time.time()
+    sys.path.insert(0, ROOT)
+    from tdw_client import TDW_Client
+    imported = time.time()
+    loaded = [name for name in UI_MODULES if name in sys.modules]
+    if (args.worker == "import"):
+        print json.dumps({"import": imported - start, "ui_modules": loaded})
+        return
+
+    client = TDW_Client("127.0.0.1",
+                        queue_port_num=str(args.port),
+                        initial_command="request_create_environment",
+                        selected_build="mock.x86_64",
+                        username="bench",
+                        description="startup",
+                        frame_shape=tuple(args.frame_shape),
+                        transport="tcp",
+                        session_file=args.session_file,
+                        interactive=False,
+                        timeout=10.0)
+    client.run()
+    client.recv_frames()
+    print json.dumps({"import": imported - start,
+                      "first_frame": time.time() - imported,
+                      "ui_modules": loaded})
+
+
+def run_worker(args, mode, session_file=None):
+    """
+    Returns (seconds from process start to exit, timings of the worker)
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--worker", mode,
+               "--port", str(args.port),
+               "--frame-shape"] + [str(n) for n in args.frame_shape]
+    if (session_file is not None):
+        command += ["--session-file", session_file]
+    start = time.time()
+    output = subprocess.check_output(command)
+    return time.time() - start, json.loads(output.splitlines()[-1])
+
+
+def bare_interpreter(samples):
+    times = []
+    for _ in range(samples):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", "pass"])
+        times.append(time.time() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=23602)
+    parser.add_argument("--frame-shape", type=int, nargs=3, default=[256, 256, 3])
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--worker", choices=["import", "start"],
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--session-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if (args.worker):
+        worker(args)
+        return
+
+    from bench_client import mock_server, report
+
+    bare = bare_interpreter(args.samples)
+    report("bare interpreter", bare)
+    samples = [run_worker(args, "import") for _ in range(args.samples)]
+    report("import tdw_client", [timings["import"] for _, timings in samples])
+    print "%-32s %s" % ("menu libraries loaded",
+                        ", ".join(samples[0][1]["ui_modules"]) or "none")
+
+    session_dir = tempfile.mkdtemp()
+    session_file = os.path.join(session_dir, "session.json")
+    try:
+        with mock_server(args.port, args.frame_shape):
+            cold = [run_worker(args, "start") for _ in range(args.samples)]
+            report("cold start to first frame", [total for total, _ in cold])
+            report("  construct to first frame",
+                   [timings["first_frame"] for _, timings in cold])
+
+            # the first worker creates the environment, the others reattach
+            run_worker(args, "start", session_file)
+            warm = [run_worker(args, "start", session_file)
+                    for _ in range(args.samples)]
+            report("warm restart to first frame", [total for total, _ in warm])
+            report("  construct to first frame",
+                   [timings["first_frame"] for _, timings in warm])
+    finally:
+        if (os.path.exists(session_file)):
+            os.remove(session_file)
+        os.rmdir(session_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import zmq
+from zmq.eventloop.future import Context
+from tornado import gen
+
+import tdw_codec
+import tdw_frames
+import tdw_protocol
+from tdw_errors import TDWError, TDWInputError, TDWRequestError
+
+
+class AsyncTDWClient(object):
+    """
+    Non-blocking client for driving many environments from one process
+
+    Every request is a coroutine built on the future-returning sockets of
+    zmq.eventloop.future, so one event loop multiplexes any number of clients
+    without a thread per environment. Nothing prompts: builds, ports and
+    environments to join are passed in and failures raise TDWError.
+
+        @gen.coroutine
+        def main():
+            clients = [AsyncTDWClient(host, selected_build=build,
+                                      description="batch")
+                       for _ in range(32)]
+            yield [c.request_create_environment() for c in clients]
+            first = yield [c.recv_frames() for c in clients]
+            obs = yield [c.step({"vel": [0, 0, 1]}) for c in clients]
+
+        IOLoop.current().run_sync(main)
+
+    With tornado 5 or newer on python 3 the IOLoop runs on top of asyncio, so
+    these coroutines can also be awaited from asyncio code.
+    """
+
+    def __init__(self, host_address,
+                 queue_port_num="23402",
+                 requested_port_num=None,
+                 environment_config=None,
+                 selected_build=None,
+                 username=None,
+                 description=None,
+                 num_frames_per_msg=4,
+                 get_obj_data=False,
+                 send_scene_info=False,
+                 environment_profile=None,
+                 frame_names=None,
+                 frame_shape=None,
+                 codec="json",
+                 queue_codec="json",
+                 ctx=None
+                 ):
+        """
+        Takes the same arguments as TDW_Client, minus the interactive ones.
+        ctx is the zmq.eventloop.future Context to create sockets with, the
+        shared instance by default.
+        """
+        self.queue_host_address = host_address
+        self.queue_port_number = queue_port_num
+        self.port_num = requested_port_num
+        self.environment_config = environment_config
+        self.selected_build = selected_build
+        if username is None:
+            username = tdw_protocol.default_username()
+        self.username = username
+        self.description = description
+        self.num_frames_per_msg = num_frames_per_msg
+        self.get_obj_data = get_obj_data
+        self.send_scene_info = send_scene_info
+        self.environment_profile = environment_profile
+        self.frame_names = tdw_frames.frame_names_for(num_frames_per_msg,
+                                                      frame_names)
+        self.frame_shapes = tdw_frames.frame_shapes_for(self.frame_names,
+                                                        frame_shape)
+        self.preferred_codec = tdw_codec.get_codec(codec)
+        self.codec = tdw_codec.get_codec(queue_codec)
+
+        self.ctx = ctx or Context.instance()
+        self.sock = self.ctx.socket(zmq.REQ)
+        self.sock.connect(self.queue_endpoint())
+        self.connected_to_queue = True
+
+    def queue_endpoint(self):
+        return "tcp://" + self.queue_host_address + ":" + str(self.queue_port_number)
+
+    def close(self):
+        self.sock.close(linger=0)
+
+    ############################################################################
+    #                            COMMANDS TO QUEUE                             #
+    ############################################################################
+
+    @gen.coroutine
+    def request_create_environment(self, selected_build=None):
+        """
+        Creates an environment running selected_build (default: the build
+        given at construction) and joins it
+        """
+        selected_build = selected_build or self.selected_build
+        if (not selected_build):
+            raise ValueError("a build is required to create an environment")
+        if (not self.description):
+            raise ValueError("a description is required to create an environment")
+        if (not self.username):
+            raise TDWInputError("username not given and the user running "
+                                "this process is unknown")
+
+        if (not self.port_num):
+            yield self.automatic_port_selection()
+
+        # phase 1
+        # loop until open port number is selected
+        while True:
+            msg = yield self.request({"msg": {"msg_type": "CREATE_ENVIRONMENT_1"},
+                                      "port_num": str(self.port_num)})
+            msg_type = msg["msg"]["msg_type"]
+            if (msg_type == "PORT_UNAVAILABLE"):
+                yield self.automatic_port_selection()
+            elif (msg_type == "SEND_OPTIONS"):
+                break
+            else:
+                raise TDWRequestError(msg_type, msg)
+
+        build_option = tdw_protocol.match_build(msg["options"], selected_build)
+        if (build_option is None):
+            raise TDWError("build '%s' is not available on the server"
+                           % selected_build)
+
+        # phase 2
+        # loop until has open port number on server
+        while True:
+            msg = yield self.request(tdw_protocol.create_message(
+                self.port_num, build_option, self.username, self.description,
+                self.environment_profile))
+            msg_type = msg["msg"]["msg_type"]
+            if (msg_type == "PORT_UNAVAILABLE"):
+                yield self.automatic_port_selection()
+            elif (msg_type == "JOIN_OFFER"):
+                break
+            else:
+                raise TDWRequestError(msg_type, msg)
+
+        yield self.connect_to_port(msg["port_num"])
+
+    @gen.coroutine
+    def request_join_environment(self, selected):
+        """
+        Joins the active environment listed by the queue as selected
+        """
+        msg = yield self.request({"msg": {"msg_type": "JOIN_ENVIRONMENT_1"}})
+        msg_type = msg["msg"]["msg_type"]
+        if (msg_type != "SEND_OPTIONS"):
+            raise TDWRequestError(msg_type, msg)
+        if (selected not in msg["options"]):
+            raise TDWError("environment '%s' is not available on the server"
+                           % selected)
+
+        msg = yield self.request({"msg": {"msg_type": "JOIN_ENVIRONMENT_2"},
+                                  "selected": selected})
+        msg_type = msg["msg"]["msg_type"]
+        if (msg_type != "JOIN_OFFER"):
+            raise TDWRequestError(msg_type, msg)
+
+        yield self.connect_to_port(msg["port_num"], use_config=False)
+
+    @gen.coroutine
+    def request_active_processes(self):
+        """
+        Returns the list of environment processes running on the server
+        """
+        msg = yield self.request({"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}})
+        msg_type = msg["msg"]["msg_type"]
+        if (msg_type != "ACTIVE_PROCESSES"):
+            raise TDWRequestError(msg_type, msg)
+        raise gen.Return(msg["processes"])
+
+    @gen.coroutine
+    def automatic_port_selection(self):
+        """
+        Requests a free port from the server
+        """
+        msg = yield self.request({"msg": {"msg_type": "AUTO_SELECT_PORT"}})
+        msg_type = msg["msg"]["msg_type"]
+        if (msg_type != "AUTO_SELECT_PORT"):
+            raise TDWRequestError(msg_type, msg)
+        self.port_num = msg["port_num"]
+
+    ############################################################################
+    #                            ENVIRONMENT FUNCTIONS                         #
+    ############################################################################
+
+    @gen.coroutine
+    def connect_to_port(self, port_num, use_config=True):
+        """
+        Connects to an environment and sends the join message, the first
+        observation is then available from recv_frames
+        """
+        if (self.connected_to_queue):
+            self.sock.disconnect(self.queue_endpoint())
+            self.connected_to_queue = False
+        self.sock.connect("tcp://" + self.queue_host_address + ":" + str(port_num))
+        self.port_num = port_num
+
+        # environments speak json until they accept the offered codec
+        self.codec = tdw_codec.JSONCodec()
+        config = None
+        if (use_config and self.environment_config):
+            config = self.environment_config
+        msg = tdw_protocol.join_message(
+            self.num_frames_per_msg, config,
+            send_scene_info=self.send_scene_info,
+            get_obj_data=self.get_obj_data,
+            codecs=tdw_protocol.offered_codecs(self.preferred_codec))
+        yield self.send_json(msg)
+
+    @gen.coroutine
+    def send_action(self, action=None):
+        msg = tdw_protocol.input_message(self.num_frames_per_msg, action,
+                                         get_obj_data=self.get_obj_data,
+                                         send_scene_info=self.send_scene_info)
+        yield self.send_json(msg)
+
+    @gen.coroutine
+    def recv_frames(self, out=None):
+        """
+        Receives one reply from the environment, see TDW_Client.recv_frames
+        """
+        frames = yield self.sock.recv_multipart(copy=False)
+        obs = tdw_frames.unpack_frames(frames, self.frame_names,
+                                       self.frame_shapes, out,
+                                       self.codec.decode)
+        self.codec = tdw_protocol.accepted_codec(obs["info"], self.codec,
+                                                 self.preferred_codec)
+        raise gen.Return(obs)
+
+    @gen.coroutine
+    def step(self, action=None, out=None):
+        """
+        Sends an action and returns the observation it produced
+        """
+        yield self.send_action(action)
+        obs = yield self.recv_frames(out)
+        raise gen.Return(obs)
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    @gen.coroutine
+    def send_json(self, msg):
+        yield self.sock.send(self.codec.encode(msg))
+
+    @gen.coroutine
+    def recv_json(self):
+        data = yield self.sock.recv()
+        raise gen.Return(self.codec.decode(data))
+
+    @gen.coroutine
+    def request(self, msg):
+        """
+        Sends a message and returns the decoded reply
+        """
+        yield self.send_json(msg)
+        reply = yield self.recv_json()
+        raise gen.Return(reply)
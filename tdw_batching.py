@@ -0,0 +1,128 @@
+import time
+from itertools import islice
+
+
+class BatchTuner(object):
+    """
+    Picks the number of actions sent per request (see TDW_Client.step_batch)
+    from the measured round trip time and throughput
+
+        tuner = BatchTuner(max_batch=32, max_bytes=256 << 20)
+        for obs in tuner.run(client, actions):
+            train_on(obs["images"])
+
+    Every window requests the throughput in steps per second at the current
+    batch size is compared with the one measured at the previous size. The
+    batch keeps growing (doubling) or shrinking (halving) while that
+    improves throughput by more than tolerance, and turns around when it
+    gets worse. When the difference is within tolerance, as on fast local
+    links where round trips are cheap, it shrinks to save memory. The size
+    always stays within min_batch and max_batch, the frames of one request
+    within max_bytes, and a request within max_latency seconds.
+    """
+
+    def __init__(self, min_batch=1, max_batch=32, max_bytes=None,
+                 max_latency=None, window=4, tolerance=0.05):
+        """
+        :Kwargs:
+            - min_batch (int, default: 1)
+
+            - max_batch (int, default: 32)
+                Also capped by the largest batch the environment accepts.
+
+            - max_bytes (int, default: None)
+                Largest payload of one reply, limits the batch once the size of a step is known.
+
+            - max_latency (float, default: None)
+                Seconds a request may take, the batch shrinks while requests are slower.
+
+            - window (int, default: 4)
+                Requests measured at each batch size before deciding on the next one.
+
+            - tolerance (float, default: 0.05)
+                Relative throughput change treated as no change.
+        """
+        self.min_batch = max(int(min_batch), 1)
+        self.max_batch = max(int(max_batch), self.min_batch)
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.window = window
+        self.tolerance = tolerance
+
+        self.batch_size = self.min_batch
+        self.direction = 1
+        self.step_bytes = None
+        self.previous = None
+        self.reset_window()
+
+    def reset_window(self):
+        self.requests = 0
+        self.steps = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+
+    def limit(self, client_max=None):
+        """
+        Largest batch allowed right now
+        """
+        limit = self.max_batch
+        if (client_max):
+            limit = min(limit, client_max)
+        if (self.max_bytes and self.step_bytes):
+            limit = min(limit, int(self.max_bytes // self.step_bytes))
+        return max(limit, self.min_batch)
+
+    def record(self, steps, seconds, nbytes=None, client_max=None):
+        """
+        Records one request of steps actions that took seconds and returned
+        nbytes of frames, and moves the batch size once the window is full
+        """
+        self.requests += 1
+        self.steps += steps
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        if (nbytes):
+            self.step_bytes = float(nbytes) / steps
+        if (self.requests < self.window):
+            return
+
+        throughput = self.steps / max(self.seconds, 1e-9)
+        if (self.max_latency is not None and self.slowest > self.max_latency):
+            self.direction = -1
+        elif (self.previous is not None):
+            change = throughput / self.previous - 1
+            if (change < -self.tolerance):
+                self.direction = -self.direction
+            elif (change <= self.tolerance):
+                self.direction = -1
+        self.previous = throughput
+
+        if (self.direction > 0):
+            size = self.batch_size * 2
+        else:
+            size = self.batch_size // 2
+        limit = self.limit(client_max)
+        self.batch_size = min(max(size, self.min_batch), limit)
+        if (self.batch_size == self.min_batch):
+            # probe larger batches again in case the link got slower
+            self.direction = 1
+        self.reset_window()
+
+    def run(self, client, actions, out=None):
+        """
+        Steps client through the iterable actions in batches of the current
+        size, yielding the stacked observations of every batch
+        """
+        actions = iter(actions)
+        while True:
+            size = min(self.batch_size, self.limit(client.max_batch))
+            batch = list(islice(actions, size))
+            if (not batch):
+                return
+            start = time.time()
+            obs = client.step_batch(batch, out)
+            nbytes = sum(value.nbytes for name, value in obs.items()
+                         if hasattr(value, "nbytes"))
+            self.record(len(batch), time.time() - start, nbytes,
+                        client.max_batch)
+            yield obs
@@ -1,7 +1,14 @@
-import os, json, datetime
+import sys, time, datetime
+from collections import deque
 import zmq
-from tabulate import tabulate
-from pick import pick
+
+import tdw_codec
+import tdw_compression
+import tdw_frames
+import tdw_protocol
+import tdw_transport
+from tdw_errors import TDWError, TDWInputError, TDWRequestError, TDWTimeoutError
+from tdw_metrics import LatencyStats, Metrics
 
 
 class TDW_Client(object):
@@ -11,7 +18,7 @@ class TDW_Client(object):
                  requested_port_num=None,
                  auto_select_port=True,
                  environment_config=None,
-                 debug=True,
+                 debug=False,
                  selected_build=None,
                  selected_forward=None,
                  initial_command="",
@@ -20,12 +27,30 @@ class TDW_Client(object):
                  num_frames_per_msg=4,
                  get_obj_data=False,
                  send_scene_info=False,
-                 environment_profile=None
+                 environment_profile=None,
+                 frame_names=None,
+                 frame_shape=None,
+                 codec="json",
+                 queue_codec="json",
+                 pipeline_depth=1,
+                 ctx=None,
+                 timeout=None,
+                 reconnect_attempts=5,
+                 reconnect_backoff=0.5,
+                 reconnect_timeout=10.0,
+                 metrics=None,
+                 scene_cache=None,
+                 transport="auto",
+                 session_file=None,
+                 session_timeout=1.0,
+                 interactive=None,
+                 frame_encoding=None
                  ):
 
         """
         :Args:
-            host_address (str)
+            host_address (str or list)
+                Address of the queue, or a list of them ('host' or 'host:port'). With several queues, request_create_environment probes all of them and creates the environment on the least loaded one (see tdw_queues).
 
         :Kwargs:
             - queue_port_num (str, default: 23402)
@@ -60,22 +85,78 @@ class TDW_Client(object):
                 A number greater than 1 that equals the number of frames you expect back.
 
             - get_obj_data (bool, default: False)
-                Determines whether you want object data or not. Object data is returned as a list.
+                Determines whether you want object data or not. Object data is returned as a list under 'observed_objects' in the header, and is also kept in client.objects (see tdw_objects.ObjectStore) for lookups by id and spatial queries.
 
             - send_scene_info (bool, default: False)
                 Determines whether or not to send scene info, icluding objects in the scene
+
+            - frame_names (list, default: ['images', 'normals', 'objects'])
+                Names of the frames following the json header in every reply, in the order the environment sends them.
+
+            - frame_shape (tuple or dict, default: None)
+                Shape (height, width, channels) of raw frames, or a dict of frame name -> shape. Frames whose payload matches the shape are returned as arrays of that shape, all others as flat uint8 arrays of the received bytes.
+
+            - codec (str or codec, default: 'json')
+                Codec to offer the environment when joining. Options: 'json', 'msgpack', 'binary' or any object with name, encode and decode. Messages stay json until the environment accepts the codec in its first reply.
+
+            - queue_codec (str or codec, default: 'json')
+                Codec used for messages to and from the queue. Set to 'json_legacy' for queue servers that still expect messages encoded twice.
+
+            - pipeline_depth (int, default: 1)
+                Number of requests kept in flight to the environment. Above 1 the environment is driven through a DEALER socket, every message is tagged with a sequence number and replies are handed back in the order the requests were sent (see submit_action and collect_frames).
+
+            - ctx (zmq.Context, default: None)
+                Context to create sockets with, a new one when left blank. Share one context between clients when running many of them in one process.
+
+            - timeout (float, default: None)
+                Seconds to wait for any reply before raising TDWTimeoutError, forever when left blank. Can be overridden per call. After a timeout the socket is closed and recreated, so the client is usable again right away.
+
+            - reconnect_attempts (int, default: 5)
+                Number of times reconnect tries to rejoin the saved port.
+
+            - reconnect_backoff (float, default: 0.5)
+                Seconds to wait before the second reconnect attempt, doubled after every further failure.
+
+            - reconnect_timeout (float, default: 10.0)
+                Seconds the environment has to answer each reconnect attempt.
+
+            - metrics (Metrics or bool, default: None)
+                Records per message type counts, bytes, serialization time and round trip latency histograms (see tdw_metrics.Metrics). True creates a Metrics instance, available as client.metrics. Nothing is recorded when left blank.
+
+            - scene_cache (SceneCache or bool, default: None)
+                With send_scene_info, keeps the scene of the environment (see tdw_scene_cache.SceneCache) and asks it for changes only, once the full scene was received on join. The current scene is available as client.scene. True creates a cache for this client, pass one SceneCache to share it between clients.
+
+            - transport (str, default: 'auto')
+                How to reach the environment after joining over tcp. Options: 'tcp', 'ipc' (an ipc:// socket named by the environment), 'shm' (ipc, plus frames placed in shared memory with only their descriptors sent; frames are copied out of it on receipt, straight into out when given) or 'auto' (offers ipc when the host is this machine). shm is only used when asked for. Environments that do not support the offered transports keep using tcp.
+
+            - session_file (str, default: None)
+                File to keep the session in: queue, port, build, config hash and last scene of the environment, saved once the first reply after creating or joining arrives (and by save_session). When the file names an environment that is still running with the same config and build, run reattaches to it right away instead of creating or joining one (see resume_session).
+
+            - session_timeout (float, default: 1.0)
+                Seconds the queue and then the environment each have to answer when reattaching to a saved session, before falling back to creating or joining an environment.
+
+            - interactive (bool, default: None)
+                Whether the client may ask the user through menus and prompts, and prints its banners. When false, anything the client would have asked for (a build, username, description or command not given) raises TDWInputError, replies of unexpected types raise TDWRequestError instead of waiting for enter, and the menu libraries (pick, tabulate) are never imported. When left blank, interactive if stdin is a terminal.
+
+            - frame_encoding (str or dict, default: None)
+                Encoding to ask the environment to send frames in: 'raw', 'lz4', 'zstd', 'lossless' (the best of those installed) or 'jpeg' (lossy), or a dict with 'encoding', 'quality' (jpeg, 1 to 100), 'scale' (e.g. 0.5 for half the height and width) and 'roi' ([y, x, height, width] to crop before scaling). Pass a dict of frame name -> encoding to set each frame on its own, e.g. {'images': 'jpeg', 'objects': 'lz4'}; keep lossy encodings off frames holding ids. Frames arrive decoded, cropped and scaled frames with the shape named by the environment. Environments that do not support an encoding send the frame raw (see tdw_compression).
         """
 
         # initialize attributes
-        self.queue_host_address = host_address
-        self.queue_port_number = queue_port_num
+        # subsystems only some clients use (queues, objects, scene cache,
+        # sessions, termination, status feed) are imported where used
+        from tdw_queues import parse_queues
+        self.queue_hosts = parse_queues(host_address, queue_port_num)
+        self.queue_host_address, self.queue_port_number = self.queue_hosts[0]
+        self.queue_loads = None
         self.port_num = requested_port_num
         self.selected_build = selected_build
         self.selected_forward = selected_forward
         self.environment_config = environment_config
         self.initial_command = initial_command
         if username is None:
-            username = os.environ['USER']
+            # prompted for, or TDWInputError when not interactive, once needed
+            username = tdw_protocol.default_username()
         self.username = username
         self.description = description
         self.num_frames_per_msg = num_frames_per_msg
@@ -83,20 +164,69 @@ class TDW_Client(object):
         self.send_scene_info = send_scene_info
         self.debug = debug
         self.environment_profile = environment_profile
-
-        self.ctx = zmq.Context()
-
-        print "\n\n"
-        print '=' * 60
-        print " " * 17, "WELCOME TO 3D WORLD CLIENT"
-        print '=' * 60
-        print "\n"
+        self.frame_names = tdw_frames.frame_names_for(num_frames_per_msg,
+                                                      frame_names)
+        self.frame_shapes = tdw_frames.frame_shapes_for(self.frame_names,
+                                                        frame_shape)
+        self.frame_encodings = tdw_compression.frame_encoding_options(
+            frame_encoding, self.frame_names)
+        self.preferred_codec = tdw_codec.get_codec(codec)
+        self.codec = tdw_codec.get_codec(queue_codec)
+        self.queue_codec = self.codec
+        self.pipeline_depth = max(int(pipeline_depth), 1)
+        self.timeout = timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_backoff = reconnect_backoff
+        self.reconnect_timeout = reconnect_timeout
+        self.stats = LatencyStats()
+        if (metrics is True):
+            metrics = Metrics()
+        self.metrics = metrics or None
+        # (time, message type) of the last message sent, and (bytes, decode
+        # seconds) of the last reply when recording metrics
+        self.last_sent = None
+        self.last_reply = None
+        self.recorder = None
+        self.objects = None
+        if (get_obj_data):
+            from tdw_objects import ObjectStore
+            self.objects = ObjectStore()
+        if (scene_cache is True):
+            from tdw_scene_cache import SceneCache
+            scene_cache = SceneCache()
+        self.scene_cache = scene_cache or None
+        self.scene = None
+        self.transport = transport
+        self.shared_frames = tdw_transport.SharedFrames()
+        # most actions the environment accepts in one CLIENT_INPUT_BATCH,
+        # None if it did not offer batching in its reply to the join
+        self.max_batch = None
+        self.session_file = session_file
+        self.session_timeout = session_timeout
+        # entry of the environment in the active processes of the queue and
+        # the build it runs, as far as known
+        self.session_process = None
+        self.environment_build = None
+        self.save_pending = False
+
+        if (interactive is None):
+            interactive = sys.stdin is not None and sys.stdin.isatty()
+        self.interactive = interactive
+
+        self.ctx = ctx or zmq.Context()
+
+        if (self.interactive):
+            print "\n\n"
+            print '=' * 60
+            print " " * 17, "WELCOME TO 3D WORLD CLIENT"
+            print '=' * 60
+            print "\n"
 
         # connect to queue at requested server
         if (self.debug):
             print ("\nconnecting...")
-        self.sock = self.ctx.socket(zmq.REQ)
-        self.sock.connect("tcp://" + self.queue_host_address + ":" + self.queue_port_number)
+        self.endpoint = "tcp://" + self.queue_host_address + ":" + self.queue_port_number
+        self.sock = self.new_socket(zmq.REQ, self.endpoint)
         if (self.debug):
             print "...connected @", self.queue_host_address, ":", self.queue_port_number, "\n\n"
 
@@ -105,6 +235,7 @@ class TDW_Client(object):
         self.manually_pick_port_num = not auto_select_port
         self.ready_for_input = True
         self.ready_for_recv = False
+        self.reset_pipeline()
 
     def run(self):
         """
@@ -116,15 +247,18 @@ class TDW_Client(object):
             "request_join_environment": self.request_join_environment,
         }
 
+        # reattach to the environment of the last session if still running
+        if (self.session_file and not self.ready_for_recv):
+            self.resume_session()
+
         # run initial command if specified
         if (self.initial_command in commands.keys() and not self.ready_for_recv):
             commands[self.initial_command]()
 
         # run commands until waiting for a message
         while(not self.ready_for_recv):
-            title = "Pick a command:"
-            options = commands.keys()
-            option, index = pick(options, title)
+            option = self.pick_option({"title": "Pick a command:",
+                                       "options": commands.keys()})
             commands[option]()
 
         # loop while still connected to the queue
@@ -133,20 +267,18 @@ class TDW_Client(object):
             if (self.ready_for_recv):
                 msg = self.recv_json(self.sock)
 
-                j = json.loads(msg)
-
                 self.ready_for_recv = False
 
             # run commands until waiting for a message
             while(not self.ready_for_recv):
-                title = "Pick a command:"
-                options = commands.keys()
-                option, index = pick(options, title)
+                option = self.pick_option({"title": "Pick a command:",
+                                           "options": commands.keys()})
                 commands[option]()
 
-        print "=" * 60
-        print " " * 19, "Client Setup Complete"
-        print "=" * 60
+        if (self.interactive):
+            print "=" * 60
+            print " " * 19, "Client Setup Complete"
+            print "=" * 60
         return self.sock
 
     ############################################################################
@@ -166,35 +298,285 @@ class TDW_Client(object):
         """
         Attempts to reconnect to saved port number
 
+        Recreates the socket and rejoins, waiting reconnect_timeout seconds
+        for the environment to answer and backing off between attempts. The
+        first observation is then available from recv_frames. With a scene
+        cache the environment only sends the changes to the cached scene.
+
         If succeeds returns True else False
         """
-        try:
-            self.connect_to_port(self.port_num, use_config=False)
-            return True
-        except:
+        delay = self.reconnect_backoff
+        for attempt in range(self.reconnect_attempts):
+            if (attempt > 0):
+                time.sleep(delay)
+                delay *= 2
+            self.stats.reconnects += 1
+            try:
+                self.reset_socket(self.environment_endpoint(self.port_num))
+                self.send_join(use_config=False)
+                if (self.sock.poll(self.reconnect_timeout * 1000, zmq.POLLIN)):
+                    return True
+            except zmq.ZMQError:
+                pass
+        self.stats.reconnect_failures += 1
+        return False
+
+    def resume_session(self):
+        """
+        Reattaches to the environment saved in session_file if the queue
+        still lists it and it runs the current config and build, skipping
+        create and join. The queue and the environment each get
+        session_timeout seconds to answer. With a scene cache the saved scene
+        is cached again, so the environment only sends the changes since.
+        The first observation is then available from recv_frames.
+
+        If succeeds returns True, else False with the client still connected
+        to the queue
+        """
+        import tdw_session
+        from tdw_scene_cache import config_key
+
+        session = tdw_session.load_session(self.session_file)
+        if (session is None):
+            return False
+        queue = (str(session["host"]), str(session["queue_port"]))
+        if (queue not in self.queue_hosts):
+            return False
+        if (session["config_hash"] != config_key(self.environment_config)):
+            return False
+        if (self.selected_build and
+                tdw_protocol.build_name(session["build"] or "") !=
+                tdw_protocol.build_name(self.selected_build)):
+            return False
+        proc = tdw_session.probe_session(session, self.ctx,
+                                         self.session_timeout,
+                                         self.queue_codec)
+        if (proc is None):
+            if (self.debug):
+                print "saved session is gone, starting a new one"
             return False
 
-    def killall(self, username):
-        msg = json.dumps({"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}})
-        self.send_json(msg, self.sock)
-        msg = self.recv_json(self.sock)
-        msg = json.loads(msg)
+        previous = (self.queue_host_address, self.queue_port_number,
+                    self.port_num)
+        self.queue_host_address, self.queue_port_number = queue
+        port_num = str(session["port_num"])
+        if (self.scene_cache is not None and session["scene"] is not None):
+            self.scene_cache.store(port_num, self.environment_config,
+                                   session["scene"], session["scene_version"])
+        self.connect_to_port(port_num, use_config=False)
+        self.session_process = proc
+        self.environment_build = session["build"]
+        if (self.sock.poll(self.session_timeout * 1000, zmq.POLLIN)):
+            self.ready_for_recv = True
+            return True
 
-        if msg["msg"]["msg_type"] == "ACTIVE_PROCESSES":
-            pass
-        else:
-            print "Error: " + msg["msg"]["msg_type"] + "\n"
-            self.press_enter_to_continue()
+        # listed but not answering, go back to the queue
+        self.queue_host_address, self.queue_port_number, self.port_num = previous
+        self.session_process = None
+        self.environment_build = None
+        self.save_pending = False
+        self.sock.close(linger=0)
+        self.endpoint = ("tcp://" + self.queue_host_address + ":" +
+                         self.queue_port_number)
+        self.sock = self.new_socket(zmq.REQ, self.endpoint)
+        self.reset_pipeline()
+        self.codec = self.queue_codec
+        self.connected_to_queue = True
+        return False
+
+    def save_session(self):
+        """
+        Saves the connected environment and the current scene to
+        session_file, for resume_session in a later process
+        """
+        import tdw_session, tdw_terminate
+
+        if (self.session_process is None):
+            try:
+                processes = tdw_terminate.active_processes(
+                    self.queue_host_address, self.queue_port_number,
+                    self.ctx, self.session_timeout, self.queue_codec)
+                self.session_process = tdw_session.find_process(processes,
+                                                                self.port_num)
+            except TDWError:
+                # saved without pid and create time, the port, owner and
+                # build still have to match
+                pass
+        session = tdw_session.make_session(
+            self.queue_host_address, self.queue_port_number, self.port_num,
+            self.environment_build, self.environment_config, self.username,
+            self.session_process, self.scene)
+        tdw_session.save_session(self.session_file, session)
+
+    def killall(self, username, deadline=10.0, **filters):
+        """
+        Terminates every environment of username on the server at once and
+        waits up to deadline seconds for the queue to stop listing them.
+        filters narrow the selection, see tdw_terminate.select_processes.
+
+        Returns a tdw_terminate.TerminationResult
+        """
+        import tdw_terminate
+
+        # the queue is asked on a socket of its own, the one of the client
+        # may be connected to an environment by now
+        try:
+            processes = tdw_terminate.active_processes(
+                self.queue_host_address, self.queue_port_number, self.ctx,
+                deadline, self.queue_codec)
+        except TDWRequestError as e:
+            self.request_failed(e.reply)
             return
 
-        print 'The following processes will be killed:'
-        print
-        killproc = [p for p in msg['processes'] if p['env_owner'] == username]
-        self.print_processes(killproc)
+        killproc = tdw_terminate.select_processes(processes,
+                                                  owner=username, **filters)
+        if (self.interactive):
+            print 'The following processes will be killed:'
+            print
+            self.print_processes(killproc)
+
+        # every environment gets a socket of its own as well
+        result = tdw_terminate.terminate_environments(
+            self.queue_host_address, killproc, self.queue_port_number,
+            deadline, ctx=self.ctx, queue_codec=self.queue_codec)
+        if (result.remaining and self.interactive):
+            print "Still running after %s seconds:" % deadline
+            self.print_processes(result.remaining)
+        return result
+
+    def send_action(self, action=None):
+        """
+        Sends one input message to the connected environment, the keys of
+        action are added to the message. Returns the sequence number of the
+        message when pipelining, else None
+        """
+        msg = tdw_protocol.input_message(self.num_frames_per_msg, action,
+                                         get_obj_data=self.get_obj_data,
+                                         send_scene_info=self.send_scene_info,
+                                         **self.scene_options())
+        return self.send_to_environment(msg)
+
+    def recv_frames(self, out=None, timeout=None):
+        """
+        Receives one reply from the connected environment
+
+        Returns a dict with the parsed json header under 'info' and one numpy
+        array per frame name. The arrays are views onto the received buffers,
+        nothing is copied. If out is a dict of preallocated arrays, the frames
+        named in it are written into those arrays instead.
 
-        for proc in killproc:
-            self.connect_to_port(proc['port_num'], use_config=False)
-            self.send_json({'n': 0, 'msg': {'msg_type': 'TERMINATE'}})
+        When pipelining this returns the reply to the oldest request still
+        outstanding, see collect_frames.
+
+        Raises TDWTimeoutError if nothing arrives within timeout seconds
+        (default: the timeout of the client).
+        """
+        if (self.pipeline_depth > 1):
+            return self.collect_frames(out, timeout)[1]
+        obs = self.recv_reply(out, timeout)
+        if (self.awaiting_replies):
+            self.awaiting_replies.popleft()
+        self.record_reply(self.last_sent)
+        self.update_state(obs)
+        return obs
+
+    def step(self, action=None, out=None, timeout=None):
+        """
+        Sends an action and returns the observation it produced, see
+        send_action and recv_frames
+        """
+        self.send_action(action)
+        return self.recv_frames(out, timeout)
+
+    def step_batch(self, actions, out=None, timeout=None):
+        """
+        Sends several actions in one request and returns the observations
+        they produced stacked along a new first axis, the headers of the
+        steps listed under info['steps']. out works as in recv_frames, with
+        room for len(actions) rows.
+
+        Environments that did not accept batching when joining are stepped
+        once per action instead (pipelined if pipeline_depth allows), with
+        the same result. See tdw_batching.BatchTuner to pick the batch size.
+        """
+        actions = list(actions)
+        if (self.max_batch and len(actions) <= self.max_batch):
+            msg = tdw_protocol.input_batch_message(
+                self.num_frames_per_msg, actions,
+                get_obj_data=self.get_obj_data,
+                send_scene_info=self.send_scene_info,
+                **self.scene_options())
+            self.send_to_environment(msg)
+            return self.recv_frames(out, timeout)
+        if (self.max_batch):
+            raise ValueError("%d actions exceed the batch size of %d accepted "
+                             "by the environment" % (len(actions), self.max_batch))
+
+        steps = []
+        for start in range(0, len(actions), self.pipeline_depth):
+            for action in actions[start:start + self.pipeline_depth]:
+                self.send_action(action)
+            for action in actions[start:start + self.pipeline_depth]:
+                steps.append(self.recv_frames(timeout=timeout))
+        obs = tdw_frames.stack_observations(steps, self.frame_names, out)
+        obs["info"] = {"batch": len(steps),
+                       "steps": [step["info"] for step in steps]}
+        return obs
+
+    def submit_action(self, action=None):
+        """
+        Sends an action without waiting for its reply and returns its sequence
+        number. Blocks only while pipeline_depth requests are already in
+        flight.
+        """
+        return self.send_action(action)
+
+    def collect_frames(self, out=None, timeout=None):
+        """
+        Returns (sequence number, observation) for the oldest request whose
+        reply has not been collected yet, receiving and buffering replies that
+        arrive out of order until it is available
+        """
+        if (not self.undelivered):
+            raise RuntimeError("no requests in flight")
+
+        seq = self.undelivered[0]
+        while (seq not in self.pending_replies):
+            self.buffer_reply(timeout)
+        self.undelivered.popleft()
+        obs = self.pending_replies.pop(seq)
+        self.update_state(obs)
+
+        if (out is not None):
+            # replies to step_batch fill the first info['batch'] rows of out
+            batch = obs["info"].get("batch")
+            for name in out:
+                if (name not in obs):
+                    continue
+                if (batch is None):
+                    obs[name] = tdw_frames.copy_frame_into(obs[name],
+                                                           out[name])
+                else:
+                    dst = out[name][:batch]
+                    for i, frame in enumerate(obs[name]):
+                        tdw_frames.copy_frame_into(frame, dst[i])
+                    obs[name] = dst
+        return seq, obs
+
+    def attach_recorder(self, recorder):
+        """
+        Hands every reply received from the environment to recorder (see
+        tdw_recorder.TrajectoryRecorder) as soon as it is unpacked. None
+        detaches the current one.
+        """
+        self.recorder = recorder
+
+    def in_flight(self):
+        """
+        Number of requests sent to the environment whose reply has not been
+        received yet
+        """
+        return len(self.awaiting_replies)
 
     ############################################################################
     #                            COMMANDS TO QUEUE                             #
@@ -204,9 +586,13 @@ class TDW_Client(object):
         """
         Requests to make an environment
         """
-        print '_' * 60
-        print " " * 16, "Requesting Create Environment"
-        print '_' * 60, "\n"
+        if (self.interactive):
+            print '_' * 60
+            print " " * 16, "Requesting Create Environment"
+            print '_' * 60, "\n"
+
+        if (len(self.queue_hosts) > 1 and not self.select_queue()):
+            return
 
         # select a port number if not already specified
         if (not self.port_num):
@@ -216,48 +602,40 @@ class TDW_Client(object):
         # loop until open port number is selected
         has_valid_port_num = False
         while (not has_valid_port_num):
-            msg = json.dumps({"msg": {"msg_type": "CREATE_ENVIRONMENT_1"},
-                             "port_num": str(self.port_num)})
+            msg = {"msg": {"msg_type": "CREATE_ENVIRONMENT_1"},
+                   "port_num": str(self.port_num)}
             self.send_json(msg, self.sock)
             msg = self.recv_json(self.sock)
 
-            msg = json.loads(msg)
-
             if (msg["msg"]["msg_type"] == "PORT_UNAVAILABLE"):
                 self.pick_new_port_num()
             elif (msg["msg"]["msg_type"] == "SEND_OPTIONS"):
                 has_valid_port_num = True
             else:
-                print "Error: " + msg["msg"]["msg_type"] + "\n"
-                self.press_enter_to_continue()
+                self.request_failed(msg)
                 return
 
-        # reformat options
-        refmt_options = []
-        for option in msg['options']:
-            i = option.rfind('/')
-            if i < 0:
-                i = 0
-            refmt_options += [option[i+1:]]
-
         # pick option
-        build_option = self.pick_option({'title': msg['title'],
-                                         'options': sorted(refmt_options)},
-                                        default_choice=self.selected_build)
-
-        for opt in msg['options']:
-            if opt.endswith(build_option):
-                build_option = opt
+        build_names = [tdw_protocol.build_name(option) for option in msg['options']]
+        build_name = self.pick_option({'title': msg['title'],
+                                       'options': sorted(build_names)},
+                                      default_choice=self.selected_build)
+        build_option = tdw_protocol.match_build(msg['options'], build_name)
+        if (build_option is None):
+            raise TDWError("build '%s' is not available on the server"
+                           % build_name)
 
         # phase 2
         username, description = self.username, self.description
 
         # collect username and description if not given in initialization
         while (not username):
+            self.require_interactive("username")
             print "\nPlease type a username:"
             username = raw_input()
             print ""
         while (not description):
+            self.require_interactive("description")
             print "\nPlease type a description:"
             description = raw_input()
             print ""
@@ -265,70 +643,61 @@ class TDW_Client(object):
         # loop until has open port number on server
         has_valid_port_num = False
         while (not has_valid_port_num):
-            base_msg = {"msg": {"msg_type": "CREATE_ENVIRONMENT_2"},
-                        "port_num": str(self.port_num),
-                        "selected_build": build_option,
-                        "username": username,
-                        "description": description}
-            msg = base_msg.copy()
-
-            # add config
-            if (self.environment_profile):
-                msg.update(self.environment_profile)
-
             # request environment
-            msg = json.dumps(msg)
+            msg = tdw_protocol.create_message(self.port_num, build_option,
+                                              username, description,
+                                              self.environment_profile)
             self.send_json(msg, self.sock)
 
             # receive environment port number
             msg = self.recv_json(self.sock)
 
-            msg = json.loads(msg)
-
             if (msg["msg"]["msg_type"] == "PORT_UNAVAILABLE"):
                 self.pick_new_port_num()
             elif (msg["msg"]["msg_type"] == "JOIN_OFFER"):
                 has_valid_port_num = True
             else:
-                print "Error: " + msg["msg"]["msg_type"] + "\n"
-                self.press_enter_to_continue()
+                self.request_failed(msg)
                 return
 
         # connect at received port
         self.port_num = msg["port_num"]
+        self.session_process = None
+        self.environment_build = build_option
         self.connect_to_port(msg["port_num"])
 
         self.ready_for_recv = True
 
-        print "=" * 60
+        if (self.interactive):
+            print "=" * 60
 
     def request_join_environment(self):
         """
         Requests to join active environment process
         """
-        print '_' * 60
-        print " " * 16, "Requesting Join Environment"
-        print '_' * 60, "\n"
+        if (self.interactive):
+            print '_' * 60
+            print " " * 16, "Requesting Join Environment"
+            print '_' * 60, "\n"
 
         # phase 1
         # send join request
-        msg = json.dumps({"msg": {"msg_type": "JOIN_ENVIRONMENT_1"}})
+        msg = {"msg": {"msg_type": "JOIN_ENVIRONMENT_1"}}
         self.send_json(msg, self.sock)
 
         # wait for environment options
         msg = self.recv_json(self.sock)
 
-        msg = json.loads(msg)
-
         if (msg["msg"]["msg_type"] == "NO_AVAILABLE_ENVIRONMENTS"):
+            if (not self.interactive):
+                raise TDWRequestError("NO_AVAILABLE_ENVIRONMENTS", msg)
             print "No available environments on server!"
             self.press_enter_to_continue()
             return
         elif (msg["msg"]["msg_type"] == "SEND_OPTIONS"):
             has_valid_port_num = True
         else:
-            print "Error: " + msg["msg"]["msg_type"] + "\n"
-            self.press_enter_to_continue()
+            self.request_failed(msg)
             return
 
         # pick option
@@ -336,18 +705,18 @@ class TDW_Client(object):
 
         # phase 2
         # send selected option
-        msg = json.dumps({"msg": {"msg_type": "JOIN_ENVIRONMENT_2"},
-                          "selected": option})
+        msg = {"msg": {"msg_type": "JOIN_ENVIRONMENT_2"},
+               "selected": option}
         self.send_json(msg, self.sock)
 
         # wait for selected options port number
         # (and eventually also confimation that selected option is still online)
         msg = self.recv_json(self.sock)
 
-        msg = json.loads(msg)
-
         # handle if environment goes offline after picking environment
         if (msg["msg"]["msg_type"] == "ENVIRONMENT_UNAVAILABLE"):
+            if (not self.interactive):
+                raise TDWRequestError("ENVIRONMENT_UNAVAILABLE", msg)
             print "Environment no longer available! Look for a new environment? (y/n)"
             while True:
                 ans = raw_input()
@@ -361,44 +730,57 @@ class TDW_Client(object):
         elif (msg["msg"]["msg_type"] == "JOIN_OFFER"):
             pass
         else:
-            print "Error: " + msg["msg"]["msg_type"] + "\n"
-            self.press_enter_to_continue()
+            self.request_failed(msg)
             return
 
         # connect to received port number
         self.port_num = msg["port_num"]
+        self.session_process = None
+        self.environment_build = None
         self.connect_to_port(msg["port_num"], use_config=False)
 
         self.ready_for_recv = True
 
-        print "=" * 60, "\n"
+        if (self.interactive):
+            print "=" * 60, "\n"
 
     def request_active_processes(self):
         """
-        Request to display the relevant info for the environments on the server
+        Request to display the relevant info for the environments on the
+        server, returns the list of process entries
         """
-        print '_' * 60
-        print " " * 16, "Requesting Active Processes"
-        print '_' * 60
-        print ""
+        if (self.interactive):
+            print '_' * 60
+            print " " * 16, "Requesting Active Processes"
+            print '_' * 60
+            print ""
 
-        msg = json.dumps({"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}})
+        msg = {"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}}
         self.send_json(msg, self.sock)
 
         msg = self.recv_json(self.sock)
 
-        msg = json.loads(msg)
-
         if (msg["msg"]["msg_type"] == "ACTIVE_PROCESSES"):
             pass
         else:
-            print "Error: " + msg["msg"]["msg_type"] + "\n"
-            self.press_enter_to_continue()
+            self.request_failed(msg)
             return
 
-        self.print_processes(msg["processes"])
+        if (self.interactive):
+            self.print_processes(msg["processes"])
+            self.press_enter_to_continue()
+        return msg["processes"]
 
-        self.press_enter_to_continue()
+    def status_feed(self, **kwargs):
+        """
+        Returns a StatusFeed (not started) keeping the active processes of
+        the queue up to date on sockets of its own, see tdw_status_feed
+        """
+        from tdw_status_feed import StatusFeed
+        kwargs.setdefault("ctx", self.ctx)
+        kwargs.setdefault("queue_codec", self.queue_codec)
+        return StatusFeed(self.queue_host_address, self.queue_port_number,
+                          **kwargs)
 
     ############################################################################
     #                             HELPER FUNCTIONS                             #
@@ -406,31 +788,290 @@ class TDW_Client(object):
 
     def send_json(self, msg, sock):
         """
-        Send and receive functions
+        Send and receive functions, messages are encoded with the current codec
         """
         if (self.debug):
             print "\n", ">" * 20
             print "sending message..."
-        sock.send_json(msg)
+        msg_type = msg.get("msg", {}).get("msg_type")
+        if (self.metrics is None):
+            data = self.codec.encode(msg)
+        else:
+            start = time.time()
+            data = self.codec.encode(msg)
+            self.metrics.record("send", msg_type, len(data),
+                                time.time() - start)
+        if (sock.type == zmq.DEALER):
+            # empty delimiter frame expected by the REP/ROUTER on the other end
+            sock.send_multipart(["", data])
+        else:
+            sock.send(data)
+        self.last_sent = (time.time(), msg_type)
         if (self.debug):
             print "...message sent:\n", msg
             print ">" * 20
 
-    def recv_json(self, sock):
+    def recv_json(self, sock, timeout=None):
         if (self.debug):
             print "\n", "<" * 20
             print "waiting for message..."
-        msg = sock.recv_json()
+        self.wait_for_reply(sock, timeout)
+        data = sock.recv()
+        if (self.metrics is None):
+            msg = self.codec.decode(data)
+        else:
+            start = time.time()
+            msg = self.codec.decode(data)
+            self.last_reply = (len(data), time.time() - start)
+        self.record_reply(self.last_sent)
         if (self.debug):
             print "...message received:\n", msg
             print "<" * 20
         return msg
 
+    def send_to_environment(self, msg):
+        """
+        Sends a message to the connected environment
+
+        When pipelining, waits for a reply first if pipeline_depth requests
+        are already in flight, then tags the message with the next sequence
+        number and returns it
+        """
+        if (self.next_endpoint is not None and not self.awaiting_replies):
+            # both endpoints lead to the same environment, the socket is
+            # idle so nothing is lost by moving it
+            self.sock.disconnect(self.endpoint)
+            self.sock.connect(self.next_endpoint)
+            self.endpoint = self.next_endpoint
+            self.next_endpoint = None
+
+        if (self.pipeline_depth == 1):
+            self.send_json(msg, self.sock)
+            self.awaiting_replies.append(None)
+            return None
+
+        while (len(self.awaiting_replies) >= self.pipeline_depth):
+            self.buffer_reply()
+
+        seq = self.next_seq
+        self.next_seq += 1
+        msg["seq"] = seq
+        self.send_json(msg, self.sock)
+        self.send_times[seq] = self.last_sent
+        self.awaiting_replies.append(seq)
+        self.undelivered.append(seq)
+        return seq
+
+    def recv_reply(self, out=None, timeout=None):
+        """
+        Receives and unpacks one multipart reply from the environment,
+        switching to the codec the environment accepted if it names one
+        """
+        if (self.debug):
+            print "\n", "<" * 20
+            print "waiting for frames..."
+        self.wait_for_reply(self.sock, timeout)
+        frames = self.sock.recv_multipart(copy=False)
+        if (self.sock.type == zmq.DEALER):
+            frames = frames[1:]
+        if (self.debug):
+            print "...received", len(frames), "frames"
+            print "<" * 20
+        if (self.metrics is None):
+            obs = tdw_frames.unpack_frames(frames, self.frame_names,
+                                           self.frame_shapes, out,
+                                           self.codec.decode,
+                                           self.shared_frames)
+        else:
+            start = time.time()
+            obs = tdw_frames.unpack_frames(frames, self.frame_names,
+                                           self.frame_shapes, out,
+                                           self.codec.decode,
+                                           self.shared_frames)
+            self.last_reply = (sum(len(frame) for frame in frames),
+                               time.time() - start)
+
+        self.codec = tdw_protocol.accepted_codec(obs["info"], self.codec,
+                                                 self.preferred_codec)
+        if ("max_batch" in obs["info"]):
+            self.max_batch = obs["info"]["max_batch"]
+        endpoint = tdw_transport.accepted_endpoint(obs["info"])
+        if (endpoint is not None and endpoint != self.endpoint):
+            self.next_endpoint = endpoint
+        if (self.recorder is not None):
+            self.recorder.record(obs)
+        return obs
+
+    def buffer_reply(self, timeout=None):
+        """
+        Receives one reply while pipelining and stores it under its sequence
+        number. Environments that do not echo 'seq' answer in order, so
+        untagged replies belong to the oldest request awaiting one.
+        """
+        if (not self.awaiting_replies):
+            raise RuntimeError("no requests in flight")
+        obs = self.recv_reply(timeout=timeout)
+        seq = obs["info"].get("seq")
+        if (seq not in self.awaiting_replies):
+            seq = self.awaiting_replies[0]
+        self.awaiting_replies.remove(seq)
+        self.pending_replies[seq] = obs
+        self.record_reply(self.send_times.pop(seq))
+
+    def record_reply(self, sent):
+        """
+        Records the round trip of a reply to the message sent as sent, a
+        (time, message type) pair
+        """
+        sent_time, msg_type = sent
+        latency = time.time() - sent_time
+        self.stats.record(latency)
+        if (self.metrics is not None):
+            nbytes, seconds = self.last_reply
+            self.metrics.record("recv", msg_type, nbytes, seconds, latency)
+
+    def update_state(self, obs):
+        """
+        Updates the object store and the scene from a reply handed to the
+        user, so they follow the order of the requests
+        """
+        for info in obs["info"].get("steps", [obs["info"]]):
+            if (self.objects is not None and "observed_objects" in info):
+                self.objects.update(info["observed_objects"])
+            if (self.scene_cache is not None):
+                self.scene = self.scene_cache.update(self.port_num,
+                                                     self.environment_config,
+                                                     info)
+            elif ("scene_info" in info):
+                self.scene = info["scene_info"]
+        if (self.save_pending):
+            self.save_pending = False
+            self.save_session()
+
+    def join_options(self):
+        """
+        Options of the join message beyond the ones every join carries
+        """
+        options = self.scene_options()
+        options["batching"] = True
+        if (self.frame_encodings is not None):
+            options["frame_encodings"] = self.frame_encodings
+        transports = tdw_transport.offered_transports(self.transport,
+                                                      self.queue_host_address)
+        if (transports):
+            options["transports"] = transports
+        return options
+
+    def scene_options(self):
+        """
+        Options asking the environment for the changes to the cached scene,
+        none (the full scene) when nothing usable is cached
+        """
+        if (not self.send_scene_info or self.scene_cache is None):
+            return {}
+        version = self.scene_cache.version(self.port_num,
+                                           self.environment_config)
+        if (version is None):
+            return {}
+        return {"scene_version": version}
+
+    def reset_pipeline(self):
+        """
+        Forgets all requests in flight and endpoints offered by the
+        environment, used whenever a new socket is set up
+        """
+        self.next_endpoint = None
+        self.next_seq = 0
+        self.awaiting_replies = deque()
+        self.undelivered = deque()
+        self.pending_replies = {}
+        self.send_times = {}
+
+    def wait_for_reply(self, sock, timeout=None):
+        """
+        Waits until sock has a reply to read, at most timeout seconds
+        (default: the timeout of the client, forever if that is None)
+
+        On timeout the socket of the client is recreated, as a REQ socket
+        cannot send again before it received, and TDWTimeoutError is raised
+        """
+        if (timeout is None):
+            timeout = self.timeout
+        if (timeout is None):
+            return
+
+        poller = zmq.Poller()
+        poller.register(sock, zmq.POLLIN)
+        if (poller.poll(timeout * 1000)):
+            return
+
+        self.stats.timeouts += 1
+        if (sock is self.sock):
+            self.reset_socket()
+        raise TDWTimeoutError("no reply from %s after %s seconds"
+                              % (self.endpoint, timeout))
+
+    def reset_socket(self, endpoint=None):
+        """
+        Closes the socket of the client without waiting for unsent messages
+        and connects a new one of the same type to endpoint (default: the
+        current endpoint). Requests in flight are forgotten.
+        """
+        if (endpoint is None):
+            endpoint = self.endpoint
+        sock_type = self.sock.type
+        self.sock.close(linger=0)
+        self.sock = self.new_socket(sock_type, endpoint)
+        self.endpoint = endpoint
+        self.reset_pipeline()
+
+    def new_socket(self, sock_type, endpoint):
+        """
+        Returns a socket of sock_type connected to endpoint. Unsent messages
+        are dropped when it is closed, so a request to a dead environment
+        cannot keep the process from exiting.
+        """
+        sock = self.ctx.socket(sock_type)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(endpoint)
+        return sock
+
+    def select_queue(self):
+        """
+        Probes every queue and connects to the least loaded one, the loads
+        are kept in queue_loads. Returns False if no queue answered.
+        """
+        import tdw_queues
+        self.queue_loads = tdw_queues.probe_queues(
+            self.queue_hosts, self.ctx, self.reconnect_timeout, self.codec)
+        ranked = tdw_queues.rank_queues(self.queue_loads, self.username,
+                                        self.selected_build)
+        if (self.debug):
+            for load in self.queue_loads:
+                print load
+        if (not ranked):
+            if (not self.interactive):
+                raise TDWError("none of the queues %s answered"
+                               % (self.queue_hosts,))
+            print "Error: no queue answered\n"
+            self.press_enter_to_continue()
+            return False
+
+        best = ranked[0]
+        if ((best.host, best.port) != (self.queue_host_address,
+                                        self.queue_port_number)):
+            self.queue_host_address, self.queue_port_number = best.host, best.port
+            self.reset_socket("tcp://" + best.host + ":" + best.port)
+        return True
+
+    def environment_endpoint(self, port_num):
+        return "tcp://" + self.queue_host_address + ":" + str(port_num)
+
     def pick_new_port_num(self):
         """"
         Split function that assigns picking to auto or manual via state
         """
-        if (self.manually_pick_port_num):
+        if (self.manually_pick_port_num and self.interactive):
             self.manual_port_selection()
         else:
             self.automatic_port_selection()
@@ -459,13 +1100,11 @@ class TDW_Client(object):
                 get_port_num = True
                 print ("Not a valid port number, enter a number between 0 and 65535:")
 
-        self.send_json(json.dumps({"msg": {"msg_type": "CHECK_PORT"},
-                                   "port_num": x}), self.sock)
+        self.send_json({"msg": {"msg_type": "CHECK_PORT"},
+                        "port_num": x}, self.sock)
 
         msg = self.recv_json(self.sock)
 
-        msg = json.loads(msg)
-
         if (not msg["status"]):
             self.pick_new_port_num()
         else:
@@ -475,20 +1114,34 @@ class TDW_Client(object):
         """
         Requests a free port from the server
         """
-        self.send_json(json.dumps({"msg": {"msg_type": "AUTO_SELECT_PORT"}}),
-                       self.sock)
+        self.send_json({"msg": {"msg_type": "AUTO_SELECT_PORT"}}, self.sock)
 
         msg = self.recv_json(self.sock)
 
-        msg = json.loads(msg)
-
         if (msg["msg"]["msg_type"] == "AUTO_SELECT_PORT"):
             self.port_num = msg["port_num"]
         else:
-            print "Error: " + msg["msg"]["msg_type"] + "\n"
-            self.press_enter_to_continue()
+            self.request_failed(msg)
             return
 
+    def request_failed(self, msg):
+        """
+        Reports a reply of unexpected type: raises TDWRequestError, or prints
+        it and waits for enter when interactive
+        """
+        if (not self.interactive):
+            raise TDWRequestError(msg["msg"]["msg_type"], msg)
+        print "Error: " + msg["msg"]["msg_type"] + "\n"
+        self.press_enter_to_continue()
+
+    def require_interactive(self, what):
+        """
+        Raises TDWInputError if the client may not ask the user for what
+        """
+        if (not self.interactive):
+            raise TDWInputError("%s not given and the client is not "
+                                "interactive" % what)
+
     def press_enter_to_continue(self):
         """
         Displays a bar asking to hit enter to continue, and stalls program until this action is performed
@@ -503,6 +1156,8 @@ class TDW_Client(object):
         """
         Prints process info in a table
         """
+        from tabulate import tabulate
+
         table = list()
         for entry in entries:
             table = table + [[entry["env_owner"], entry["proc_pid"], entry["port_num"], datetime.datetime.fromtimestamp(float(entry["proc_create_time"])).strftime("%Y-%m-%d %H:%M:%S"), entry["env_desc"]]]
@@ -519,6 +1174,8 @@ class TDW_Client(object):
         if default_choice is not None and default_choice in options:
             return default_choice
 
+        self.require_interactive("choice for '%s'" % title)
+        from pick import pick
         option, index = pick(options, title)
 
         return option
@@ -527,36 +1184,55 @@ class TDW_Client(object):
         """
         Attempt to connect to a port, if using a config, sends config with join message
         """
-        self.sock.disconnect("tcp://" + self.queue_host_address + ":" + self.queue_port_number)
-
         self.connected_to_queue = False
 
         if (self.debug):
             print("\nconnecting...")
-        self.sock.connect("tcp://" + self.queue_host_address + ":" + str(port_num))
+        endpoint = self.environment_endpoint(port_num)
+        if (self.pipeline_depth > 1):
+            # a DEALER socket can have several requests in flight at once
+            self.sock.close(linger=0)
+            self.sock = self.new_socket(zmq.DEALER, endpoint)
+        else:
+            self.sock.disconnect(self.endpoint)
+            self.sock.connect(endpoint)
+        self.endpoint = endpoint
+        self.reset_pipeline()
         if (self.debug):
             print "...connected @", self.queue_host_address, ":", port_num, "\n"
 
         self.port_num = port_num
+        self.save_pending = self.session_file is not None
+        self.send_join(use_config)
 
+    def send_join(self, use_config=True):
+        """
+        Sends the join message to the connected environment, with the config
+        if using one. Sending it again on a joined environment resets the
+        scene without relaunching the environment.
+        """
+        # environments speak json until they accept the offered codec
+        self.codec = tdw_codec.JSONCodec()
+        self.max_batch = None
+        config = None
         if (use_config and self.environment_config):
+            config = self.environment_config
+        msg = tdw_protocol.join_message(
+            self.num_frames_per_msg, config,
+            send_scene_info=self.send_scene_info,
+            get_obj_data=self.get_obj_data,
+            codecs=tdw_protocol.offered_codecs(self.preferred_codec),
+            **self.join_options())
+
+        if (config):
             if (self.debug):
                 print "sending with config..."
-            self.sock.send_json({"n": self.num_frames_per_msg,
-                                 "msg": {"msg_type": "CLIENT_JOIN_WITH_CONFIG",
-                                         "config": self.environment_config,
-                                         "send_scene_info":
-                                            self.send_scene_info,
-                                         "get_obj_data": self.get_obj_data}})
+            self.send_to_environment(msg)
             if (self.debug):
                 print "...sent with config\n"
         else:
             if (self.debug):
                 print "sending without config..."
-            self.sock.send_json({"n": self.num_frames_per_msg,
-                                 "msg": {"msg_type": "CLIENT_JOIN",
-                                         "send_scene_info":
-                                             self.send_scene_info,
-                                         "get_obj_data": self.get_obj_data}})
+            self.send_to_environment(msg)
             if (self.debug):
                 print "...sent without config\n"
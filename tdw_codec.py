@@ -0,0 +1,130 @@
+import json, pkgutil
+import numpy as np
+
+# imported by the first msgpack codec created, see _import_msgpack
+msgpack = None
+
+
+# msgpack extension type used by the binary codec for numpy arrays
+NDARRAY_EXT_TYPE = 42
+
+
+class JSONCodec(object):
+    """
+    Encodes every message once as json
+    """
+    name = "json"
+
+    def encode(self, msg):
+        return json.dumps(msg)
+
+    def decode(self, data):
+        msg = json.loads(data)
+        # queues that still double encode send a json string holding the json
+        if (isinstance(msg, basestring)):
+            msg = json.loads(msg)
+        return msg
+
+
+class LegacyJSONCodec(JSONCodec):
+    """
+    Encodes every message as a json string holding the json of the message,
+    for queue servers that still expect the old double encoding
+    """
+    name = "json_legacy"
+
+    def encode(self, msg):
+        return json.dumps(json.dumps(msg))
+
+
+class MsgpackCodec(object):
+    """
+    Encodes messages with msgpack
+    """
+    name = "msgpack"
+
+    def __init__(self):
+        try:
+            _import_msgpack()
+        except ImportError:
+            raise ImportError("the %s codec requires the msgpack package"
+                              % self.name)
+
+    def encode(self, msg):
+        return msgpack.packb(msg, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class BinaryCodec(MsgpackCodec):
+    """
+    Encodes messages with msgpack and sends numpy arrays as raw bytes plus
+    dtype and shape instead of as nested lists
+    """
+    name = "binary"
+
+    def encode(self, msg):
+        return msgpack.packb(msg, use_bin_type=True, default=_pack_ndarray)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False, ext_hook=_unpack_ndarray)
+
+
+CODECS = {
+    JSONCodec.name: JSONCodec,
+    LegacyJSONCodec.name: LegacyJSONCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    BinaryCodec.name: BinaryCodec,
+}
+
+
+def get_codec(codec):
+    """
+    Returns a codec instance given its name, codec instances are returned as
+    they are so that custom codecs can be plugged in
+    """
+    if (not isinstance(codec, basestring)):
+        return codec
+    if (codec not in CODECS):
+        raise ValueError("unknown codec '%s', options: %s"
+                         % (codec, ", ".join(sorted(CODECS))))
+    return CODECS[codec]()
+
+
+def available_codecs():
+    """
+    Returns the names of the codecs whose dependencies are installed
+    """
+    names = [JSONCodec.name, LegacyJSONCodec.name]
+    if (pkgutil.find_loader("msgpack") is not None):
+        names += [MsgpackCodec.name, BinaryCodec.name]
+    return names
+
+
+def _import_msgpack():
+    global msgpack
+    if (msgpack is None):
+        import msgpack as module
+        msgpack = module
+    return msgpack
+
+
+def _pack_ndarray(obj):
+    if (isinstance(obj, np.ndarray)):
+        header = msgpack.packb([obj.dtype.str, list(obj.shape)])
+        data = np.ascontiguousarray(obj).tobytes()
+        return msgpack.ExtType(NDARRAY_EXT_TYPE, header + data)
+    if (isinstance(obj, np.generic)):
+        return obj.item()
+    raise TypeError("cannot encode object of type %s" % type(obj))
+
+
+def _unpack_ndarray(code, data):
+    if (code != NDARRAY_EXT_TYPE):
+        return msgpack.ExtType(code, data)
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(data)
+    dtype, shape = unpacker.unpack()
+    offset = unpacker.tell()
+    return np.frombuffer(data, dtype=dtype, offset=offset).reshape(shape)
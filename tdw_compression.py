@@ -0,0 +1,174 @@
+import io, pkgutil
+import numpy as np
+
+
+# encodings of frames, negotiated per frame when joining
+#   raw:       the bytes of the array, as sent without negotiation
+#   lz4, zstd: the raw bytes compressed, decoded to the same array
+#   jpeg:      lossy, with a quality from 1 to 100
+LOSSLESS_ENCODINGS = ("zstd", "lz4")
+ENCODINGS = ("raw",) + LOSSLESS_ENCODINGS + ("jpeg",)
+FRAME_OPTIONS = ("encoding", "quality", "scale", "roi")
+REQUIREMENTS = {"lz4": "lz4", "zstd": "zstandard", "jpeg": "PIL (pillow)"}
+
+
+def available_encodings():
+    """
+    Names of the encodings this process can decode
+    """
+    # the packages are imported when first encoding or decoding a frame
+    encodings = ["raw"]
+    if (pkgutil.find_loader("lz4") is not None):
+        encodings.append("lz4")
+    if (pkgutil.find_loader("zstandard") is not None):
+        encodings.append("zstd")
+    if (pkgutil.find_loader("PIL") is not None):
+        encodings.append("jpeg")
+    return encodings
+
+
+def frame_options(spec):
+    """
+    Returns the join options of one frame for spec, an encoding name or a
+    dict with 'encoding', 'quality', 'scale' and 'roi', None to have the
+    frame sent as it is
+
+    The encodings are offered in order of preference, followed by raw for
+    environments that support none of them. 'lossless' offers every
+    lossless encoding that can be decoded here.
+    """
+    if (spec is None):
+        return None
+    if (isinstance(spec, basestring)):
+        spec = {"encoding": spec}
+    encoding = spec.get("encoding", "raw")
+    available = available_encodings()
+
+    if (encoding == "lossless"):
+        encodings = [e for e in LOSSLESS_ENCODINGS if e in available]
+    elif (encoding not in ENCODINGS):
+        raise ValueError("unknown frame encoding '%s'" % encoding)
+    elif (encoding not in available):
+        raise ImportError("the %s frame encoding requires the %s package"
+                          % (encoding, REQUIREMENTS[encoding]))
+    else:
+        encodings = [encoding]
+    if ("raw" not in encodings):
+        encodings.append("raw")
+
+    options = {"encodings": encodings}
+    if (encoding == "jpeg"):
+        options["quality"] = int(spec.get("quality", 90))
+    if (spec.get("scale") not in (None, 1, 1.0)):
+        options["scale"] = float(spec["scale"])
+    if (spec.get("roi") is not None):
+        options["roi"] = [int(v) for v in spec["roi"]]
+    if (options == {"encodings": ["raw"]}):
+        return None
+    return options
+
+
+def frame_encoding_options(frame_encoding, names):
+    """
+    Builds the 'frame_encodings' join option, one entry of frame_options
+    per frame in the order of names. frame_encoding is one spec for every
+    frame or a dict of frame name -> spec. Returns None if every frame is
+    sent as it is.
+    """
+    if (frame_encoding is None):
+        return None
+    if (isinstance(frame_encoding, dict) and
+            not set(frame_encoding) & set(FRAME_OPTIONS)):
+        specs = [frame_encoding.get(name) for name in names]
+    else:
+        specs = [frame_encoding] * len(names)
+    options = [frame_options(spec) for spec in specs]
+    if (not any(options)):
+        return None
+    return options
+
+
+def accept_frame_encoding(options, supported=None):
+    """
+    Environment side of the negotiation: returns the first offered encoding
+    in supported (default: the available ones), raw if none is
+    """
+    if (supported is None):
+        supported = available_encodings()
+    for encoding in options.get("encodings", []):
+        if (encoding in supported):
+            return encoding
+    return "raw"
+
+
+def crop_and_scale(frame, roi=None, scale=None):
+    """
+    Crops roi [y, x, height, width] out of frame (height, width, ...) and
+    downscales the crop by scale, picking the nearest pixel. Environments
+    apply crop and scale in this order, so the client receives the same
+    array this returns for the full frame.
+    """
+    if (roi is not None):
+        y, x, height, width = roi
+        frame = frame[y:y + height, x:x + width]
+    if (scale is not None and scale != 1):
+        height, width = frame.shape[:2]
+        rows = (np.arange(max(int(height * scale), 1)) / scale).astype(int)
+        cols = (np.arange(max(int(width * scale), 1)) / scale).astype(int)
+        frame = frame[rows[:, None], cols]
+    return np.ascontiguousarray(frame)
+
+
+def encode_frame(frame, encoding, quality=90):
+    """
+    Encodes the array frame, returns the bytes to send
+    """
+    if (encoding == "raw"):
+        return frame
+    if (encoding == "lz4"):
+        import lz4.frame
+        return lz4.frame.compress(frame)
+    if (encoding == "zstd"):
+        import zstandard
+        return zstandard.ZstdCompressor().compress(frame)
+    if (encoding == "jpeg"):
+        from PIL import Image
+        image = frame
+        if (image.ndim == 3 and image.shape[2] == 1):
+            image = image[:, :, 0]
+        data = io.BytesIO()
+        Image.fromarray(image).save(data, "JPEG", quality=quality)
+        return data.getvalue()
+    raise ValueError("unknown frame encoding '%s'" % encoding)
+
+
+def decode_frame(frame, encoding):
+    """
+    Decodes one received frame (zmq.Frame or any object exposing a buffer)
+    to a flat uint8 array holding the frame the environment encoded
+    """
+    if (encoding == "raw"):
+        return frame
+    data = getattr(frame, "buffer", frame)
+    if (encoding == "lz4"):
+        import lz4.frame
+        return np.frombuffer(lz4.frame.decompress(data), dtype=np.uint8)
+    if (encoding == "zstd"):
+        import zstandard
+        return np.frombuffer(zstandard.ZstdDecompressor().decompress(data),
+                             dtype=np.uint8)
+    if (encoding == "jpeg"):
+        from tdw_decode import decode_image
+        image = decode_image(np.frombuffer(data, dtype=np.uint8))
+        return np.ascontiguousarray(image).reshape(-1)
+    raise ValueError("unknown frame encoding '%s'" % encoding)
+
+
+def decode_frames(frames, encodings):
+    """
+    Decodes the frames of a reply whose header lists 'frame_encodings', one
+    [encoding, shape] per frame name. Batched replies repeat the names once
+    per step, so frame i is encoded as encodings[i % len(encodings)].
+    """
+    return [decode_frame(frame, encodings[i % len(encodings)][0])
+            for i, frame in enumerate(frames)]
@@ -0,0 +1,218 @@
+import io
+from collections import deque
+from multiprocessing.pool import Pool, ThreadPool
+import numpy as np
+
+
+def decode_image(data, out=None):
+    """
+    Decodes one compressed image (png, jpeg or anything else PIL reads) to
+    an array, written into out if it has the decoded shape
+    """
+    from PIL import Image
+    if (isinstance(data, np.ndarray)):
+        data = data.tostring()
+    image = np.asarray(Image.open(io.BytesIO(data)))
+    if (out is not None and out.shape == image.shape and out.dtype == image.dtype):
+        out[...] = image
+        return out
+    return image
+
+
+def _decode_frame(decode, data, slot=None, name=None):
+    """
+    Runs in the pool. With a slot (thread pools) the result is written into
+    the ring buffer array of name, which is adopted from the first decoded
+    frame if not preallocated
+    """
+    if (slot is None):
+        return decode(data)
+    out = slot.get(name)
+    image = decode(data, out)
+    if (image is not out):
+        # arrays adopted as buffers are written into by later decodes
+        if (not image.flags.writeable):
+            image = image.copy()
+        slot[name] = image
+    return image
+
+
+class FrameDecoder(object):
+    """
+    Decodes the compressed frames of observations in a pool of workers while
+    the client keeps stepping
+
+        decoder = FrameDecoder(workers=8)
+        for obs in decoder.stream(client, actions):
+            train_on(obs["images"])
+
+    Frames arrive as flat arrays of encoded bytes (see tdw_frames). Every
+    observation is assigned one slot of a ring buffer of ring_size
+    preallocated arrays per frame name, and its frames are decoded into that
+    slot in parallel. Observations come out in the order they were submitted.
+    An observation handed out stays valid until the next one is requested;
+    copy frames that have to outlive that.
+
+    Threads suit decoders that release the GIL, like the ones of PIL. With
+    processes=True the frames are decoded in worker processes instead, at
+    the cost of copying them there and back.
+    """
+
+    def __init__(self, workers=None, processes=False, ring_size=8,
+                 names=None, shapes=None, dtype=np.uint8, decode=decode_image):
+        """
+        :Kwargs:
+            - workers (int, default: number of cores)
+
+            - processes (bool, default: False)
+                Decode in a process pool instead of a thread pool.
+
+            - ring_size (int, default: 8)
+                Number of observations in flight plus the one last handed out.
+
+            - names (list, default: None)
+                Frames to decode. When left blank every frame still holding encoded bytes is decoded, others are passed through.
+
+            - shapes (dict, default: None)
+                Frame name -> decoded shape, to preallocate the ring buffer. Frames without a shape get arrays on their first decode, which are then reused.
+
+            - decode (function, default: decode_image)
+                decode(data, out=None) returning the decoded array, written into out when possible. Must be picklable with processes=True.
+        """
+        if (ring_size < 2):
+            raise ValueError("ring_size must be at least 2")
+        self.processes = processes
+        if (processes):
+            self.pool = Pool(workers)
+        else:
+            self.pool = ThreadPool(workers)
+        self.ring_size = ring_size
+        self.names = names
+        self.decode = decode
+
+        self.slots = [dict() for _ in range(ring_size)]
+        for name, shape in (shapes or {}).items():
+            for slot in self.slots:
+                slot[name] = np.zeros(shape, dtype=dtype)
+
+        # (slot index, observation, {name: async result}) oldest first, and
+        # the slot of the observation last handed out
+        self.pending = deque()
+        self.next_slot = 0
+        self.delivered = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ############################################################################
+    #                               USER FUNCTIONS                             #
+    ############################################################################
+
+    def submit(self, obs):
+        """
+        Starts decoding the frames of obs. Raises RuntimeError if the ring
+        buffer is full, see full.
+        """
+        if (self.full()):
+            raise RuntimeError("ring buffer full, collect observations first")
+        index = self.next_slot
+        self.next_slot = (self.next_slot + 1) % self.ring_size
+        slot = self.slots[index]
+
+        jobs = {}
+        for name, value in obs.items():
+            if (not self.should_decode(name, value)):
+                continue
+            if (self.processes):
+                args = (self.decode, value.tostring())
+            else:
+                args = (self.decode, value, slot, name)
+            jobs[name] = self.pool.apply_async(_decode_frame, args)
+        self.pending.append((index, obs, jobs))
+
+    def get(self, timeout=None):
+        """
+        Returns the oldest submitted observation once all its frames are
+        decoded. The observation returned before is released.
+        """
+        if (not self.pending):
+            raise RuntimeError("no observations submitted")
+        self.delivered = None
+        index, obs, jobs = self.pending.popleft()
+
+        decoded = dict(obs)
+        slot = self.slots[index]
+        for name, job in jobs.items():
+            image = job.get(timeout)
+            if (self.processes):
+                image = self.store(slot, name, image)
+            decoded[name] = image
+        self.delivered = index
+        return decoded
+
+    def full(self):
+        """
+        Whether every slot is decoding or handed out, get has to be called
+        before the next submit
+        """
+        held = len(self.pending)
+        if (self.delivered is not None):
+            held += 1
+        return held >= self.ring_size
+
+    def in_flight(self):
+        return len(self.pending)
+
+    def imap(self, observations):
+        """
+        Decodes an iterable of observations, yielding them in order while up
+        to ring_size - 1 more are being decoded
+        """
+        for obs in observations:
+            if (len(self.pending) >= self.ring_size - 1):
+                yield self.get()
+            self.submit(obs)
+        while (self.pending):
+            yield self.get()
+
+    def stream(self, client, actions):
+        """
+        Steps client with every action and yields the decoded observations
+        in order, starting with the one waiting after joining. Frames of
+        earlier steps are decoded while the next ones travel over the network.
+        """
+        def observations():
+            yield client.recv_frames()
+            for action in actions:
+                yield client.step(action)
+        return self.imap(observations())
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.pending.clear()
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    def should_decode(self, name, value):
+        if (name == "info" or not isinstance(value, np.ndarray)):
+            return False
+        if (self.names is not None):
+            return name in self.names
+        # raw frames with a known shape are already reshaped
+        return value.ndim == 1
+
+    def store(self, slot, name, image):
+        out = slot.get(name)
+        if (out is None or out.shape != image.shape or out.dtype != image.dtype):
+            if (not image.flags.writeable):
+                image = image.copy()
+            slot[name] = image
+            return image
+        out[...] = image
+        return out
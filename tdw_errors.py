@@ -0,0 +1,31 @@
+class TDWError(Exception):
+    """
+    Base class of the errors raised by the client
+    """
+
+
+class TDWRequestError(TDWError):
+    """
+    Raised when the queue or an environment answers a request with a message
+    type other than the ones expected
+
+    The message type and the full reply are kept as msg_type and reply.
+    """
+    def __init__(self, msg_type, reply=None):
+        TDWError.__init__(self, "Error: " + str(msg_type))
+        self.msg_type = msg_type
+        self.reply = reply
+
+
+class TDWTimeoutError(TDWError):
+    """
+    Raised when the queue or an environment does not answer before the
+    deadline. The socket has already been recreated when this is raised.
+    """
+
+
+class TDWInputError(TDWError):
+    """
+    Raised by clients that are not interactive where they would have asked
+    the user, e.g. to pick a build that was not given
+    """
@@ -0,0 +1,182 @@
+import json
+import numpy as np
+
+import tdw_compression
+
+
+# names given to the frames that follow the json header in a reply, in order
+DEFAULT_FRAME_NAMES = ("images", "normals", "objects")
+
+
+def frame_names_for(num_frames_per_msg, names=None):
+    """
+    Returns the names of the frames that follow the header in a reply made of
+    num_frames_per_msg parts. Frames without a name are called 'frame_<i>'.
+    """
+    if (names is None):
+        names = DEFAULT_FRAME_NAMES
+    count = max(num_frames_per_msg - 1, 0)
+    names = list(names[:count])
+    names += ["frame_%d" % i for i in range(len(names), count)]
+    return names
+
+
+def frame_shapes_for(names, frame_shape):
+    """
+    Expands frame_shape to a dict of name -> shape
+
+    frame_shape can be None, a single shape used for every frame, or a dict
+    """
+    if (frame_shape is None):
+        return {}
+    if (isinstance(frame_shape, dict)):
+        return dict((name, tuple(shape))
+                    for name, shape in frame_shape.items())
+    return dict((name, tuple(frame_shape)) for name in names)
+
+
+def frame_view(frame, shape=None, dtype=np.uint8):
+    """
+    Returns a numpy view onto a frame received with copy=False (or any other
+    object exposing a buffer)
+
+    If shape is given and matches the size of the payload the view is
+    reshaped, otherwise the flat (usually still encoded) bytes are returned.
+    """
+    arr = np.frombuffer(frame, dtype=dtype)
+    if (shape is not None and arr.size == _size_of(shape)):
+        arr = arr.reshape(shape)
+    return arr
+
+
+def parse_header(frame, decode=json.loads):
+    """
+    Parses the header sent as the first frame of every reply, json unless
+    another decode function is given
+    """
+    return decode(getattr(frame, "bytes", frame))
+
+
+def unpack_frames(frames, names, shapes=None, out=None, decode=json.loads,
+                  shared=None):
+    """
+    Turns the parts of one multipart reply into an observation dict
+
+    The parsed header is stored under 'info' and every other frame under its
+    name as a numpy view onto the received buffer. When out holds an array
+    for a frame, the frame is written into that array instead and the array
+    is returned in its place.
+
+    Headers with 'shm_frames' descriptors come without frames, the frames
+    are then read from shared memory through shared (see
+    tdw_transport.SharedFrames) and copied, as the environment overwrites
+    them a few replies later.
+
+    Frames sent in a negotiated encoding or cropped and scaled (header with
+    'frame_encodings', see tdw_compression) are decoded first and take the
+    shapes named in the header.
+
+    Replies to a batch of actions (header with 'batch') are unpacked with
+    unpack_batch.
+    """
+    info = parse_header(frames[0], decode)
+    # frames of received messages stay valid as long as they are referenced
+    stable = True
+    if (shared is not None and "shm_frames" in info):
+        frames = [frames[0]] + shared.frames(info["shm_frames"])
+        stable = False
+    if ("frame_encodings" in info):
+        encodings = info["frame_encodings"]
+        frames = [frames[0]] + tdw_compression.decode_frames(frames[1:],
+                                                             encodings)
+        shapes = dict(shapes or {})
+        for name, (encoding, shape) in zip(names, encodings):
+            shapes[name] = tuple(shape)
+    if ("batch" in info):
+        return unpack_batch(info, frames[1:], names, shapes, out, stable)
+    if (len(frames) != len(names) + 1):
+        raise ValueError("expected %d frames, received %d"
+                         % (len(names) + 1, len(frames)))
+    if (shapes is None):
+        shapes = {}
+
+    obs = {"info": info}
+    for name, frame in zip(names, frames[1:]):
+        if (out is not None and name in out):
+            obs[name] = copy_frame_into(frame, out[name])
+        else:
+            obs[name] = frame_view(frame, shapes.get(name))
+            if (not stable):
+                obs[name] = obs[name].copy()
+    return obs
+
+
+def unpack_batch(info, frames, names, shapes=None, out=None, stable=True):
+    """
+    Unpacks the frames of a reply to info['batch'] actions, sent step by
+    step in the order of names, into one array per name stacked along a new
+    first axis. Rows are written into out[name] when given, which needs room
+    for at least that many steps. The headers of the steps are listed in
+    info['steps']. Frames that are not stable, like shared memory views,
+    are copied.
+    """
+    count = info["batch"]
+    if (len(frames) != count * len(names)):
+        raise ValueError("expected %d frames, received %d"
+                         % (count * len(names), len(frames)))
+    if (shapes is None):
+        shapes = {}
+
+    steps = []
+    for i in range(count):
+        step = {}
+        for j, name in enumerate(names):
+            step[name] = frame_view(frames[i * len(names) + j], shapes.get(name))
+        steps.append(step)
+    obs = stack_observations(steps, names, out)
+    for name in names:
+        if (not stable and isinstance(obs[name], list)):
+            # stacked arrays are copies already
+            obs[name] = [frame.copy() for frame in obs[name]]
+    obs["info"] = info
+    return obs
+
+
+def stack_observations(steps, names, out=None):
+    """
+    Stacks the frames of several observations into one array per name,
+    written into out[name][:len(steps)] when given. Frames whose shapes
+    differ between steps are kept as a list.
+    """
+    obs = {}
+    for name in names:
+        frames = [step[name] for step in steps]
+        if (out is not None and name in out):
+            dst = out[name][:len(frames)]
+            for i, frame in enumerate(frames):
+                copy_frame_into(frame, dst[i])
+            obs[name] = dst
+        elif (len(set(frame.shape for frame in frames)) == 1):
+            obs[name] = np.stack(frames)
+        else:
+            obs[name] = frames
+    return obs
+
+
+def copy_frame_into(frame, dst):
+    """
+    Writes the payload of a frame into the preallocated array dst
+    """
+    src = np.frombuffer(frame, dtype=dst.dtype)
+    if (src.size != dst.size):
+        raise ValueError("frame holds %d values, destination holds %d"
+                         % (src.size, dst.size))
+    np.copyto(dst, src.reshape(dst.shape))
+    return dst
+
+
+def _size_of(shape):
+    size = 1
+    for dim in shape:
+        size *= dim
+    return size
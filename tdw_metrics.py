@@ -0,0 +1,197 @@
+import time, bisect, logging
+from collections import deque
+import numpy as np
+
+
+class LatencyStats(object):
+    """
+    Counts timeouts and reconnects and keeps the latencies of the most recent
+    replies, in seconds
+    """
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.reconnect_failures = 0
+
+    def record(self, latency):
+        self.latencies.append(latency)
+        self.count += 1
+        self.total += latency
+        if (latency > self.max):
+            self.max = latency
+
+    def summary(self):
+        """
+        Returns the counters and latency percentiles over the recent window
+        as a dict
+        """
+        summary = {"count": self.count,
+                   "mean": self.total / self.count if self.count else 0.0,
+                   "max": self.max,
+                   "timeouts": self.timeouts,
+                   "reconnects": self.reconnects,
+                   "reconnect_failures": self.reconnect_failures}
+        if (self.latencies):
+            p50, p90, p99 = np.percentile(self.latencies, [50, 90, 99])
+        else:
+            p50 = p90 = p99 = 0.0
+        summary.update({"p50": p50, "p90": p90, "p99": p99})
+        return summary
+
+
+# upper bounds of the round trip latency histogram buckets, in seconds:
+# 100us doubling up to ~52s, plus an overflow bucket
+LATENCY_BUCKETS = [1e-4 * 2 ** i for i in range(20)]
+
+
+class MessageTypeMetrics(object):
+    """
+    Counters of one message type
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.encode_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.latency_count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_hist = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def snapshot(self):
+        latency = {"count": self.latency_count,
+                   "mean": (self.latency_total / self.latency_count
+                            if self.latency_count else 0.0),
+                   "max": self.latency_max,
+                   "p50": self.percentile(50),
+                   "p90": self.percentile(90),
+                   "p99": self.percentile(99),
+                   "buckets": [(bound, count) for bound, count
+                               in zip(LATENCY_BUCKETS + [float("inf")],
+                                      self.latency_hist) if count]}
+        return {"sent": self.sent,
+                "received": self.received,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "encode_seconds": self.encode_seconds,
+                "decode_seconds": self.decode_seconds,
+                "latency": latency}
+
+    def percentile(self, q):
+        """
+        Upper bound of the histogram bucket holding the q-th percentile
+        """
+        if (not self.latency_count):
+            return 0.0
+        rank = q / 100.0 * self.latency_count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_hist):
+            seen += count
+            if (seen >= rank):
+                return bound
+        return self.latency_max
+
+
+class Metrics(object):
+    """
+    Per message type counts, bytes, serialization time and round trip latency
+    histograms of a client
+
+    Attach one with TDW_Client(metrics=Metrics()). Clients without metrics
+    skip all of this, so it costs nothing when disabled.
+
+    Callbacks added with add_callback are called with a dict describing
+    every message sent or received (direction, msg_type, bytes, seconds spent
+    encoding or decoding, latency for replies and time), for forwarding to a
+    profiler. With log_interval set, a summary line is logged at most every
+    log_interval seconds.
+    """
+
+    def __init__(self, log_interval=None, logger=None):
+        self.types = {}
+        self.callbacks = []
+        self.log_interval = log_interval
+        self.logger = logger or logging.getLogger("tdw_client")
+        self.started = time.time()
+        self.last_log = self.started
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def record(self, direction, msg_type, nbytes, seconds, latency=None):
+        """
+        Records one message. direction is 'send' or 'recv', seconds the time
+        spent encoding or decoding it and latency the round trip time of a
+        reply. Replies are counted under the type of the request they answer.
+        """
+        metrics = self.types.get(msg_type)
+        if (metrics is None):
+            metrics = self.types[msg_type] = MessageTypeMetrics()
+
+        if (direction == "send"):
+            metrics.sent += 1
+            metrics.bytes_sent += nbytes
+            metrics.encode_seconds += seconds
+        else:
+            metrics.received += 1
+            metrics.bytes_received += nbytes
+            metrics.decode_seconds += seconds
+        if (latency is not None):
+            metrics.latency_count += 1
+            metrics.latency_total += latency
+            if (latency > metrics.latency_max):
+                metrics.latency_max = latency
+            metrics.latency_hist[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+        now = time.time()
+        if (self.callbacks):
+            event = {"direction": direction,
+                     "msg_type": msg_type,
+                     "bytes": nbytes,
+                     "seconds": seconds,
+                     "latency": latency,
+                     "time": now}
+            for callback in self.callbacks:
+                callback(event)
+        if (self.log_interval is not None and
+                now - self.last_log >= self.log_interval):
+            self.last_log = now
+            self.logger.info(self.log_line())
+
+    def snapshot(self):
+        """
+        Returns all counters as a dict of message type -> counters
+        """
+        return {"uptime": time.time() - self.started,
+                "types": dict((msg_type, metrics.snapshot())
+                              for msg_type, metrics in self.types.items())}
+
+    def log_line(self):
+        """
+        Returns a one line summary: messages, bytes and p50/p99 latency in
+        milliseconds per message type
+        """
+        parts = []
+        for msg_type in sorted(self.types, key=str):
+            metrics = self.types[msg_type]
+            parts.append("%s sent=%d recv=%d bytes=%d/%d p50=%.1fms p99=%.1fms"
+                         % (msg_type, metrics.sent, metrics.received,
+                            metrics.bytes_sent, metrics.bytes_received,
+                            metrics.percentile(50) * 1e3,
+                            metrics.percentile(99) * 1e3))
+        return "; ".join(parts)
+
+    def reset(self):
+        self.types = {}
+        self.started = self.last_log = time.time()
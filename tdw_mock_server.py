@@ -0,0 +1,601 @@
+"""
+Local stand-in for the 3D World queue and environments
+
+Speaks the protocol TDW_Client uses (CREATE_ENVIRONMENT_1/2,
+JOIN_ENVIRONMENT_1/2, GET_ACTIVE_ENVIRONMENTS, AUTO_SELECT_PORT, CHECK_PORT,
+CLIENT_JOIN(_WITH_CONFIG), CLIENT_INPUT and TERMINATE) and answers every
+environment message with synthetic frames of a configurable size, so the
+client can be tested and benchmarked without render nodes. Frames are noise
+by default, or with --pattern scene flat shapes on gradients that compress
+about as well as rendered frames.
+
+    python tdw_mock_server.py --port 23402 --frame-shape 256 256 3
+
+or from python:
+
+    with MockQueue(port=23402) as queue:
+        client = TDW_Client("127.0.0.1", selected_build=MockQueue.BUILD, ...)
+"""
+import os, time, argparse, tempfile, threading
+from collections import deque
+import numpy as np
+import zmq
+
+import tdw_codec
+import tdw_compression
+
+
+class MockEnvironment(object):
+    """
+    One environment answering on a ROUTER socket, so both REQ and DEALER
+    (pipelined) clients are served. Replies echo the 'seq' of the request.
+    """
+
+    def __init__(self, port, frame_shape=(64, 64, 3), fps=None, host="127.0.0.1",
+                 owner="", description="", ctx=None, num_objects=0,
+                 pattern="noise"):
+        self.port = port
+        self.frame_shape = tuple(frame_shape)
+        self.pattern = pattern
+        self.fps = fps
+        self.num_objects = num_objects
+        self.owner = owner
+        self.description = description
+        self.created = time.time()
+        self.ctx = ctx or zmq.Context.instance()
+        self.endpoint = "tcp://%s:%d" % (host, port)
+        self.running = False
+        self.thread = None
+        self.steps = 0
+        self.frames = {}
+        # scene sent to clients asking for scene info, rebuilt on joins with
+        # a config, and the changes of recent steps to send as deltas
+        self.scene = None
+        self.scene_version = 0
+        self.scene_history = deque(maxlen=64)
+        # transports accepted in the last join: the ipc endpoint bound next to
+        # the tcp one, and the shared memory ring frames are written to
+        self.ipc_endpoint = None
+        self.use_shm = False
+        self.shm = None
+        self.shm_path = None
+        self.shm_slots = 8
+        self.replies = 0
+        self.max_batch = 64
+        # (encoding, quality, roi, scale) per frame accepted in the last join,
+        # None to send raw frames
+        self.frame_encodings = None
+
+    def start(self):
+        self.sock = self.ctx.socket(zmq.ROUTER)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.sock.bind(self.endpoint)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if (self.thread is not None and
+                self.thread is not threading.current_thread()):
+            self.thread.join()
+
+    def frame(self, index):
+        """
+        Returns the synthetic frame sent as pass index, created on first use
+        """
+        if (index not in self.frames):
+            rng = np.random.RandomState(index)
+            if (self.pattern == "scene"):
+                self.frames[index] = self.scene_frame(rng)
+            else:
+                self.frames[index] = rng.randint(0, 256, self.frame_shape).astype(np.uint8)
+        return self.frames[index]
+
+    def scene_frame(self, rng):
+        """
+        Gradient background with a few flat boxes
+        """
+        height, width = self.frame_shape[:2]
+        channels = self.frame_shape[2] if len(self.frame_shape) > 2 else 1
+        frame = np.empty((height, width, channels), dtype=np.float32)
+        rows = np.linspace(0, 1, height)[:, None]
+        cols = np.linspace(0, 1, width)[None, :]
+        for c in range(channels):
+            frame[:, :, c] = 255 * (rng.rand() * rows + rng.rand() * cols) / 2
+        for _ in range(8):
+            y, x = rng.randint(0, height), rng.randint(0, width)
+            frame[y:y + rng.randint(1, height // 2 + 2),
+                  x:x + rng.randint(1, width // 2 + 2)] = rng.randint(0, 256, channels)
+        return np.clip(frame, 0, 255).astype(np.uint8).reshape(self.frame_shape)
+
+    def serve(self):
+        codec = tdw_codec.JSONCodec()
+        num_frames = 4
+        interval = 1.0 / self.fps if self.fps else 0.0
+        last_reply = 0.0
+
+        while (self.running):
+            if (not self.sock.poll(100, zmq.POLLIN)):
+                continue
+            parts = self.sock.recv_multipart()
+            ident, data = parts[0], parts[-1]
+            msg = self.decode(codec, data)
+            msg_type = msg["msg"]["msg_type"]
+            reply_codec = codec
+
+            if (msg_type in ("CLIENT_JOIN", "CLIENT_JOIN_WITH_CONFIG")):
+                # joins are answered in json, naming the accepted codec
+                header = {"msg_type": msg_type, "step": self.steps}
+                if (msg_type == "CLIENT_JOIN_WITH_CONFIG"):
+                    self.scene = None
+                codec, name = self.accept_codec(msg["msg"].get("codecs"))
+                if (name is not None):
+                    header["codec"] = name
+                self.accept_transports(header, msg["msg"].get("transports", []))
+                self.accept_frame_encodings(msg["msg"].get("frame_encodings"))
+                if (msg["msg"].get("batching")):
+                    header["max_batch"] = self.max_batch
+                if (msg["msg"].get("get_obj_data")):
+                    header["observed_objects"] = self.observed_objects()
+                if (msg["msg"].get("send_scene_info")):
+                    self.add_scene(header, msg["msg"])
+                reply_codec = tdw_codec.JSONCodec()
+            elif (msg_type == "TERMINATE"):
+                self.running = False
+                self.sock.send_multipart([ident, "", tdw_codec.JSONCodec().encode(
+                    {"msg_type": msg_type})])
+                break
+            elif (msg_type == "CLIENT_INPUT_BATCH"):
+                # one step per action, answered with the frames of every step
+                steps = [self.step(msg["msg"]) for _ in msg["msg"]["actions"]]
+                header = {"msg_type": msg_type, "step": self.steps,
+                          "batch": len(steps), "steps": steps}
+                if (msg["msg"].get("send_scene_info")):
+                    self.add_scene(steps[-1], msg["msg"])
+            else:
+                header = self.step(msg["msg"])
+                if (msg["msg"].get("send_scene_info")):
+                    self.add_scene(header, msg["msg"])
+
+            num_frames = msg.get("n", num_frames)
+            if ("seq" in msg):
+                header["seq"] = msg["seq"]
+
+            if (interval):
+                wait = last_reply + interval - time.time()
+                if (wait > 0):
+                    time.sleep(wait)
+                last_reply = time.time()
+
+            frames = [self.frame(i) for i in range(max(num_frames - 1, 0))]
+            if (self.frame_encodings is not None):
+                frames = self.encode_frames(header, frames)
+            frames *= header.get("batch", 1)
+            if (self.use_shm):
+                header["shm_frames"] = self.write_shared(frames)
+                frames = []
+            reply = [ident, "", reply_codec.encode(header)] + frames
+            self.sock.send_multipart(reply, copy=False)
+
+        self.sock.close()
+        self.shm = None
+        if (self.shm_path is not None and os.path.exists(self.shm_path)):
+            os.remove(self.shm_path)
+
+    def step(self, msg):
+        """
+        Advances the environment by one step, returns the header of the step
+        """
+        self.steps += 1
+        header = {"msg_type": "CLIENT_INPUT", "step": self.steps}
+        if (self.scene is not None):
+            self.advance_scene()
+        if (msg.get("get_obj_data")):
+            header["observed_objects"] = self.observed_objects()
+        return header
+
+    def accept_transports(self, header, offered):
+        if ("ipc" in offered):
+            if (self.ipc_endpoint is None):
+                self.ipc_endpoint = "ipc://%s/tdw_mock_%d" % (
+                    tempfile.gettempdir(), self.port)
+                self.sock.bind(self.ipc_endpoint)
+            header["ipc_endpoint"] = self.ipc_endpoint
+        self.use_shm = "shm" in offered
+
+    def accept_frame_encodings(self, offered):
+        self.frame_encodings = None
+        if (not offered):
+            return
+        self.frame_encodings = []
+        for options in offered:
+            if (options is None):
+                self.frame_encodings.append(None)
+                continue
+            self.frame_encodings.append((
+                tdw_compression.accept_frame_encoding(options),
+                options.get("quality", 90), options.get("roi"),
+                options.get("scale")))
+
+    def encode_frames(self, header, frames):
+        """
+        Crops, scales and encodes frames as accepted in the join, naming the
+        encoding and decoded shape of every frame in the header
+        """
+        encoded = []
+        header["frame_encodings"] = []
+        for i, frame in enumerate(frames):
+            encoding = "raw"
+            if (i < len(self.frame_encodings) and self.frame_encodings[i]):
+                encoding, quality, roi, scale = self.frame_encodings[i]
+                frame = tdw_compression.crop_and_scale(frame, roi, scale)
+                data = tdw_compression.encode_frame(frame, encoding, quality)
+                if (encoding != "raw"):
+                    data = np.frombuffer(data, dtype=np.uint8)
+                encoded.append(data)
+            else:
+                encoded.append(frame)
+            header["frame_encodings"].append([encoding, list(frame.shape)])
+        return encoded
+
+    def write_shared(self, frames):
+        """
+        Writes frames into the next slot of the shared memory ring, returns
+        their [path, offset, size] descriptors
+        """
+        size = sum(frame.nbytes for frame in frames)
+        if (self.shm is None or len(self.shm) < size * self.shm_slots):
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            self.shm_path = os.path.join(directory, "tdw_mock_%d" % self.port)
+            self.shm = np.memmap(self.shm_path, dtype=np.uint8, mode="w+",
+                                 shape=(max(size, 1) * self.shm_slots,))
+
+        offset = (self.replies % self.shm_slots) * size
+        self.replies += 1
+        descriptors = []
+        for frame in frames:
+            self.shm[offset:offset + frame.nbytes] = frame.reshape(-1)
+            descriptors.append([self.shm_path, offset, frame.nbytes])
+            offset += frame.nbytes
+        return descriptors
+
+    def observed_objects(self):
+        """
+        Objects in the layout of tdw_objects.OBJECT_DTYPE, every other one
+        moving along a circle as the environment steps
+        """
+        objects = []
+        for i in range(self.num_objects):
+            static = i % 2 == 0
+            angle = 0.0 if static else 0.1 * self.steps + i
+            objects.append(["object_%d" % i, i + 1,
+                            [float(i % 100) + np.cos(angle), 0.0,
+                             float(i // 100) + np.sin(angle)],
+                            [0.0, 0.0, 0.0, 1.0],
+                            [0.0, 0.0, 0.0] if static else [-np.sin(angle), 0.0, np.cos(angle)],
+                            static])
+        return objects
+
+    def add_scene(self, header, msg):
+        """
+        Adds the scene to a reply header, as the changes since the
+        'scene_version' of the request when the recent history covers it
+        """
+        if (self.scene is None):
+            self.scene = {"environment_scene": msg.get("config", {}).get(
+                              "environment_scene", "Empty"),
+                          "step": self.steps,
+                          "objects": dict((obj[0], {"id": obj[1],
+                                                    "position": obj[2],
+                                                    "static": obj[5]})
+                                          for obj in self.observed_objects())}
+            self.scene_version += 1
+            self.scene_history.clear()
+
+        base = msg.get("scene_version")
+        oldest = self.scene_version
+        if (self.scene_history):
+            oldest = self.scene_history[0][0] - 1
+        if (base is None or not oldest <= base <= self.scene_version):
+            header["scene_info"] = self.scene
+            header["scene_version"] = self.scene_version
+            return
+
+        changes = {}
+        for version, step_changes in self.scene_history:
+            if (version > base):
+                for path, value in step_changes:
+                    changes[tuple(path)] = value
+        header["scene_delta"] = {"base": base,
+                                 "version": self.scene_version,
+                                 "set": [[list(path), value]
+                                         for path, value in changes.items()]}
+
+    def advance_scene(self):
+        changes = [[["step"], self.steps]]
+        for obj in self.observed_objects():
+            if (not obj[5]):
+                changes.append([["objects", obj[0], "position"], obj[2]])
+        self.scene["step"] = self.steps
+        for path, value in changes[1:]:
+            self.scene["objects"][path[1]]["position"] = value
+        self.scene_version += 1
+        self.scene_history.append((self.scene_version, changes))
+
+    def decode(self, codec, data):
+        try:
+            return codec.decode(data)
+        except Exception:
+            # joins arrive as json even after another codec was accepted
+            return tdw_codec.JSONCodec().decode(data)
+
+    def accept_codec(self, offered):
+        for name in offered or []:
+            if (name in tdw_codec.available_codecs()):
+                return tdw_codec.get_codec(name), name
+        return tdw_codec.JSONCodec(), None
+
+
+class MockQueue(object):
+    """
+    The queue, answering on a ROUTER socket and launching MockEnvironments
+    in threads of the same process
+
+    CREATE_ENVIRONMENT_2 is answered launch_delay seconds later without
+    blocking other requests, like a build taking time to load. With
+    status_feed, environments added and removed are published on a PUB
+    socket named in the reply to GET_STATUS_FEED (see tdw_status_feed).
+    With list_builds, active processes also name their 'selected_build',
+    which the standard process table does not. Without answer_unknown,
+    messages the queue does not know are left unanswered.
+    """
+
+    BUILD = "mock.x86_64"
+
+    def __init__(self, host="127.0.0.1", port=23402, first_env_port=None,
+                 builds=None, frame_shape=(64, 64, 3), fps=None,
+                 launch_delay=0.0, legacy_json=False, num_objects=0,
+                 status_feed=True, pattern="noise", list_builds=False,
+                 answer_unknown=True):
+        self.host = host
+        self.port = int(port)
+        if (first_env_port is None):
+            first_env_port = self.port + 1
+        self.first_env_port = first_env_port
+        self.builds = builds or ["builds/" + self.BUILD]
+        self.frame_shape = tuple(frame_shape)
+        self.fps = fps
+        self.launch_delay = launch_delay
+        self.num_objects = num_objects
+        self.status_feed = status_feed
+        self.pattern = pattern
+        self.list_builds = list_builds
+        self.answer_unknown = answer_unknown
+        self.feed_version = 0
+        if (legacy_json):
+            self.codec = tdw_codec.LegacyJSONCodec()
+        else:
+            self.codec = tdw_codec.JSONCodec()
+
+        self.ctx = zmq.Context()
+        self.environments = {}
+        self.delayed = []
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.sock = self.ctx.socket(zmq.ROUTER)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.sock.bind("tcp://%s:%d" % (self.host, self.port))
+        self.feed = None
+        if (self.status_feed):
+            self.feed = self.ctx.socket(zmq.PUB)
+            self.feed.setsockopt(zmq.LINGER, 0)
+            self.feed.bind("tcp://%s:*" % self.host)
+            self.feed_port = int(self.feed.getsockopt(zmq.LAST_ENDPOINT).rsplit(":", 1)[1])
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if (self.thread is not None):
+            self.thread.join()
+        for env in self.environments.values():
+            env.stop()
+        self.environments = {}
+
+    ############################################################################
+    #                            QUEUE MESSAGES                                #
+    ############################################################################
+
+    def serve(self):
+        while (self.running):
+            now = time.time()
+            for reply in [r for r in self.delayed if r[0] <= now]:
+                self.delayed.remove(reply)
+                self.send(reply[1], reply[2])
+
+            wait = 100
+            if (self.delayed):
+                wait = max(min(r[0] for r in self.delayed) - now, 0) * 1000
+            if (not self.sock.poll(wait, zmq.POLLIN)):
+                # terminated environments disappear without a request
+                self.collect_terminated()
+                continue
+            ident, empty, data = self.sock.recv_multipart()
+            msg = self.codec.decode(data)
+            reply = self.handle(msg)
+            if (isinstance(reply, tuple)):
+                self.delayed.append((time.time() + reply[0], ident, reply[1]))
+            elif (reply is not None):
+                self.send(ident, reply)
+        self.sock.close()
+        if (self.feed is not None):
+            self.feed.close()
+
+    def send(self, ident, reply):
+        self.sock.send_multipart([ident, "", self.codec.encode(reply)])
+
+    def handle(self, msg):
+        """
+        Returns the reply to a queue message, or (delay, reply) for replies
+        sent later
+        """
+        self.collect_terminated()
+        msg_type = msg["msg"]["msg_type"]
+
+        if (msg_type == "AUTO_SELECT_PORT"):
+            return {"msg": {"msg_type": "AUTO_SELECT_PORT"},
+                    "port_num": self.free_port()}
+
+        if (msg_type == "CHECK_PORT"):
+            return {"msg": {"msg_type": "CHECK_PORT"},
+                    "status": self.port_available(int(msg["port_num"]))}
+
+        if (msg_type == "CREATE_ENVIRONMENT_1"):
+            if (not self.port_available(int(msg["port_num"]))):
+                return {"msg": {"msg_type": "PORT_UNAVAILABLE"}}
+            return {"msg": {"msg_type": "SEND_OPTIONS"},
+                    "title": "Pick a build:",
+                    "options": self.builds}
+
+        if (msg_type == "CREATE_ENVIRONMENT_2"):
+            port = int(msg["port_num"])
+            if (not self.port_available(port)):
+                return {"msg": {"msg_type": "PORT_UNAVAILABLE"}}
+            if (msg["selected_build"] not in self.builds):
+                return {"msg": {"msg_type": "BUILD_UNAVAILABLE"}}
+            env = MockEnvironment(port, self.frame_shape, self.fps,
+                                  host=self.host,
+                                  owner=msg.get("username", ""),
+                                  description=msg.get("description", ""),
+                                  ctx=self.ctx,
+                                  num_objects=self.num_objects,
+                                  pattern=self.pattern)
+            env.build = msg["selected_build"]
+            env.start()
+            self.environments[port] = env
+            self.publish("added", env)
+            reply = {"msg": {"msg_type": "JOIN_OFFER"}, "port_num": port}
+            if (self.launch_delay):
+                return (self.launch_delay, reply)
+            return reply
+
+        if (msg_type == "JOIN_ENVIRONMENT_1"):
+            if (not self.environments):
+                return {"msg": {"msg_type": "NO_AVAILABLE_ENVIRONMENTS"}}
+            return {"msg": {"msg_type": "SEND_OPTIONS"},
+                    "title": "Pick an environment:",
+                    "options": [self.option(env) for env
+                                in sorted(self.environments.values(),
+                                          key=lambda e: e.port)]}
+
+        if (msg_type == "JOIN_ENVIRONMENT_2"):
+            for env in self.environments.values():
+                if (self.option(env) == msg["selected"]):
+                    return {"msg": {"msg_type": "JOIN_OFFER"},
+                            "port_num": env.port}
+            return {"msg": {"msg_type": "ENVIRONMENT_UNAVAILABLE"}}
+
+        if (msg_type == "GET_ACTIVE_ENVIRONMENTS"):
+            return {"msg": {"msg_type": "ACTIVE_PROCESSES"},
+                    "processes": [self.process(env) for env
+                                  in self.environments.values()],
+                    "version": self.feed_version}
+
+        if (msg_type == "GET_STATUS_FEED" and self.feed is not None):
+            return {"msg": {"msg_type": "STATUS_FEED"},
+                    "port_num": self.feed_port}
+
+        if (not self.answer_unknown):
+            return None
+        return {"msg": {"msg_type": "UNKNOWN_MESSAGE"}}
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    def option(self, env):
+        return "%d: %s" % (env.port, env.description)
+
+    def process(self, env):
+        proc = {"env_owner": env.owner,
+                "proc_pid": os.getpid(),
+                "port_num": env.port,
+                "proc_create_time": str(env.created),
+                "env_desc": env.description}
+        if (self.list_builds):
+            proc["selected_build"] = env.build
+        return proc
+
+    def port_available(self, port):
+        return port != self.port and port not in self.environments
+
+    def free_port(self):
+        port = self.first_env_port
+        while (not self.port_available(port)):
+            port += 1
+        return port
+
+    def collect_terminated(self):
+        for port, env in list(self.environments.items()):
+            if (not env.running):
+                env.stop()
+                del self.environments[port]
+                self.publish("removed", env)
+
+    def publish(self, event, env):
+        self.feed_version += 1
+        if (self.feed is not None):
+            self.feed.send(self.codec.encode({"event": event,
+                                              "version": self.feed_version,
+                                              "process": self.process(env)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=23402)
+    parser.add_argument("--frame-shape", type=int, nargs=3, default=[64, 64, 3])
+    parser.add_argument("--fps", type=float, default=None,
+                        help="maximum replies per second per environment")
+    parser.add_argument("--launch-delay", type=float, default=0.0,
+                        help="seconds before CREATE_ENVIRONMENT_2 is answered")
+    parser.add_argument("--objects", type=int, default=0,
+                        help="objects reported to clients asking for object data")
+    parser.add_argument("--pattern", default="noise", choices=["noise", "scene"],
+                        help="content of the synthetic frames")
+    parser.add_argument("--no-status-feed", action="store_true",
+                        help="answer GET_STATUS_FEED as an unknown message")
+    parser.add_argument("--legacy-json", action="store_true",
+                        help="encode queue messages twice like older queues")
+    args = parser.parse_args()
+
+    queue = MockQueue(args.host, args.port, frame_shape=args.frame_shape,
+                      fps=args.fps, launch_delay=args.launch_delay,
+                      legacy_json=args.legacy_json, num_objects=args.objects,
+                      status_feed=not args.no_status_feed,
+                      pattern=args.pattern)
+    queue.start()
+    print "mock queue listening on %s:%d" % (args.host, args.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        queue.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import numpy as np
+
+
+# layout of one entry of 'observed_objects' in replies to get_obj_data:
+# [name, id, position xyz, rotation quaternion xyzw, velocity xyz, is static]
+OBJECT_DTYPE = np.dtype([("id", np.int64),
+                         ("position", np.float32, 3),
+                         ("rotation", np.float32, 4),
+                         ("velocity", np.float32, 3),
+                         ("static", np.bool_),
+                         ("present", np.bool_),
+                         ("updated", np.int64)])
+
+
+class ObjectStore(object):
+    """
+    Columnar state of the objects reported with get_obj_data
+
+    Objects live in the rows of one structured array (see OBJECT_DTYPE),
+    looked up by id through a dict, and rows are overwritten in place by
+    every update. Columns are available as arrays, so queries run over all
+    objects at once:
+
+        store.get(42)["position"]
+        store.nearest([0, 0, 0], k=5)
+        store.in_region([-1, 0, -1], [1, 2, 1])
+        store.changed()
+
+    Objects missing from an update keep their row with present set to
+    False and are left out of queries, so ids always map to the same row.
+    """
+
+    def __init__(self, capacity=1024):
+        self.rows = np.zeros(capacity, dtype=OBJECT_DTYPE)
+        self.names = [None] * capacity
+        self.size = 0
+        self.row_of = {}
+        self.step = 0
+        # ids of the last update in the order they arrived, and their rows,
+        # to skip the id lookup when the environment repeats the order
+        self.last_ids = None
+        self.last_rows = None
+
+    def __len__(self):
+        return int(np.count_nonzero(self.rows["present"][:self.size]))
+
+    def __contains__(self, object_id):
+        row = self.row_of.get(object_id)
+        return row is not None and self.rows["present"][row]
+
+    ############################################################################
+    #                               USER FUNCTIONS                             #
+    ############################################################################
+
+    def update(self, objects, step=None):
+        """
+        Writes the entries of an 'observed_objects' list into their rows,
+        adding rows for new ids. Returns the rows updated.
+        """
+        if (step is None):
+            step = self.step + 1
+        self.step = step
+
+        self.rows["present"][:self.size] = False
+        if (not objects):
+            self.last_ids = self.last_rows = None
+            return np.zeros(0, dtype=np.int64)
+
+        names, ids, position, rotation, velocity, static = zip(*objects)
+        ids = np.array(ids, dtype=np.int64)
+        if (self.last_ids is not None and np.array_equal(ids, self.last_ids)):
+            rows = self.last_rows
+        else:
+            rows = self.rows_for(ids, names)
+            self.last_ids, self.last_rows = ids, rows
+
+        position = np.array(position, dtype=np.float32)
+        rotation = np.array(rotation, dtype=np.float32)
+        moved = (np.any(self.rows["position"][rows] != position, axis=1) |
+                 np.any(self.rows["rotation"][rows] != rotation, axis=1))
+        # rows just added count as changed
+        moved |= self.rows["updated"][rows] == 0
+
+        self.rows["position"][rows] = position
+        self.rows["rotation"][rows] = rotation
+        self.rows["velocity"][rows] = velocity
+        self.rows["static"][rows] = static
+        self.rows["present"][rows] = True
+        self.rows["updated"][rows[moved]] = step
+        return rows
+
+    def row(self, object_id):
+        """
+        Returns the row of an object, raises KeyError for unknown ids
+        """
+        return self.row_of[object_id]
+
+    def get(self, object_id):
+        """
+        Returns the record of an object, a view onto its row that later
+        updates write into until the store grows
+        """
+        return self.rows[self.row_of[object_id]]
+
+    def name(self, object_id):
+        return self.names[self.row_of[object_id]]
+
+    @property
+    def ids(self):
+        return self.active()["id"]
+
+    def active(self):
+        """
+        Returns the records of the objects present in the last update, copied
+        """
+        live = self.rows[:self.size]
+        return live[live["present"]]
+
+    def nearest(self, point, k=1, static=None):
+        """
+        Returns the ids of the k objects closest to point, closest first.
+        static restricts the search to static (True) or moving (False)
+        objects.
+        """
+        rows = self.select(static=static)
+        if (len(rows) == 0):
+            return np.zeros(0, dtype=np.int64)
+        offset = self.rows["position"][rows] - np.asarray(point, dtype=np.float32)
+        dist = np.einsum("ij,ij->i", offset, offset)
+        k = min(k, len(rows))
+        closest = np.argpartition(dist, k - 1)[:k]
+        closest = closest[np.argsort(dist[closest])]
+        return self.rows["id"][rows[closest]]
+
+    def in_region(self, low, high, static=None):
+        """
+        Returns the ids of the objects whose position lies inside the axis
+        aligned box from low to high
+        """
+        rows = self.select(static=static)
+        position = self.rows["position"][rows]
+        inside = np.all((position >= low) & (position <= high), axis=1)
+        return self.rows["id"][rows[inside]]
+
+    def changed(self, since=None):
+        """
+        Returns the ids of the objects whose position or rotation changed in
+        updates after step since (default: in the last update)
+        """
+        if (since is None):
+            since = self.step - 1
+        rows = self.select()
+        updated = self.rows["updated"][rows] > since
+        return self.rows["id"][rows[updated]]
+
+    def clear(self):
+        self.rows[:] = 0
+        self.names = [None] * len(self.rows)
+        self.size = 0
+        self.row_of = {}
+        self.step = 0
+        self.last_ids = self.last_rows = None
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    def rows_for(self, ids, names):
+        """
+        Returns the rows of ids, adding rows for ids seen for the first time
+        """
+        rows = np.empty(len(ids), dtype=np.int64)
+        for i, object_id in enumerate(ids.tolist()):
+            row = self.row_of.get(object_id)
+            if (row is None):
+                row = self.add(object_id, names[i])
+            rows[i] = row
+        return rows
+
+    def add(self, object_id, name):
+        if (self.size == len(self.rows)):
+            self.grow(2 * len(self.rows))
+        row = self.size
+        self.size += 1
+        self.rows["id"][row] = object_id
+        self.names[row] = name
+        self.row_of[object_id] = row
+        return row
+
+    def grow(self, capacity):
+        rows = np.zeros(capacity, dtype=OBJECT_DTYPE)
+        rows[:self.size] = self.rows[:self.size]
+        self.rows = rows
+        self.names += [None] * (capacity - len(self.names))
+
+    def select(self, static=None):
+        present = self.rows["present"][:self.size]
+        if (static is not None):
+            present = present & (self.rows["static"][:self.size] == static)
+        return np.flatnonzero(present)
@@ -0,0 +1,331 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import zmq
+
+import tdw_terminate
+from tdw_provision import provision_environments
+from tdw_errors import TDWError
+
+
+class EnvironmentPool(object):
+    """
+    Keeps environments created, joined and idle so jobs can start on one
+    right away instead of waiting for a build to launch
+
+        pool = EnvironmentPool(host, 8, "<build_name>.x86_64", "eval")
+        pool.start()
+        with pool.lease() as client:
+            obs = client.recv_frames()
+            obs = client.step(action)
+
+    A leased client is in the same state as after TDW_Client.run(): its
+    first observation is waiting in recv_frames. On return the scene is reset
+    by sending the join message with the config again instead of terminating
+    the environment. Environments that do not answer the reset in time, or
+    stay idle longer than max_idle, are terminated and replaced. A reaper
+    thread started by start checks the idle environments every
+    check_interval seconds, so idle and dead ones are found without waiting
+    for the next lease.
+    """
+
+    def __init__(self, host_address, size, selected_build, description,
+                 min_size=None, max_idle=None, health_timeout=30.0,
+                 check_interval=5.0, **kwargs):
+        """
+        :Args:
+            host_address (str)
+            size (int)
+                Number of environments created by start and kept warm.
+            selected_build (str)
+            description (str)
+
+        :Kwargs:
+            - min_size (int, default: size)
+                Environments evicted for being idle are only replaced while the pool holds fewer than this. Leasing from a pool below size creates environments on demand.
+
+            - max_idle (float, default: None)
+                Seconds after which an idle environment is evicted, never when left blank.
+
+            - health_timeout (float, default: 30.0)
+                Seconds an environment has to answer a reset before it is considered unhealthy.
+
+            - check_interval (float, default: 5.0)
+                Seconds between the checks of the reaper thread, which evicts environments idle longer than max_idle, environments that did not answer their reset within health_timeout and environments their queue no longer lists. No thread is started when left blank.
+
+            Any other keyword is passed to every TDW_Client.
+        """
+        self.host_address = host_address
+        self.size = size
+        if (min_size is None):
+            min_size = size
+        self.min_size = min_size
+        self.selected_build = selected_build
+        self.description = description
+        self.max_idle = max_idle
+        self.health_timeout = health_timeout
+        self.check_interval = check_interval
+        self.client_kwargs = kwargs
+
+        # idle holds (client, idle since) pairs, oldest first
+        self.idle = deque()
+        self.leased = set()
+        self.configs = {}
+        self.closed = False
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+        self.reaper = None
+
+    ############################################################################
+    #                               USER FUNCTIONS                             #
+    ############################################################################
+
+    def start(self):
+        """
+        Creates environments until the pool holds size of them and starts
+        the reaper thread
+        """
+        self.grow(self.size - len(self))
+        if (self.check_interval is not None and self.reaper is None):
+            self.reaper = threading.Thread(target=self.reap)
+            self.reaper.daemon = True
+            self.reaper.start()
+
+    @contextmanager
+    def lease(self, timeout=None, config=None):
+        """
+        Context manager leasing a client for the duration of the block, see
+        acquire and release
+        """
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client, config)
+
+    def acquire(self, timeout=None):
+        """
+        Returns an idle client, creating one if the pool is below size and
+        otherwise waiting up to timeout seconds for one to be returned
+        """
+        deadline = None
+        if (timeout is not None):
+            deadline = time.time() + timeout
+
+        while True:
+            self.evict_idle()
+            with self.cond:
+                while (not self.idle and len(self) >= self.size):
+                    wait = None
+                    if (deadline is not None):
+                        wait = deadline - time.time()
+                        if (wait <= 0):
+                            raise TDWError("no environment available after %s seconds"
+                                           % timeout)
+                    self.cond.wait(wait)
+                if (self.idle):
+                    client, since = self.idle.popleft()
+                    self.leased.add(client)
+                else:
+                    client = None
+
+            if (client is None):
+                self.grow(1)
+                continue
+
+            # the reply to the reset must be waiting, else the environment
+            # is hung and gets replaced
+            if (client.sock.poll(self.health_timeout * 1000, zmq.POLLIN)):
+                return client
+            self.evict(client)
+
+    def release(self, client, config=None):
+        """
+        Returns a leased client to the pool, resetting its scene with config
+        (default: the config it was created with)
+        """
+        with self.cond:
+            self.leased.discard(client)
+        if (self.closed):
+            self.evict(client, replace=False)
+            return
+
+        try:
+            # replies the lessee did not collect block the reset
+            while (client.in_flight()):
+                if (not client.sock.poll(self.health_timeout * 1000, zmq.POLLIN)):
+                    raise TDWError("environment on port %s stopped answering"
+                                   % client.port_num)
+                client.recv_frames()
+            # replies buffered while pipelining but never collected would be
+            # handed to the next lessee before the reply to the reset
+            client.reset_pipeline()
+
+            if (config is None):
+                config = self.configs.get(client)
+            client.load_config(config)
+            client.send_join(use_config=True)
+        except (TDWError, zmq.ZMQError):
+            self.evict(client)
+            return
+
+        with self.cond:
+            self.idle.append((client, time.time()))
+            self.cond.notify()
+
+    def evict_idle(self):
+        """
+        Evicts environments idle longer than max_idle, replacing them while
+        the pool holds fewer than min_size
+        """
+        if (self.max_idle is None):
+            return
+        now = time.time()
+        stale = []
+        with self.cond:
+            while (self.idle and now - self.idle[0][1] > self.max_idle):
+                stale.append(self.idle.popleft()[0])
+        for client in stale:
+            self.evict(client, replace=False)
+        if (stale and len(self) < self.min_size):
+            self.grow(self.min_size - len(self))
+
+    def evict_unhealthy(self):
+        """
+        Evicts idle environments that did not answer their reset within
+        health_timeout or that their queue no longer lists, replacing them
+        while the pool holds fewer than min_size
+        """
+        checked = time.time()
+        with self.cond:
+            clients = [client for client, since in self.idle]
+        queues = {}
+        for client in clients:
+            queues.setdefault((client.queue_host_address,
+                               client.queue_port_number), client)
+        listed = {}
+        for (host, port), client in queues.items():
+            try:
+                processes = tdw_terminate.active_processes(
+                    host, port, client.ctx, self.health_timeout,
+                    client.queue_codec)
+            except TDWError:
+                # the queue cannot tell, only the resets are checked
+                continue
+            listed[(host, port)] = set(str(proc["port_num"])
+                                       for proc in processes)
+
+        dead = []
+        now = time.time()
+        with self.cond:
+            for entry in list(self.idle):
+                client, since = entry
+                ports = listed.get((client.queue_host_address,
+                                    client.queue_port_number))
+                gone = (ports is not None and since < checked and
+                        str(client.port_num) not in ports)
+                hung = (now - since > self.health_timeout and
+                        not client.sock.poll(0, zmq.POLLIN))
+                if (gone or hung):
+                    self.idle.remove(entry)
+                    dead.append(client)
+        for client in dead:
+            self.evict(client, replace=False)
+        if (dead and len(self) < self.min_size):
+            self.grow(self.min_size - len(self))
+
+    def close(self):
+        """
+        Stops the reaper thread and terminates every idle environment, leased
+        ones are terminated when released afterwards
+        """
+        self.stopped.set()
+        if (self.reaper is not None and
+                self.reaper is not threading.current_thread()):
+            self.reaper.join()
+        with self.cond:
+            idle = [client for client, since in self.idle]
+            self.idle.clear()
+            self.closed = True
+            self.size = self.min_size = 0
+        for client in idle:
+            self.evict(client, replace=False)
+
+    def __len__(self):
+        return len(self.idle) + len(self.leased)
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    def reap(self):
+        """
+        Runs in the reaper thread, checking the idle environments every
+        check_interval seconds until close
+        """
+        while (not self.stopped.wait(self.check_interval)):
+            try:
+                self.evict_idle()
+                self.evict_unhealthy()
+            except (TDWError, zmq.ZMQError):
+                # checked again at the next interval
+                pass
+
+    def grow(self, count):
+        """
+        Creates count environments concurrently and adds them to the idle
+        ones, returns the number created
+        """
+        if (count <= 0):
+            return 0
+        created = 0
+        errors = []
+        for index, client, error in provision_environments(
+                self.host_address, count, self.selected_build,
+                self.description, **self.client_kwargs):
+            if (error is not None):
+                errors.append(error)
+                continue
+            created += 1
+            with self.cond:
+                self.configs[client] = client.environment_config
+                self.idle.append((client, time.time()))
+                self.cond.notify()
+        if (errors and not created):
+            raise errors[0]
+        return created
+
+    def evict(self, client, replace=True):
+        """
+        Terminates the environment of client and drops it from the pool,
+        creating a replacement if the pool falls below min_size. Waits up to
+        health_timeout seconds for the queue to stop listing it and returns
+        the tdw_terminate.TerminationResult.
+        """
+        with self.cond:
+            self.leased.discard(client)
+            self.configs.pop(client, None)
+
+        # the client socket may be waiting on a reply, TERMINATE goes out on
+        # a fresh one
+        client.sock.close(linger=0)
+        host, port = client.queue_host_address, client.queue_port_number
+        try:
+            processes = tdw_terminate.select_processes(
+                tdw_terminate.active_processes(host, port, client.ctx,
+                                               self.health_timeout,
+                                               client.queue_codec),
+                ports=[client.port_num])
+            verify = True
+        except TDWError:
+            # the queue cannot confirm, terminate by port alone
+            processes = [{"port_num": client.port_num}]
+            verify = False
+        result = tdw_terminate.terminate_environments(
+            host, processes, port, self.health_timeout, verify=verify,
+            ctx=client.ctx, queue_codec=client.queue_codec)
+
+        if (replace and len(self) < self.min_size):
+            self.grow(self.min_size - len(self))
+        return result
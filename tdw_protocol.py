@@ -0,0 +1,108 @@
+import getpass
+
+import tdw_codec
+
+
+def join_message(num_frames_per_msg, config=None, **options):
+    """
+    Builds the message joining an environment, CLIENT_JOIN_WITH_CONFIG when a
+    config is given else CLIENT_JOIN. Extra options are added to the message.
+    """
+    msg = {"msg_type": "CLIENT_JOIN"}
+    if (config):
+        msg["msg_type"] = "CLIENT_JOIN_WITH_CONFIG"
+        msg["config"] = config
+    msg.update(options)
+    return {"n": num_frames_per_msg, "msg": msg}
+
+
+def input_message(num_frames_per_msg, action=None, **options):
+    """
+    Builds a CLIENT_INPUT message from the options and the keys of action
+    """
+    msg = {"msg_type": "CLIENT_INPUT"}
+    msg.update(options)
+    if (action):
+        msg.update(action)
+    return {"n": num_frames_per_msg, "msg": msg}
+
+
+def input_batch_message(num_frames_per_msg, actions, **options):
+    """
+    Builds a CLIENT_INPUT_BATCH message, the environment steps once per
+    action and answers with the frames of every step (see
+    tdw_frames.unpack_batch)
+    """
+    msg = {"msg_type": "CLIENT_INPUT_BATCH",
+           "actions": [action or {} for action in actions]}
+    msg.update(options)
+    return {"n": num_frames_per_msg, "msg": msg}
+
+
+def default_username():
+    """
+    Name of the user running this process, from the environment or the
+    password database, None if it cannot be told (e.g. in a container
+    without either)
+    """
+    try:
+        return getpass.getuser()
+    except (KeyError, ImportError):
+        return None
+
+
+def create_message(port_num, build_option, username, description,
+                   profile=None):
+    """
+    Builds the CREATE_ENVIRONMENT_2 message launching build_option on
+    port_num, the keys of profile are added to the message
+    """
+    msg = {"msg": {"msg_type": "CREATE_ENVIRONMENT_2"},
+           "port_num": str(port_num),
+           "selected_build": build_option,
+           "username": username,
+           "description": description}
+    if (profile):
+        msg.update(profile)
+    return msg
+
+
+def offered_codecs(preferred_codec):
+    """
+    Names of the codecs offered when joining, json is always accepted
+    """
+    codecs = [preferred_codec.name]
+    if (preferred_codec.name != tdw_codec.JSONCodec.name):
+        codecs.append(tdw_codec.JSONCodec.name)
+    return codecs
+
+
+def accepted_codec(info, codec, preferred_codec):
+    """
+    Returns the codec to use after a reply with header info, environments
+    name the codec they accepted in their reply to a join
+    """
+    name = info.get("codec")
+    if (not name or name == codec.name):
+        return codec
+    if (name == preferred_codec.name):
+        return preferred_codec
+    return tdw_codec.get_codec(name)
+
+
+def build_name(option):
+    """
+    Strips the directory from a build option sent by the queue
+    """
+    return option[option.rfind('/') + 1:]
+
+
+def match_build(options, selected_build):
+    """
+    Returns the build option whose name is selected_build, None if the queue
+    does not offer it
+    """
+    for option in options:
+        if (build_name(option) == selected_build):
+            return option
+    return None
@@ -0,0 +1,316 @@
+import time
+import zmq
+
+from tdw_client import TDW_Client
+import tdw_protocol
+import tdw_queues
+from tdw_errors import TDWError, TDWInputError, TDWRequestError
+
+
+class _Slot(object):
+    """
+    Progress of one environment being provisioned
+    """
+    def __init__(self, index, client, requested_port=None):
+        self.index = index
+        self.client = client
+        self.requested_port = requested_port
+        self.state = None
+        self.port_num = None
+        # port asked about with CHECK_PORT, and how many ports were probed
+        # after the queue handed out a port already taken by the batch
+        self.checking = None
+        self.probes = 0
+
+
+class EnvironmentProvisioner(object):
+    """
+    Creates many environments at once without prompting
+
+    Every environment gets its own TDW_Client and therefore its own REQ
+    socket to the queue, so the port selection and CREATE_ENVIRONMENT_1/2
+    handshakes of all environments run concurrently, driven by one
+    zmq.Poller. Ports handed out by the queue are reserved for the batch so
+    two environments never race for the same port. Queues that answer
+    concurrent AUTO_SELECT_PORT requests with the same port are worked
+    around by probing the ports above it with CHECK_PORT, which reserves a
+    block of neighbouring ports in one round of requests.
+    """
+
+    def __init__(self, host_address, num_envs, selected_build, description,
+                 ports=None, provision_timeout=None, max_probes=16, **kwargs):
+        """
+        :Args:
+            host_address (str or list)
+                Address of the queue, or a list of them. Several queues are probed first and the environments spread over them, least loaded first (see tdw_queues.spread).
+            num_envs (int)
+            selected_build (str)
+                Name of the build to launch, '<build_name>.x86_64'.
+            description (str)
+
+        :Kwargs:
+            - ports (list, default: None)
+                Ports to request first, checked with CHECK_PORT. Environments without one, or whose port is taken, get a port from AUTO_SELECT_PORT.
+
+            - provision_timeout (float, default: None)
+                Seconds after which environments not ready yet are reported as failed. The timeout keyword of TDW_Client, the deadline of every single reply, is passed on to the clients.
+
+            - max_probes (int, default: 16)
+                Ports an environment probes with CHECK_PORT after being handed a port the batch already holds, before waiting for the queue to hand out another one.
+
+            Any other keyword is passed to every TDW_Client.
+        """
+        self.selected_build = selected_build
+        self.provision_timeout = provision_timeout
+        kwargs.setdefault("ctx", zmq.Context.instance())
+        kwargs.setdefault("interactive", False)
+        if (not kwargs.get("username")):
+            kwargs["username"] = tdw_protocol.default_username()
+        if (not kwargs["username"]):
+            raise TDWInputError("username not given and the user running "
+                                "this process is unknown")
+        ports = list(ports or [])
+
+        queues = tdw_queues.parse_queues(host_address,
+                                         kwargs.pop("queue_port_num", "23402"))
+        self.queue_loads = None
+        if (len(queues) > 1):
+            self.queue_loads = tdw_queues.probe_queues(
+                queues, kwargs["ctx"], queue_codec=kwargs.get("queue_codec", "json"))
+            owner = kwargs["username"]
+            placements = tdw_queues.spread(self.queue_loads, num_envs, owner,
+                                           selected_build)
+            if (not placements):
+                raise TDWError("none of the queues %s answered" % (queues,))
+            queues = [(load.host, load.port) for load in placements]
+
+        self.slots = []
+        for i in range(num_envs):
+            host, port = queues[i % len(queues)]
+            client = TDW_Client(host,
+                                queue_port_num=port,
+                                selected_build=selected_build,
+                                description=description,
+                                **kwargs)
+            requested_port = None
+            if (i < len(ports)):
+                requested_port = ports[i]
+            self.slots.append(_Slot(i, client, requested_port))
+
+        # (host, port) taken by this batch, and slots waiting for their queue
+        # to hand out a port no other slot holds
+        self.reserved = set()
+        self.parked = []
+        self.max_probes = max_probes
+        self.next_port = {}
+
+    def run(self):
+        """
+        Generator yielding (index, client, error) for every environment as
+        soon as it is ready or has failed. Ready clients have sent their join
+        message, their first observation is available from recv_frames.
+        Failed ones come with client None and a TDWError.
+        """
+        deadline = None
+        if (self.provision_timeout is not None):
+            deadline = time.time() + self.provision_timeout
+
+        poller = zmq.Poller()
+        slot_of = {}
+        for slot in self.slots:
+            poller.register(slot.client.sock, zmq.POLLIN)
+            slot_of[slot.client.sock] = slot
+            self.request_port(slot)
+
+        while (slot_of):
+            # slots parked on a duplicate port retry once nothing else can
+            # make the queue hand out new ports
+            if (self.parked and len(self.parked) == len(slot_of)):
+                self.retry_parked()
+
+            wait = None
+            if (deadline is not None):
+                wait = max(deadline - time.time(), 0) * 1000
+            events = poller.poll(wait)
+
+            if (not events and deadline is not None and time.time() >= deadline):
+                for sock, slot in slot_of.items():
+                    sock.close(linger=0)
+                    yield slot.index, None, TDWError(
+                        "environment %d not ready after %s seconds"
+                        % (slot.index, self.provision_timeout))
+                return
+
+            for sock, event in events:
+                slot = slot_of[sock]
+                try:
+                    ready = self.advance(slot, slot.client.recv_json(sock))
+                except TDWError as e:
+                    poller.unregister(sock)
+                    del slot_of[sock]
+                    sock.close(linger=0)
+                    yield slot.index, None, e
+                    continue
+
+                if (ready):
+                    poller.unregister(sock)
+                    del slot_of[sock]
+                    slot.client.connect_to_port(slot.port_num)
+                    slot.client.ready_for_recv = True
+                    # the port is now known to be taken on the server
+                    self.retry_parked()
+                    yield slot.index, slot.client, None
+
+    def advance(self, slot, msg):
+        """
+        Handles the reply to the last request of a slot and sends the next
+        one. Returns True once the environment offered to be joined.
+        """
+        msg_type = msg["msg"]["msg_type"]
+
+        if (slot.state == "CHECK_PORT"):
+            if (msg.get("status") and
+                    self.port_key(slot, slot.checking) not in self.reserved):
+                self.reserve(slot, slot.checking)
+            elif (slot.probes):
+                self.probe_port(slot)
+            else:
+                self.request_port(slot, check=False)
+
+        elif (slot.state == "AUTO_SELECT_PORT"):
+            if (msg_type != "AUTO_SELECT_PORT"):
+                raise TDWRequestError(msg_type, msg)
+            if (self.port_key(slot, msg["port_num"]) in self.reserved):
+                host = slot.client.queue_host_address
+                self.next_port[host] = max(self.next_port.get(host, 0),
+                                           int(msg["port_num"]) + 1)
+                self.probe_port(slot)
+            else:
+                self.reserve(slot, msg["port_num"])
+
+        elif (slot.state == "CREATE_ENVIRONMENT_1"):
+            if (msg_type == "PORT_UNAVAILABLE"):
+                self.release(slot)
+                self.request_port(slot, check=False)
+            elif (msg_type == "SEND_OPTIONS"):
+                build_option = tdw_protocol.match_build(msg["options"],
+                                                        self.selected_build)
+                if (build_option is None):
+                    raise TDWError("build '%s' is not available on the server"
+                                   % self.selected_build)
+                client = slot.client
+                slot.state = "CREATE_ENVIRONMENT_2"
+                client.send_json(tdw_protocol.create_message(
+                    slot.port_num, build_option, client.username,
+                    client.description, client.environment_profile),
+                    client.sock)
+            else:
+                raise TDWRequestError(msg_type, msg)
+
+        elif (slot.state == "CREATE_ENVIRONMENT_2"):
+            if (msg_type == "PORT_UNAVAILABLE"):
+                self.release(slot)
+                self.request_port(slot, check=False)
+            elif (msg_type == "JOIN_OFFER"):
+                slot.port_num = msg["port_num"]
+                return True
+            else:
+                raise TDWRequestError(msg_type, msg)
+
+        return False
+
+    def request_port(self, slot, check=True):
+        """
+        Asks the queue for a port, the requested port of the slot if it has
+        one and check is set, else any free port
+        """
+        client = slot.client
+        if (check and slot.requested_port is not None):
+            self.check_port(slot, slot.requested_port)
+        else:
+            slot.state = "AUTO_SELECT_PORT"
+            client.send_json({"msg": {"msg_type": "AUTO_SELECT_PORT"}},
+                             client.sock)
+
+    def check_port(self, slot, port_num):
+        slot.state = "CHECK_PORT"
+        slot.checking = port_num
+        slot.client.send_json({"msg": {"msg_type": "CHECK_PORT"},
+                               "port_num": port_num}, slot.client.sock)
+
+    def probe_port(self, slot):
+        """
+        Checks the next port above the ones the batch holds, or parks the
+        slot once it probed max_probes ports
+        """
+        if (slot.probes >= self.max_probes):
+            slot.state = None
+            slot.probes = 0
+            self.parked.append(slot)
+            return
+        host = slot.client.queue_host_address
+        port = self.next_port.get(host, 0)
+        while (self.port_key(slot, port) in self.reserved):
+            port += 1
+        self.next_port[host] = port + 1
+        slot.probes += 1
+        self.check_port(slot, port)
+
+    def reserve(self, slot, port_num):
+        """
+        Holds port_num for slot and starts creating its environment there
+        """
+        slot.port_num = port_num
+        slot.probes = 0
+        self.reserved.add(self.port_key(slot, port_num))
+        slot.state = "CREATE_ENVIRONMENT_1"
+        slot.client.send_json({"msg": {"msg_type": "CREATE_ENVIRONMENT_1"},
+                               "port_num": str(port_num)}, slot.client.sock)
+
+    def release(self, slot):
+        self.reserved.discard(self.port_key(slot, slot.port_num))
+        slot.port_num = None
+
+    def port_key(self, slot, port_num):
+        return (slot.client.queue_host_address, str(port_num))
+
+    def retry_parked(self):
+        parked, self.parked = self.parked, []
+        for slot in parked:
+            self.request_port(slot, check=False)
+
+
+def provision_environments(host_address, num_envs, selected_build,
+                           description, **kwargs):
+    """
+    Creates num_envs environments concurrently, yielding (index, client,
+    error) as each one becomes ready or fails. See EnvironmentProvisioner.
+    """
+    provisioner = EnvironmentProvisioner(host_address, num_envs,
+                                         selected_build, description,
+                                         **kwargs)
+    return provisioner.run()
+
+
+def create_environments(host_address, num_envs, selected_build, description,
+                        **kwargs):
+    """
+    Creates num_envs environments concurrently and returns their clients in
+    order. Raises the first error if any environment fails, after closing
+    the others.
+    """
+    clients = [None] * num_envs
+    errors = []
+    for index, client, error in provision_environments(
+            host_address, num_envs, selected_build, description, **kwargs):
+        if (error is not None):
+            errors.append(error)
+        else:
+            clients[index] = client
+
+    if (errors):
+        for client in clients:
+            if (client is not None):
+                client.sock.close(linger=0)
+        raise errors[0]
+    return clients
@@ -0,0 +1,149 @@
+import time
+import zmq
+
+import tdw_codec
+import tdw_protocol
+
+
+def parse_queue(address, default_port="23402"):
+    """
+    Splits 'host' or 'host:port' into (host, port)
+    """
+    if (isinstance(address, (tuple, list))):
+        host, port = address
+        return host, str(port)
+    if (":" in address):
+        host, port = address.rsplit(":", 1)
+        return host, port
+    return address, str(default_port)
+
+
+def parse_queues(addresses, default_port="23402"):
+    """
+    Returns the (host, port) of every queue in addresses, a single address
+    or a list of them
+    """
+    if (isinstance(addresses, basestring)):
+        addresses = [addresses]
+    return [parse_queue(address, default_port) for address in addresses]
+
+
+class QueueLoad(object):
+    """
+    Answer of one queue to GET_ACTIVE_ENVIRONMENTS, or the error probing it
+    """
+
+    def __init__(self, host, port, processes=None, latency=None, error=None):
+        self.host = host
+        self.port = port
+        self.processes = processes
+        self.latency = latency
+        self.error = error
+
+    def score(self, owner=None, build=None, owner_weight=1.0,
+              build_weight=1.0, latency_weight=100.0):
+        """
+        Lower is better: one per active process, plus owner_weight per
+        process of owner and build_weight per process running build, plus
+        latency_weight per second of response time
+
+        Builds are compared by name, without the directory. The build term
+        needs a queue that lists 'selected_build' with its active processes,
+        which the standard process table (env_owner, proc_pid, port_num,
+        proc_create_time, env_desc) does not; processes without it never
+        count as running build.
+        """
+        if (build is not None):
+            build = tdw_protocol.build_name(build)
+        score = len(self.processes) + latency_weight * self.latency
+        for proc in self.processes:
+            if (owner is not None and proc.get("env_owner") == owner):
+                score += owner_weight
+            selected = proc.get("selected_build")
+            if (build is not None and selected is not None and
+                    tdw_protocol.build_name(selected) == build):
+                score += build_weight
+        return score
+
+    def __repr__(self):
+        if (self.error is not None):
+            return "QueueLoad(%s:%s, error=%r)" % (self.host, self.port,
+                                                  self.error)
+        return "QueueLoad(%s:%s, %d processes, %.1f ms)" % (
+            self.host, self.port, len(self.processes), self.latency * 1e3)
+
+
+def probe_queues(queues, ctx=None, timeout=2.0, queue_codec="json"):
+    """
+    Sends GET_ACTIVE_ENVIRONMENTS to every (host, port) in queues at once and
+    returns one QueueLoad per queue, in order. Queues that do not answer
+    within timeout seconds get an error instead of processes.
+    """
+    codec = tdw_codec.get_codec(queue_codec)
+    ctx = ctx or zmq.Context.instance()
+    data = codec.encode({"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}})
+
+    loads = [QueueLoad(host, port) for host, port in queues]
+    poller = zmq.Poller()
+    load_of = {}
+    start = time.time()
+    for load in loads:
+        sock = ctx.socket(zmq.REQ)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect("tcp://" + load.host + ":" + load.port)
+        sock.send(data)
+        poller.register(sock, zmq.POLLIN)
+        load_of[sock] = load
+
+    end = start + timeout
+    try:
+        while (load_of and time.time() < end):
+            for sock, event in poller.poll(max(end - time.time(), 0) * 1000):
+                load = load_of.pop(sock)
+                load.latency = time.time() - start
+                poller.unregister(sock)
+                msg = codec.decode(sock.recv())
+                sock.close()
+                if (msg["msg"]["msg_type"] == "ACTIVE_PROCESSES"):
+                    load.processes = msg["processes"]
+                else:
+                    load.error = "Error: " + msg["msg"]["msg_type"]
+    finally:
+        for sock, load in load_of.items():
+            load.error = "no reply after %s seconds" % timeout
+            sock.close()
+    return loads
+
+
+def rank_queues(loads, owner=None, build=None, **weights):
+    """
+    Returns the queues that answered, least loaded first (see
+    QueueLoad.score for the weights)
+    """
+    answered = [load for load in loads if load.error is None]
+    return sorted(answered, key=lambda load: load.score(owner, build, **weights))
+
+
+def spread(loads, count, owner=None, build=None, **weights):
+    """
+    Returns the queue to place each of count new environments on, every
+    placement counting as one more process of owner running build on its
+    queue
+    """
+    ranked = rank_queues(loads, owner, build, **weights)
+    if (not ranked):
+        return []
+    scores = dict((id(load), load.score(owner, build, **weights))
+                  for load in ranked)
+    extra = 1.0
+    if (owner is not None):
+        extra += weights.get("owner_weight", 1.0)
+    if (build is not None):
+        extra += weights.get("build_weight", 1.0)
+
+    placements = []
+    for _ in range(count):
+        best = min(ranked, key=lambda load: scores[id(load)])
+        scores[id(best)] += extra
+        placements.append(best)
+    return placements
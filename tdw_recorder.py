@@ -0,0 +1,314 @@
+import os, json, time, threading
+import Queue
+import numpy as np
+
+from tdw_errors import TDWError
+
+
+INDEX_FILE = "index.jsonl"
+
+
+def shard_dir(directory, shard):
+    return os.path.join(directory, "shard_%05d" % shard)
+
+
+class TrajectoryRecorder(object):
+    """
+    Writes received observations to disk from a background thread
+
+        recorder = TrajectoryRecorder("/data/run_3")
+        client.attach_recorder(recorder)
+        ...
+        recorder.close()
+
+    Observations go through a bounded queue to a writer thread, so the step
+    loop only pays for handing them over. The output is a directory of
+    shards, each holding at most shard_steps steps:
+
+        shard_00000/images.bin     frames of every step appended raw
+        shard_00000/normals.bin
+        shard_00000/index.jsonl    one line per step: step, time, header
+                                   and offset, shape and dtype of its frames
+
+    Files are only ever appended to and an index line is written after the
+    frames it points to, so a shard cut short by a crash is readable up to
+    its last index line. See TrajectoryReader.
+    """
+
+    def __init__(self, directory, shard_steps=1000, queue_size=64,
+                 block=True):
+        """
+        :Args:
+            directory (str)
+                Created if missing. Shards are numbered on from the ones already in it.
+
+        :Kwargs:
+            - shard_steps (int, default: 1000)
+                Number of steps written to a shard before starting the next one.
+
+            - queue_size (int, default: 64)
+                Observations waiting for the writer before record blocks or drops.
+
+            - block (bool, default: True)
+                Whether record waits for room in a full queue. When False the observation is dropped and counted in dropped instead, so a slow disk never stalls the step loop.
+        """
+        self.directory = directory
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+        self.shard_steps = shard_steps
+        self.block = block
+        self.queue = Queue.Queue(queue_size)
+        self.steps = 0
+        self.dropped = 0
+        self.error = None
+
+        self.shard = len([d for d in os.listdir(directory)
+                          if d.startswith("shard_")])
+        self.files = {}
+        self.index = None
+        self.shard_count = 0
+
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ############################################################################
+    #                               USER FUNCTIONS                             #
+    ############################################################################
+
+    def record(self, obs, step=None):
+        """
+        Queues an observation (as returned by recv_frames) for writing.
+        Returns False if it was dropped because the queue was full.
+
+        Frames are arrays in read-only received buffers, which are kept as
+        they are, or writable arrays like preallocated outputs, which are
+        copied as they are about to be overwritten.
+        """
+        if (self.error is not None):
+            raise TDWError("recorder stopped: %s" % self.error)
+        if (step is None):
+            step = self.steps
+        self.steps = step + 1
+
+        frames = {}
+        for name, value in obs.items():
+            if (name == "info" or not isinstance(value, np.ndarray)):
+                continue
+            if (value.flags.writeable):
+                value = value.copy()
+            frames[name] = value
+        item = (step, time.time(), obs.get("info"), frames)
+
+        try:
+            self.queue.put(item, self.block)
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """
+        Waits until everything queued so far is on disk
+        """
+        self.queue.join()
+
+    def close(self):
+        if (self.thread is None):
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if (self.error is not None):
+            raise TDWError("recorder stopped: %s" % self.error)
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    def write_loop(self):
+        try:
+            while True:
+                item = self.queue.get()
+                try:
+                    if (item is None):
+                        break
+                    self.write(*item)
+                    # index lines reach the disk whenever the writer catches up
+                    if (self.queue.empty()):
+                        self.index.flush()
+                finally:
+                    self.queue.task_done()
+        except Exception as e:
+            self.error = e
+            # unblock producers waiting on a full queue
+            while True:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                except Queue.Empty:
+                    break
+        finally:
+            self.close_shard()
+
+    def write(self, step, timestamp, info, frames):
+        if (self.index is None or self.shard_count >= self.shard_steps):
+            self.open_shard()
+
+        entry = {"step": step, "time": timestamp, "info": info, "frames": {}}
+        for name, value in frames.items():
+            f = self.files.get(name)
+            if (f is None):
+                f = open(os.path.join(self.path, name + ".bin"), "ab")
+                self.files[name] = f
+            entry["frames"][name] = [f.tell(), value.shape, value.dtype.str]
+            f.write(np.ascontiguousarray(value).data)
+        for f in self.files.values():
+            f.flush()
+        self.index.write(json.dumps(entry) + "\n")
+        self.shard_count += 1
+
+    def open_shard(self):
+        self.close_shard()
+        self.path = shard_dir(self.directory, self.shard)
+        os.makedirs(self.path)
+        self.index = open(os.path.join(self.path, INDEX_FILE), "a")
+        self.shard += 1
+        self.shard_count = 0
+
+    def close_shard(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        if (self.index is not None):
+            self.index.close()
+            self.index = None
+
+
+class TrajectoryReader(object):
+    """
+    Random access to the steps written by TrajectoryRecorder
+
+        reader = TrajectoryReader("/data/run_3")
+        len(reader)
+        obs = reader[123456]          # {'info': ..., 'images': array, ...}
+        images = reader.frames("images", [10, 11, 12])
+
+    Only offsets, shapes, steps and times are held in memory, as arrays.
+    Frames are read through read-only memory maps of the shard files, opened
+    on first use, and headers by seeking to their index line, so opening a
+    recording of millions of steps loads no frames.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.shard_paths = sorted(os.path.join(directory, d)
+                                  for d in os.listdir(directory)
+                                  if d.startswith("shard_"))
+        self.maps = {}
+
+        shards, lines, steps, times = [], [], [], []
+        offsets = {}
+        layouts = []
+        layout_of = {}
+        for shard, path in enumerate(self.shard_paths):
+            with open(os.path.join(path, INDEX_FILE)) as f:
+                pos = 0
+                for line in f:
+                    start, pos = pos, pos + len(line)
+                    if (not line.endswith("\n")):
+                        # cut short while being written
+                        break
+                    entry = json.loads(line)
+                    shards.append(shard)
+                    lines.append(start)
+                    steps.append(entry["step"])
+                    times.append(entry["time"])
+                    for name, (offset, shape, dtype) in entry["frames"].items():
+                        if (name not in offsets):
+                            offsets[name] = [-1] * (len(shards) - 1)
+                        key = (tuple(shape), dtype)
+                        if (key not in layout_of):
+                            layout_of[key] = len(layouts)
+                            layouts.append(key)
+                        offsets[name].append((offset, layout_of[key]))
+                    for name in offsets:
+                        if (len(offsets[name]) < len(shards)):
+                            offsets[name].append(-1)
+
+        self.shards = np.array(shards, dtype=np.int32)
+        self.lines = np.array(lines, dtype=np.int64)
+        self.steps = np.array(steps, dtype=np.int64)
+        self.times = np.array(times, dtype=np.float64)
+        self.layouts = layouts
+        # per frame name: byte offset into its shard file and layout index,
+        # -1 for steps without that frame
+        self.offsets = {}
+        self.layout_ids = {}
+        for name, entries in offsets.items():
+            self.offsets[name] = np.array([e if e == -1 else e[0] for e in entries],
+                                          dtype=np.int64)
+            self.layout_ids[name] = np.array([-1 if e == -1 else e[1] for e in entries],
+                                             dtype=np.int32)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __getitem__(self, i):
+        """
+        Returns the observation recorded as the i-th step, frames are
+        read-only views onto the memory maps
+        """
+        obs = {"info": self.info(i)}
+        for name in self.offsets:
+            frame = self.frame(name, i)
+            if (frame is not None):
+                obs[name] = frame
+        return obs
+
+    @property
+    def frame_names(self):
+        return sorted(self.offsets)
+
+    def frame(self, name, i):
+        """
+        Returns frame name of step i as a read-only view, None if that step
+        has no such frame
+        """
+        offset = self.offsets[name][i]
+        if (offset < 0):
+            return None
+        shape, dtype = self.layouts[self.layout_ids[name][i]]
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        data = self.memmap(self.shards[i], name)[offset:offset + size]
+        return data.view(dtype).reshape(shape)
+
+    def frames(self, name, indices):
+        """
+        Returns frame name of the steps at indices stacked into one array,
+        copied out of the memory maps
+        """
+        return np.stack([self.frame(name, i) for i in indices])
+
+    def info(self, i):
+        """
+        Returns the message header recorded with step i
+        """
+        path = os.path.join(self.shard_paths[self.shards[i]], INDEX_FILE)
+        with open(path) as f:
+            f.seek(self.lines[i])
+            return json.loads(f.readline())["info"]
+
+    def memmap(self, shard, name):
+        key = (shard, name)
+        if (key not in self.maps):
+            path = os.path.join(self.shard_paths[shard], name + ".bin")
+            self.maps[key] = np.memmap(path, dtype=np.uint8, mode="r")
+        return self.maps[key]
@@ -0,0 +1,197 @@
+import json, hashlib, threading
+from collections import Mapping
+
+
+def freeze(value):
+    """
+    Returns an immutable copy of a decoded json value, dicts become
+    SceneSnapshots and lists tuples
+    """
+    if (isinstance(value, SceneSnapshot)):
+        return value
+    if (isinstance(value, dict)):
+        return SceneSnapshot(dict((k, freeze(v)) for k, v in value.items()))
+    if (isinstance(value, (list, tuple))):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+    Returns a plain, mutable copy of a frozen value
+    """
+    if (isinstance(value, SceneSnapshot)):
+        return dict((k, thaw(v)) for k, v in value.items())
+    if (isinstance(value, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def config_key(config):
+    """
+    Hash of an environment config, equal for configs with equal contents
+    """
+    data = json.dumps(config or {}, sort_keys=True)
+    return hashlib.sha1(data).hexdigest()
+
+
+class SceneSnapshot(Mapping):
+    """
+    Immutable scene description, or part of one
+
+    Behaves like a read-only dict whose nested dicts are SceneSnapshots and
+    lists are tuples, so it can be handed to other threads and kept without
+    copying. Applying a delta builds a new snapshot that shares every part
+    the delta did not touch with the old one.
+    """
+
+    __slots__ = ("_data", "version")
+
+    def __init__(self, data, version=None):
+        self._data = data
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "SceneSnapshot(%r, version=%r)" % (self._data, self.version)
+
+    def to_dict(self):
+        return thaw(self)
+
+    def apply(self, delta):
+        """
+        Returns a new snapshot with delta applied, a dict with
+            'version': version of the scene after the delta
+            'set':     list of [path, value], path a list of keys
+            'remove':  list of paths
+        """
+        data = self._data
+        for path, value in delta.get("set", []):
+            data = _set_path(data, path, freeze(value))
+        for path in delta.get("remove", []):
+            data = _remove_path(data, path)
+        return SceneSnapshot(data, delta.get("version"))
+
+
+def _set_path(data, path, value):
+    """
+    Returns a copy of the dict data with value at path, copying only the
+    dicts along the path
+    """
+    data = dict(data)
+    key = path[0]
+    if (len(path) == 1):
+        data[key] = value
+    else:
+        child = data.get(key)
+        child = child._data if isinstance(child, SceneSnapshot) else {}
+        data[key] = SceneSnapshot(_set_path(child, path[1:], value))
+    return data
+
+
+def _remove_path(data, path):
+    key = path[0]
+    if (key not in data):
+        return data
+    data = dict(data)
+    if (len(path) == 1):
+        del data[key]
+    elif (isinstance(data[key], SceneSnapshot)):
+        data[key] = SceneSnapshot(_remove_path(data[key]._data, path[1:]))
+    return data
+
+
+class SceneCache(object):
+    """
+    Last known scene of environments, keyed by (port, config hash)
+
+    Environments send their scene in the reply header under 'scene_info'
+    (everything) or 'scene_delta' (changes since the version the client said
+    it holds, see SceneSnapshot.apply). Clients name the version they hold
+    with 'scene_version' in their messages and omit it to ask for
+    everything, which they do only when nothing is cached for the
+    environment, or a delta did not fit the cached version.
+
+    One cache can be shared by several clients, e.g. to rejoin an
+    environment from a new client without downloading its scene again.
+    """
+
+    def __init__(self):
+        self.scenes = {}
+        self.lock = threading.Lock()
+        self.full_updates = 0
+        self.delta_updates = 0
+        self.misses = 0
+
+    def get(self, port_num, config=None):
+        """
+        Returns the cached SceneSnapshot of an environment, None if missing
+        """
+        return self.scenes.get(self.key(port_num, config))
+
+    def version(self, port_num, config=None):
+        """
+        Version of the cached scene to name in requests, None to ask for
+        the full scene
+        """
+        snapshot = self.get(port_num, config)
+        if (snapshot is None):
+            return None
+        return snapshot.version
+
+    def update(self, port_num, config, info):
+        """
+        Applies the scene sent in the reply header info, returns the current
+        snapshot or None if the reply held a delta that could not be applied
+        """
+        key = self.key(port_num, config)
+        with self.lock:
+            if ("scene_info" in info):
+                snapshot = freeze(info["scene_info"])
+                snapshot.version = info.get("scene_version")
+                self.scenes[key] = snapshot
+                self.full_updates += 1
+                return snapshot
+
+            snapshot = self.scenes.get(key)
+            delta = info.get("scene_delta")
+            if (delta is None):
+                return snapshot
+            if (snapshot is None or snapshot.version is None or
+                    delta.get("base") > snapshot.version):
+                # the next request asks for everything again
+                self.scenes.pop(key, None)
+                self.misses += 1
+                return None
+            if (delta.get("version") > snapshot.version):
+                # deltas of replies overtaken by later ones are already in
+                snapshot = snapshot.apply(delta)
+                self.scenes[key] = snapshot
+            self.delta_updates += 1
+            return snapshot
+
+    def store(self, port_num, config, scene, version):
+        """
+        Caches scene as the one at version, e.g. a scene saved by an earlier
+        process, and returns its snapshot
+        """
+        snapshot = freeze(scene)
+        snapshot.version = version
+        with self.lock:
+            self.scenes[self.key(port_num, config)] = snapshot
+        return snapshot
+
+    def discard(self, port_num, config=None):
+        with self.lock:
+            self.scenes.pop(self.key(port_num, config), None)
+
+    def key(self, port_num, config):
+        return (str(port_num), config_key(config))
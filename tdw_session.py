@@ -0,0 +1,118 @@
+import os, json, time, tempfile
+
+import tdw_protocol
+from tdw_errors import TDWError
+from tdw_scene_cache import config_key, thaw
+from tdw_terminate import active_processes
+
+SESSION_VERSION = 1
+
+
+def load_session(path):
+    """
+    Returns the session saved at path, None if there is none or it cannot
+    be read
+    """
+    try:
+        with open(path) as f:
+            session = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if (not isinstance(session, dict) or
+            session.get("version") != SESSION_VERSION):
+        return None
+    return session
+
+
+def save_session(path, session):
+    """
+    Writes session to path, replacing the old file at once so a process
+    killed while saving leaves the previous session behind
+    """
+    session = dict(session, version=SESSION_VERSION, saved=time.time())
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tdw_session", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(session, f)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+def make_session(host, queue_port, port_num, build, config, owner,
+                 process=None, scene=None):
+    """
+    Session of the environment on port_num of the queue at host:queue_port,
+    created with config. process is its entry in the active processes of
+    the queue, scene the last scene received from it (a dict or
+    SceneSnapshot).
+    """
+    if (process is not None):
+        owner = process.get("env_owner", owner)
+        # only queues extending the process table list 'selected_build'
+        build = build or process.get("selected_build")
+    session = {"host": host,
+               "queue_port": str(queue_port),
+               "port_num": str(port_num),
+               "build": build,
+               "config_hash": config_key(config),
+               "owner": owner,
+               "proc_pid": None,
+               "proc_create_time": None,
+               "scene": None,
+               "scene_version": None}
+    if (process is not None):
+        session["proc_pid"] = process.get("proc_pid")
+        session["proc_create_time"] = process.get("proc_create_time")
+    if (scene is not None):
+        session["scene"] = thaw(scene)
+        session["scene_version"] = getattr(scene, "version", None)
+    return session
+
+
+def find_process(processes, port_num):
+    for proc in processes:
+        if (str(proc["port_num"]) == str(port_num)):
+            return proc
+    return None
+
+
+def session_matches(session, proc):
+    """
+    True if the process entry proc is the environment of session and not
+    another one started on its port since
+    """
+    if (proc is None or str(proc["port_num"]) != session["port_num"]):
+        return False
+    if (session["owner"] is not None and
+            proc.get("env_owner") != session["owner"]):
+        return False
+    # queues that do not list 'selected_build' cannot tell builds apart
+    if (session["build"] is not None and
+            proc.get("selected_build") is not None and
+            tdw_protocol.build_name(proc["selected_build"]) !=
+            tdw_protocol.build_name(session["build"])):
+        return False
+    for key in ("proc_pid", "proc_create_time"):
+        if (session[key] is not None and str(proc.get(key)) != str(session[key])):
+            return False
+    return True
+
+
+def probe_session(session, ctx=None, timeout=1.0, queue_codec="json"):
+    """
+    Asks the queue of session whether its environment is still running,
+    waiting at most timeout seconds. Returns the process entry of the
+    environment, None if it is gone or the queue does not answer in time.
+    """
+    try:
+        processes = active_processes(session["host"], session["queue_port"],
+                                     ctx, timeout, queue_codec)
+    except TDWError:
+        return None
+    proc = find_process(processes, session["port_num"])
+    if (not session_matches(session, proc)):
+        return None
+    return proc
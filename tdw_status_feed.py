@@ -0,0 +1,228 @@
+import time, threading
+import zmq
+
+import tdw_codec
+from tdw_errors import TDWError, TDWTimeoutError
+
+
+class StatusFeed(object):
+    """
+    Local, always current table of the environments of a queue
+
+        feed = StatusFeed(host)
+        feed.add_listener(lambda event, proc: log(event, proc["port_num"]))
+        feed.start()
+        feed.processes()
+
+    Queues with a status feed answer GET_STATUS_FEED with the port of a PUB
+    socket publishing one event per change:
+
+        {"event": "added" | "removed" | "changed",
+         "version": <int, one more per event>,
+         "process": <entry as in GET_ACTIVE_ENVIRONMENTS>}
+
+    The feed subscribes first, then loads the table once with
+    GET_ACTIVE_ENVIRONMENTS, whose reply names the version it reflects, and
+    applies the events that are newer. A gap in the versions reloads the
+    table. Queues without a feed, whether they answer GET_STATUS_FEED with
+    another message or not at all within feed_timeout seconds, are polled
+    every poll_interval seconds instead, and the differences between tables
+    are turned into the same events, so listeners cannot tell the two apart.
+
+    Requests go out on a socket of the feed, never on the one a client uses
+    to create and join environments. A queue that stops answering stops the
+    feed, the TDWError is kept in error.
+    """
+
+    def __init__(self, host_address, queue_port_num="23402", ctx=None,
+                 poll_interval=2.0, timeout=10.0, queue_codec="json",
+                 feed_timeout=1.0):
+        self.host_address = host_address
+        self.queue_port_num = str(queue_port_num)
+        self.ctx = ctx or zmq.Context.instance()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.feed_timeout = feed_timeout
+        self.codec = tdw_codec.get_codec(queue_codec)
+
+        self.table = {}
+        self.version = None
+        self.mode = None
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.running = False
+        self.thread = None
+        self.error = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    ############################################################################
+    #                               USER FUNCTIONS                             #
+    ############################################################################
+
+    def start(self, wait=True):
+        """
+        Starts following the queue in a background thread, by default
+        returning once the table is loaded
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.follow)
+        self.thread.daemon = True
+        self.thread.start()
+        # a queue without a feed may use up feed_timeout before polling
+        if (wait and not self.ready.wait(self.feed_timeout + self.timeout)):
+            self.stop()
+            raise TDWTimeoutError("no status from %s:%s after %s seconds"
+                                  % (self.host_address, self.queue_port_num,
+                                     self.feed_timeout + self.timeout))
+        if (self.error is not None):
+            raise self.error
+
+    def stop(self):
+        self.running = False
+        if (self.thread is not None):
+            self.thread.join()
+            self.thread = None
+
+    def processes(self):
+        """
+        Returns the current process table as a list of entries, sorted by port
+        """
+        with self.lock:
+            return sorted(self.table.values(),
+                          key=lambda proc: int(proc["port_num"]))
+
+    def add_listener(self, callback):
+        """
+        Calls callback(event, process) for every change, from the thread of
+        the feed
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    ############################################################################
+    #                             HELPER FUNCTIONS                             #
+    ############################################################################
+
+    def follow(self):
+        req = self.connect()
+        sub = None
+        try:
+            try:
+                msg = self.request(req, {"msg": {"msg_type": "GET_STATUS_FEED"}},
+                                   self.feed_timeout)
+            except TDWTimeoutError:
+                # queues may not answer messages they do not know, the REQ
+                # socket cannot send again before it received
+                req.close()
+                req = self.connect()
+                msg = {"msg": {"msg_type": "NO_STATUS_FEED"}}
+            if (msg["msg"]["msg_type"] == "STATUS_FEED"):
+                sub = self.ctx.socket(zmq.SUB)
+                sub.setsockopt(zmq.LINGER, 0)
+                sub.setsockopt(zmq.SUBSCRIBE, b"")
+                sub.connect("tcp://" + self.host_address + ":" + str(msg["port_num"]))
+                self.mode = "feed"
+                self.follow_feed(req, sub)
+            else:
+                self.mode = "polling"
+                self.follow_polling(req)
+        except TDWError as e:
+            self.error = e
+            self.ready.set()
+        finally:
+            req.close()
+            if (sub is not None):
+                sub.close()
+
+    def follow_feed(self, req, sub):
+        # events published while the table loads wait in the socket and are
+        # applied if newer, ones missed before the subscription took effect
+        # show up as a gap in the versions
+        self.load(req)
+        self.ready.set()
+
+        while (self.running):
+            if (not sub.poll(100, zmq.POLLIN)):
+                continue
+            event = self.codec.decode(sub.recv_multipart()[-1])
+            if (self.version is not None and event["version"] > self.version + 1):
+                # missed events, the table may be wrong
+                self.load(req)
+            else:
+                self.apply(event)
+
+    def follow_polling(self, req):
+        while (self.running):
+            self.load(req)
+            self.ready.set()
+            end = time.time() + self.poll_interval
+            while (self.running and time.time() < end):
+                time.sleep(min(0.1, max(end - time.time(), 0)))
+
+    def load(self, req):
+        """
+        Replaces the table with the one of the queue, notifying listeners of
+        the differences
+        """
+        msg = self.request(req, {"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}})
+        if (msg["msg"]["msg_type"] != "ACTIVE_PROCESSES"):
+            raise TDWError("Error: " + msg["msg"]["msg_type"])
+        table = dict((str(proc["port_num"]), proc) for proc in msg["processes"])
+
+        events = []
+        with self.lock:
+            for port, proc in table.items():
+                old = self.table.get(port)
+                if (old is None):
+                    events.append(("added", proc))
+                elif (old != proc):
+                    events.append(("changed", proc))
+            for port, proc in self.table.items():
+                if (port not in table):
+                    events.append(("removed", proc))
+            self.table = table
+            self.version = msg.get("version")
+        self.notify(events)
+
+    def apply(self, event):
+        if (self.version is not None and event["version"] <= self.version):
+            return
+        proc = event["process"]
+        port = str(proc["port_num"])
+        with self.lock:
+            if (event["event"] == "removed"):
+                self.table.pop(port, None)
+            else:
+                self.table[port] = proc
+            self.version = event["version"]
+        self.notify([(event["event"], proc)])
+
+    def notify(self, events):
+        for event, proc in events:
+            for callback in list(self.listeners):
+                callback(event, proc)
+
+    def connect(self):
+        req = self.ctx.socket(zmq.REQ)
+        req.setsockopt(zmq.LINGER, 0)
+        req.connect("tcp://" + self.host_address + ":" + self.queue_port_num)
+        return req
+
+    def request(self, req, msg, timeout=None):
+        if (timeout is None):
+            timeout = self.timeout
+        req.send(self.codec.encode(msg))
+        if (not req.poll(timeout * 1000, zmq.POLLIN)):
+            raise TDWTimeoutError("no reply from %s:%s after %s seconds"
+                                  % (self.host_address, self.queue_port_num,
+                                     timeout))
+        return self.codec.decode(req.recv())
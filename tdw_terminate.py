@@ -0,0 +1,175 @@
+import re, time
+import zmq
+
+import tdw_codec
+from tdw_errors import TDWError, TDWRequestError, TDWTimeoutError
+
+
+def active_processes(host_address, queue_port_num="23402", ctx=None,
+                     timeout=10.0, queue_codec="json"):
+    """
+    Returns the environment processes the queue at host_address lists as
+    active, asked on a socket of its own
+    """
+    codec = tdw_codec.get_codec(queue_codec)
+    ctx = ctx or zmq.Context.instance()
+    sock = ctx.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    endpoint = "tcp://" + host_address + ":" + str(queue_port_num)
+    sock.connect(endpoint)
+    try:
+        sock.send(codec.encode({"msg": {"msg_type": "GET_ACTIVE_ENVIRONMENTS"}}))
+        if (not sock.poll(timeout * 1000, zmq.POLLIN)):
+            raise TDWTimeoutError("no reply from %s after %s seconds"
+                                  % (endpoint, timeout))
+        msg = codec.decode(sock.recv())
+    finally:
+        sock.close()
+
+    msg_type = msg["msg"]["msg_type"]
+    if (msg_type != "ACTIVE_PROCESSES"):
+        raise TDWRequestError(msg_type, msg)
+    return msg["processes"]
+
+
+def select_processes(processes, owner=None, description=None,
+                     older_than=None, ports=None, predicate=None):
+    """
+    Returns the processes matching every filter given
+
+        owner        username the environment was created by
+        description  regular expression searched in the description
+        older_than   minimum age in seconds
+        ports        ports to select
+        predicate    function taking a process entry
+    """
+    now = time.time()
+    if (description is not None):
+        description = re.compile(description)
+    if (ports is not None):
+        ports = set(str(port) for port in ports)
+
+    selected = []
+    for proc in processes:
+        if (owner is not None and proc["env_owner"] != owner):
+            continue
+        if (description is not None and
+                not description.search(proc.get("env_desc") or "")):
+            continue
+        if (older_than is not None and
+                now - float(proc["proc_create_time"]) < older_than):
+            continue
+        if (ports is not None and str(proc["port_num"]) not in ports):
+            continue
+        if (predicate is not None and not predicate(proc)):
+            continue
+        selected.append(proc)
+    return selected
+
+
+class TerminationResult(object):
+    """
+    Outcome of terminate_environments: terminated processes are no longer
+    listed by the queue, remaining ones still were at the deadline.
+    acknowledged holds the ports whose environment answered TERMINATE.
+    """
+
+    def __init__(self, terminated, remaining, acknowledged):
+        self.terminated = terminated
+        self.remaining = remaining
+        self.acknowledged = acknowledged
+
+    def __nonzero__(self):
+        return not self.remaining
+
+    def __repr__(self):
+        return "TerminationResult(%d terminated, %d remaining)" % (
+            len(self.terminated), len(self.remaining))
+
+
+def terminate_environments(host_address, processes, queue_port_num="23402",
+                           deadline=10.0, verify=True, poll_interval=0.2,
+                           ctx=None, queue_codec="json"):
+    """
+    Sends TERMINATE to every process at once, each on a short-lived socket
+    of its own, and waits up to deadline seconds for them to disappear from
+    the active processes of the queue
+
+    Environments speak json until a client negotiated another codec, so
+    TERMINATE is always sent as json. Replies are collected but not relied
+    on, an environment may exit without answering. Without verify the
+    result counts every environment that answered as terminated.
+    """
+    ctx = ctx or zmq.Context.instance()
+    end = time.time() + deadline
+    data = tdw_codec.JSONCodec().encode({"n": 0, "msg": {"msg_type": "TERMINATE"}})
+
+    poller = zmq.Poller()
+    port_of = {}
+    for proc in processes:
+        sock = ctx.socket(zmq.REQ)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect("tcp://" + host_address + ":" + str(proc["port_num"]))
+        sock.send(data)
+        poller.register(sock, zmq.POLLIN)
+        port_of[sock] = str(proc["port_num"])
+
+    acknowledged = set()
+    remaining = list(processes)
+    try:
+        while (remaining and time.time() < end):
+            wait = min(poll_interval, max(end - time.time(), 0))
+            events = poller.poll(wait * 1000)
+            for sock, event in events:
+                sock.recv()
+                acknowledged.add(port_of.pop(sock))
+                poller.unregister(sock)
+                sock.close()
+            if (verify and (not events or not port_of)):
+                # ask the queue once replies stop coming in
+                remaining = _still_active(host_address, queue_port_num,
+                                          remaining, ctx, end, queue_codec)
+            elif (not verify):
+                remaining = [p for p in processes
+                             if str(p["port_num"]) not in acknowledged]
+    finally:
+        for sock in port_of:
+            sock.close()
+
+    keys = set(_process_key(p) for p in remaining)
+    terminated = [p for p in processes if _process_key(p) not in keys]
+    return TerminationResult(terminated, remaining, acknowledged)
+
+
+def terminate_matching(host_address, queue_port_num="23402", deadline=10.0,
+                       ctx=None, queue_codec="json", **filters):
+    """
+    Terminates the active environments matching filters (see
+    select_processes), e.g. terminate_matching(host, owner="me",
+    older_than=3600)
+    """
+    processes = active_processes(host_address, queue_port_num, ctx,
+                                 deadline, queue_codec)
+    processes = select_processes(processes, **filters)
+    return terminate_environments(host_address, processes, queue_port_num,
+                                  deadline, ctx=ctx, queue_codec=queue_codec)
+
+
+def _process_key(proc):
+    # a port can be reused by a new environment, the pid tells them apart
+    return (str(proc["port_num"]), str(proc.get("proc_pid")))
+
+
+def _still_active(host_address, queue_port_num, processes, ctx, end,
+                  queue_codec):
+    """
+    Returns the processes the queue still lists, all of them if it does not
+    answer before end
+    """
+    try:
+        active = active_processes(host_address, queue_port_num, ctx,
+                                  max(end - time.time(), 0.01), queue_codec)
+    except TDWError:
+        return processes
+    keys = set(_process_key(p) for p in active)
+    return [p for p in processes if _process_key(p) in keys]
@@ -0,0 +1,91 @@
+import mmap, socket
+import numpy as np
+
+
+# transports offered to environments when joining, in order of preference
+#   ipc: the environment names an ipc:// endpoint to use instead of tcp
+#   shm: frames are written to shared memory and only 'shm_frames'
+#        descriptors [path, offset, size] are sent in the header
+TRANSPORTS = ("ipc", "shm")
+
+
+def is_local_host(host_address):
+    """
+    Whether host_address names this machine
+    """
+    try:
+        address = socket.gethostbyname(host_address)
+    except socket.error:
+        return False
+    if (address.startswith("127.")):
+        return True
+    try:
+        local = socket.gethostbyname_ex(socket.gethostname())[2]
+    except socket.error:
+        return False
+    return address in local
+
+
+def offered_transports(transport, host_address):
+    """
+    Names of the transports to offer when joining, see TDW_Client transport
+    """
+    if (transport == "tcp"):
+        return []
+    if (transport == "auto"):
+        # shm only when asked for, see SharedFrames
+        if (not is_local_host(host_address)):
+            return []
+        return ["ipc"]
+    if (transport == "ipc"):
+        return ["ipc"]
+    if (transport == "shm"):
+        return list(TRANSPORTS)
+    raise ValueError("unknown transport '%s'" % transport)
+
+
+def accepted_endpoint(info):
+    """
+    Returns the endpoint the environment asked to be reached on from now on
+    in its reply header info, None to keep the current one
+    """
+    return info.get("ipc_endpoint")
+
+
+class SharedFrames(object):
+    """
+    Views onto frames an environment on the same machine wrote to shared
+    memory files, usually in /dev/shm
+
+    Files are mapped read-only on first use and kept mapped. Environments
+    reuse the space of a frame after a number of replies, so views are only
+    valid until then. unpack_frames copies them before handing them out,
+    into the preallocated arrays when given.
+    """
+
+    def __init__(self):
+        self.maps = {}
+
+    def frames(self, descriptors):
+        """
+        Returns one flat uint8 view per [path, offset, size] descriptor
+        """
+        views = []
+        for path, offset, size in descriptors:
+            mm = self.map(path, offset + size)
+            views.append(np.frombuffer(mm, dtype=np.uint8, count=size,
+                                       offset=offset))
+        return views
+
+    def map(self, path, size):
+        mm = self.maps.get(path)
+        if (mm is None or len(mm) < size):
+            # the file grew since it was mapped, views onto the old map stay
+            # valid until they are dropped
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[path] = mm
+        return mm
+
+    def close(self):
+        self.maps = {}
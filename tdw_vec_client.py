@@ -0,0 +1,199 @@
+import time
+import numpy as np
+import zmq
+
+from tdw_client import TDW_Client
+from tdw_errors import TDWTimeoutError
+from tdw_provision import create_environments
+
+
+class TDWVecClient(object):
+    """
+    Steps several environments together and returns their observations
+    stacked into contiguous (num_envs, height, width, channels) arrays
+
+    Every frame with a known shape (see frame_shape of TDW_Client) is written
+    straight into its row of the batch array, other frames are kept as a list
+    of per environment arrays. Headers are kept as a list under 'info'.
+
+    The clients must use one request in flight (pipeline_depth 1).
+    """
+
+    def __init__(self, clients, pending=True, dtype=np.uint8):
+        """
+        :Args:
+            clients (list of TDW_Client)
+                Clients already connected to their environments.
+
+        :Kwargs:
+            - pending (bool, default: True)
+                Whether every client still has a reply to receive, as is the case right after joining.
+
+            - dtype (numpy dtype, default: uint8)
+                Type of the batch arrays.
+        """
+        self.clients = list(clients)
+        self.num_envs = len(self.clients)
+        if (self.num_envs == 0):
+            raise ValueError("at least one client is required")
+
+        names = self.clients[0].frame_names
+        shapes = self.clients[0].frame_shapes
+        self.observations = {"info": [None] * self.num_envs}
+        self.outs = [dict() for _ in range(self.num_envs)]
+        for name in names:
+            if (name in shapes):
+                batch = np.zeros((self.num_envs,) + shapes[name], dtype=dtype)
+                for i in range(self.num_envs):
+                    self.outs[i][name] = batch[i]
+            else:
+                batch = [None] * self.num_envs
+            self.observations[name] = batch
+
+        self.pending = np.zeros(self.num_envs, dtype=bool)
+        self.pending[:] = pending
+
+    @classmethod
+    def create(cls, host_address, num_envs, selected_build, description,
+               **kwargs):
+        """
+        Creates and joins num_envs environments concurrently through the
+        queue at host_address, kwargs are passed to create_environments
+        """
+        return cls(create_environments(host_address, num_envs,
+                                       selected_build, description, **kwargs))
+
+    @classmethod
+    def join(cls, host_address, environments, **kwargs):
+        """
+        Joins the active environments listed by the queue as environments,
+        kwargs are passed to every TDW_Client
+        """
+        kwargs.setdefault("interactive", False)
+        clients = []
+        for environment in environments:
+            client = TDW_Client(host_address,
+                                initial_command="request_join_environment",
+                                selected_build=environment,
+                                **kwargs)
+            client.run()
+            clients.append(client)
+        return cls(clients)
+
+    ############################################################################
+    #                               USER FUNCTIONS                             #
+    ############################################################################
+
+    def step(self, actions=None):
+        """
+        Sends one action to every environment and waits for all of them to
+        answer. actions is a list with one action per environment, or a
+        single action sent to all of them.
+
+        Returns the batched observations
+        """
+        self.wait()
+        self.send(actions)
+        self.wait()
+        return self.observations
+
+    def step_ready(self, actions=None, k=1):
+        """
+        Sends actions to the environments that are not still busy with an
+        earlier action and returns as soon as k environments have answered,
+        so a slow environment does not stall the batch. Actions addressed to
+        busy environments are dropped.
+
+        Returns (indices, observations), only the rows at indices are new
+        """
+        idle = np.flatnonzero(~self.pending)
+        self.send(actions, idle)
+        ready = self.wait(k)
+        return ready, self.observations
+
+    def send(self, actions=None, indices=None):
+        """
+        Sends actions to the environments at indices (default: all)
+        """
+        if (indices is None):
+            indices = range(self.num_envs)
+        if (actions is None or isinstance(actions, dict)):
+            actions = [actions] * self.num_envs
+        elif (len(actions) != self.num_envs):
+            raise ValueError("expected %d actions, got %d"
+                             % (self.num_envs, len(actions)))
+
+        for i in indices:
+            if (self.pending[i]):
+                raise RuntimeError("environment %d has not answered yet" % i)
+            self.clients[i].send_action(actions[i])
+            self.pending[i] = True
+
+    def wait(self, k=None, timeout=None):
+        """
+        Receives replies until k of the environments with a pending reply
+        have answered (default: all of them). Returns the sorted indices of
+        the environments that answered.
+
+        Raises TDWTimeoutError if they have not within timeout seconds
+        (default: the longest timeout of the waiting clients, forever if
+        none has one). The sockets of the environments still pending are
+        then recreated, as TDW_Client does, and they are no longer pending.
+        """
+        waiting = np.flatnonzero(self.pending)
+        if (k is None or k > len(waiting)):
+            k = len(waiting)
+        if (timeout is None):
+            timeouts = [self.clients[i].timeout for i in waiting]
+            if (timeouts and None not in timeouts):
+                timeout = max(timeouts)
+        deadline = None if timeout is None else time.time() + timeout
+
+        poller = zmq.Poller()
+        index_of = {}
+        for i in waiting:
+            poller.register(self.clients[i].sock, zmq.POLLIN)
+            index_of[self.clients[i].sock] = i
+
+        ready = []
+        while (len(ready) < k):
+            if (deadline is None):
+                events = poller.poll()
+            else:
+                events = poller.poll(max(deadline - time.time(), 0) * 1000)
+            if (not events and deadline is not None and time.time() >= deadline):
+                self.abandon([i for i in waiting if i not in ready])
+                raise TDWTimeoutError("environments %s did not answer after %s seconds"
+                                      % ([int(i) for i in waiting if i not in ready],
+                                         timeout))
+            for sock, event in events:
+                i = index_of[sock]
+                self.recv(i)
+                poller.unregister(sock)
+                ready.append(i)
+        return np.array(sorted(ready), dtype=int)
+
+    def recv(self, i):
+        """
+        Receives the reply of environment i into row i of the batch
+        """
+        obs = self.clients[i].recv_frames(self.outs[i])
+        self.pending[i] = False
+        for name, value in obs.items():
+            if (name not in self.outs[i]):
+                self.observations[name][i] = value
+        return obs
+
+    def abandon(self, indices):
+        """
+        Forgets the replies pending from the environments at indices,
+        recreating their sockets so they can be sent to again
+        """
+        for i in indices:
+            self.clients[i].stats.timeouts += 1
+            self.clients[i].reset_socket()
+            self.pending[i] = False
+
+    def close(self):
+        for client in self.clients:
+            client.sock.close(linger=0)
@@ -0,0 +1,50 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from tdw_batching import BatchTuner
+
+
+def measure(tuner, seconds_per_request, nbytes=None, client_max=None):
+    """
+    Records one window of requests taking seconds_per_request(batch size)
+    """
+    for _ in range(tuner.window):
+        size = tuner.batch_size
+        tuner.record(size, seconds_per_request(size), nbytes and nbytes * size,
+                     client_max)
+
+
+class BatchTunerTest(unittest.TestCase):
+
+    def test_grows_on_slow_links(self):
+        # a round trip of 10 ms per request, 1 ms per step
+        tuner = BatchTuner(max_batch=16, window=2)
+        sizes = []
+        for _ in range(6):
+            measure(tuner, lambda size: 0.01 + 0.001 * size)
+            sizes.append(tuner.batch_size)
+        self.assertEqual(sizes[:4], [2, 4, 8, 16])
+        self.assertLessEqual(max(sizes), 16)
+
+    def test_shrinks_without_gain(self):
+        tuner = BatchTuner(min_batch=2, max_batch=16, window=2)
+        tuner.batch_size = 16
+        tuner.previous = 1000.0
+        measure(tuner, lambda size: 0.001 * size)
+        self.assertEqual(tuner.batch_size, 8)
+
+    def test_limits(self):
+        tuner = BatchTuner(max_batch=32, max_bytes=4096, window=1)
+        measure(tuner, lambda size: 0.01, nbytes=1024, client_max=64)
+        self.assertEqual(tuner.limit(), 4)
+        self.assertEqual(tuner.limit(client_max=2), 2)
+
+        tuner = BatchTuner(max_batch=32, max_latency=0.05, window=1)
+        tuner.batch_size = 8
+        measure(tuner, lambda size: 0.1)
+        self.assertEqual(tuner.batch_size, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
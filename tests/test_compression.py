@@ -0,0 +1,51 @@
+import os, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import tdw_compression
+
+AVAILABLE = tdw_compression.available_encodings()
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.frame = rng.randint(0, 4, (16, 12, 3)).astype(np.uint8)
+
+    def round_trip(self, encoding):
+        data = tdw_compression.encode_frame(self.frame, encoding)
+        decoded = tdw_compression.decode_frame(data, encoding)
+        np.testing.assert_array_equal(decoded, self.frame.reshape(-1))
+
+    @unittest.skipIf("lz4" not in AVAILABLE, "lz4 is not installed")
+    def test_lz4(self):
+        self.round_trip("lz4")
+
+    @unittest.skipIf("zstd" not in AVAILABLE, "zstandard is not installed")
+    def test_zstd(self):
+        self.round_trip("zstd")
+
+    def test_crop_and_scale(self):
+        frame = np.arange(8 * 8).reshape(8, 8).astype(np.uint8)
+        crop = tdw_compression.crop_and_scale(frame, roi=[2, 4, 4, 4],
+                                              scale=0.5)
+        np.testing.assert_array_equal(crop, [[20, 22], [36, 38]])
+        self.assertTrue(crop.flags.c_contiguous)
+
+    def test_frame_options(self):
+        self.assertIsNone(tdw_compression.frame_options("raw"))
+        options = tdw_compression.frame_options({"encoding": "raw",
+                                                 "scale": 0.5})
+        self.assertEqual(options, {"encodings": ["raw"], "scale": 0.5})
+        lossless = tdw_compression.frame_options("lossless")
+        self.assertEqual(lossless["encodings"][-1], "raw")
+        with self.assertRaises(ValueError):
+            tdw_compression.frame_options("gif")
+        self.assertEqual(tdw_compression.accept_frame_encoding(
+            {"encodings": ["zstd", "lz4", "raw"]}, ["raw", "lz4"]), "lz4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,289 @@
+"""
+Client tests against the local mock server (tdw_mock_server)
+
+Every test starts its own MockQueue on a port of its own, with environments
+on the ports just above it.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, time, getpass, unittest, itertools
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import tdw_codec
+import tdw_transport
+from tdw_client import TDW_Client
+from tdw_errors import TDWInputError, TDWTimeoutError
+from tdw_mock_server import MockQueue
+from tdw_pool import EnvironmentPool
+from tdw_provision import create_environments
+from tdw_status_feed import StatusFeed
+from tdw_vec_client import TDWVecClient
+
+FRAME_SHAPE = (16, 16, 3)
+PORTS = itertools.count(24800, 20)
+
+
+def unknown_user():
+    raise KeyError("getpwuid(): uid not found")
+
+
+class MockServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.port = next(PORTS)
+        self.queue = MockQueue(port=self.port, frame_shape=FRAME_SHAPE)
+        self.queue.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.sock.close(linger=0)
+        self.queue.stop()
+
+    def create(self, **kwargs):
+        kwargs.setdefault("timeout", 5.0)
+        client = TDW_Client("127.0.0.1",
+                            queue_port_num=str(self.port),
+                            initial_command="request_create_environment",
+                            selected_build=MockQueue.BUILD,
+                            username="test",
+                            description="mock",
+                            frame_shape=FRAME_SHAPE,
+                            interactive=False,
+                            **kwargs)
+        client.run()
+        self.clients.append(client)
+        return client
+
+    def test_create_and_step(self):
+        client = self.create()
+        self.assertTrue(client.environment_build.endswith(MockQueue.BUILD))
+        obs = client.recv_frames()
+        self.assertEqual(obs["info"]["msg_type"], "CLIENT_JOIN")
+        for _ in range(3):
+            obs = client.step()
+        self.assertEqual(obs["images"].shape, FRAME_SHAPE)
+        self.assertEqual(len(self.queue.environments), 1)
+
+    def test_username_unknown(self):
+        # neither $USER nor a password database entry, as in some containers
+        getuser = getpass.getuser
+        getpass.getuser = unknown_user
+        try:
+            client = TDW_Client("127.0.0.1",
+                                queue_port_num=str(self.port),
+                                initial_command="request_create_environment",
+                                selected_build=MockQueue.BUILD,
+                                description="mock",
+                                interactive=False)
+            self.clients.append(client)
+            with self.assertRaises(TDWInputError):
+                client.run()
+        finally:
+            getpass.getuser = getuser
+
+    def test_join(self):
+        client = self.create()
+        client.recv_frames()
+        joined = TDW_Client("127.0.0.1",
+                            queue_port_num=str(self.port),
+                            initial_command="request_join_environment",
+                            selected_build="%s: mock" % client.port_num,
+                            username="test",
+                            frame_shape=FRAME_SHAPE,
+                            interactive=False,
+                            timeout=5.0)
+        joined.run()
+        self.clients.append(joined)
+        self.assertEqual(str(joined.port_num), str(client.port_num))
+        joined.recv_frames()
+        self.assertEqual(joined.step()["images"].shape, FRAME_SHAPE)
+
+    def test_pipelining(self):
+        client = self.create(pipeline_depth=3)
+        client.recv_frames()
+        sent = [client.submit_action() for _ in range(3)]
+        self.assertEqual(client.in_flight(), 3)
+        collected = [client.collect_frames()[0] for _ in sent]
+        self.assertEqual(collected, sent)
+        self.assertEqual(client.in_flight(), 0)
+
+    def test_step_batch_into_out(self):
+        for depth in (1, 3):
+            client = self.create(pipeline_depth=depth)
+            client.recv_frames()
+            out = dict((name, np.zeros((4,) + FRAME_SHAPE, np.uint8))
+                       for name in client.frame_names)
+            obs = client.step_batch([{}] * 2, out=out)
+            self.assertEqual(obs["info"]["batch"], 2)
+            self.assertEqual(obs["images"].shape, (2,) + FRAME_SHAPE)
+            self.assertTrue(np.shares_memory(obs["images"], out["images"]))
+            self.assertTrue(out["images"][:2].any())
+            self.assertFalse(out["images"][2:].any())
+
+    def test_killall(self):
+        client = self.create(codec="json")
+        client.recv_frames()
+        other = self.create()
+        other.recv_frames()
+        other.step()
+        result = client.killall("test", deadline=3.0)
+        self.assertTrue(result)
+        self.assertEqual(len(self.queue.environments), 0)
+
+    @unittest.skipIf("msgpack" not in tdw_codec.available_codecs(),
+                     "msgpack is not installed")
+    def test_status_feed_with_queue_codec(self):
+        client = self.create(codec="msgpack")
+        client.recv_frames()
+        client.step()
+        feed = client.status_feed(timeout=3.0)
+        feed.start()
+        try:
+            self.assertEqual(len(feed.processes()), 1)
+        finally:
+            feed.stop()
+
+    def test_status_feed_polls_silent_queue(self):
+        queue = MockQueue(port=self.port + 10, status_feed=False,
+                          answer_unknown=False)
+        queue.start()
+        try:
+            feed = StatusFeed("127.0.0.1", self.port + 10, timeout=3.0,
+                              feed_timeout=0.3)
+            feed.start()
+            try:
+                self.assertEqual(feed.mode, "polling")
+                self.assertEqual(feed.processes(), [])
+            finally:
+                feed.stop()
+        finally:
+            queue.stop()
+
+    def test_reconnect(self):
+        client = self.create(reconnect_attempts=2, reconnect_backoff=0.1,
+                             reconnect_timeout=1.0)
+        client.recv_frames()
+        client.send_action()
+        # the reply to the action is never collected
+        self.assertTrue(client.reconnect())
+        self.assertEqual(client.recv_frames()["info"]["msg_type"],
+                         "CLIENT_JOIN")
+        client.step()
+
+    def test_reconnect_to_stopped_environment(self):
+        client = self.create(reconnect_attempts=2, reconnect_backoff=0.1,
+                             reconnect_timeout=0.3)
+        client.recv_frames()
+        for env in self.queue.environments.values():
+            env.stop()
+        start = time.time()
+        self.assertFalse(client.reconnect())
+        self.assertLess(time.time() - start, 3.0)
+
+    def test_shared_frames_are_copied(self):
+        self.assertEqual(tdw_transport.offered_transports("auto", "127.0.0.1"),
+                         ["ipc"])
+        client, = create_environments("127.0.0.1", 1, MockQueue.BUILD, "shm",
+                                      queue_port_num=str(self.port),
+                                      username="test",
+                                      frame_shape=FRAME_SHAPE, timeout=5.0,
+                                      transport="shm", pipeline_depth=3)
+        self.clients.append(client)
+        client.recv_frames()
+        for _ in range(3):
+            client.submit_action()
+        for _ in range(3):
+            obs = client.collect_frames()[1]
+            self.assertTrue(obs["images"].flags.owndata)
+
+    def test_pool_release_drops_buffered_replies(self):
+        pool = EnvironmentPool("127.0.0.1", 1, MockQueue.BUILD, "pool",
+                               queue_port_num=str(self.port),
+                               username="test", pipeline_depth=3, timeout=5.0,
+                               health_timeout=3.0)
+        pool.start()
+        try:
+            with pool.lease() as client:
+                client.recv_frames()
+                for _ in range(3):
+                    client.submit_action()
+                while (client.in_flight()):
+                    client.buffer_reply()
+            with pool.lease() as client:
+                self.assertEqual(client.recv_frames()["info"]["msg_type"],
+                                 "CLIENT_JOIN")
+            client = pool.acquire()
+            self.assertTrue(pool.evict(client, replace=False))
+            self.assertEqual(len(self.queue.environments), 0)
+        finally:
+            pool.close()
+
+    def test_pool_reaps_without_leases(self):
+        pool = EnvironmentPool("127.0.0.1", 1, MockQueue.BUILD, "pool",
+                               queue_port_num=str(self.port),
+                               username="test", timeout=5.0, min_size=0,
+                               max_idle=0.2, check_interval=0.1)
+        pool.start()
+        try:
+            self.assertEqual(len(self.queue.environments), 1)
+            time.sleep(1.0)
+            self.assertEqual(len(pool), 0)
+            self.assertEqual(len(self.queue.environments), 0)
+        finally:
+            pool.close()
+        self.assertFalse(pool.reaper.is_alive())
+
+    def test_pool_replaces_dead_environments(self):
+        pool = EnvironmentPool("127.0.0.1", 1, MockQueue.BUILD, "pool",
+                               queue_port_num=str(self.port),
+                               username="test", timeout=5.0,
+                               health_timeout=1.0, check_interval=0.1)
+        pool.start()
+        try:
+            # the queue drops stopped environments from its table
+            env = self.queue.environments.values()[0]
+            env.stop()
+            time.sleep(1.0)
+            self.assertEqual(len(pool), 1)
+            self.assertEqual(len(self.queue.environments), 1)
+            self.assertNotIn(env, self.queue.environments.values())
+            start = time.time()
+            with pool.lease() as client:
+                client.recv_frames()
+            self.assertLess(time.time() - start, 0.5)
+        finally:
+            pool.close()
+
+    def test_vec_wait_timeout(self):
+        vec = TDWVecClient.create("127.0.0.1", 2, MockQueue.BUILD, "vec",
+                                  queue_port_num=str(self.port),
+                                  username="test")
+        self.clients.extend(vec.clients)
+        vec.step()
+        self.queue.environments[int(vec.clients[0].port_num)].stop()
+        vec.send()
+        with self.assertRaises(TDWTimeoutError):
+            vec.wait(timeout=1.0)
+        self.assertFalse(vec.pending.any())
+
+    def test_vec_wait_uses_client_timeout(self):
+        vec = TDWVecClient.create("127.0.0.1", 2, MockQueue.BUILD, "vec",
+                                  queue_port_num=str(self.port),
+                                  username="test", timeout=1.0)
+        self.clients.extend(vec.clients)
+        self.assertEqual([client.timeout for client in vec.clients], [1.0, 1.0])
+        vec.step()
+        self.queue.environments[int(vec.clients[1].port_num)].stop()
+        vec.send()
+        start = time.time()
+        with self.assertRaises(TDWTimeoutError):
+            vec.wait()
+        self.assertLess(time.time() - start, 3.0)
+        self.assertFalse(vec.pending.any())
+
+
+if __name__ == "__main__":
+    unittest.main()
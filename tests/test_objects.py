@@ -0,0 +1,49 @@
+import os, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from tdw_objects import ObjectStore
+
+
+def entry(object_id, position, static=False):
+    return ["obj%d" % object_id, object_id, position, [0, 0, 0, 1],
+            [0, 0, 0], static]
+
+
+class ObjectStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ObjectStore(capacity=2)
+        self.store.update([entry(1, [0, 0, 0]),
+                           entry(2, [5, 0, 0], static=True),
+                           entry(3, [1, 1, 1])])
+
+    def test_lookup(self):
+        self.assertEqual(len(self.store), 3)
+        self.assertIn(2, self.store)
+        self.assertEqual(self.store.name(3), "obj3")
+        np.testing.assert_array_equal(self.store.get(2)["position"], [5, 0, 0])
+
+    def test_nearest(self):
+        self.assertEqual(list(self.store.nearest([4, 0, 0], k=2)), [2, 3])
+        self.assertEqual(list(self.store.nearest([4, 0, 0], k=5,
+                                                 static=False)), [3, 1])
+
+    def test_in_region(self):
+        self.assertEqual(sorted(self.store.in_region([-1, -1, -1], [2, 2, 2])),
+                         [1, 3])
+
+    def test_changed_and_missing(self):
+        self.assertEqual(sorted(self.store.changed()), [1, 2, 3])
+        self.store.update([entry(1, [0, 0, 0]), entry(3, [2, 1, 1])])
+        self.assertEqual(list(self.store.changed()), [3])
+        self.assertNotIn(2, self.store)
+        self.assertEqual(len(self.store), 2)
+        # ids keep their row while missing
+        self.store.update([entry(2, [5, 0, 0])])
+        self.assertEqual(self.store.row(2), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
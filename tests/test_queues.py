@@ -0,0 +1,49 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import tdw_queues
+from tdw_queues import QueueLoad
+
+
+def process(owner, build=None):
+    proc = {"env_owner": owner, "proc_pid": 1, "port_num": 1071,
+            "proc_create_time": "0", "env_desc": ""}
+    if (build is not None):
+        proc["selected_build"] = build
+    return proc
+
+
+class QueueLoadTest(unittest.TestCase):
+
+    def test_build_compared_by_name(self):
+        load = QueueLoad("a", "23402", [process("x", "builds/mock.x86_64")],
+                         latency=0.0)
+        self.assertEqual(load.score(build="mock.x86_64", build_weight=2.0), 3.0)
+        self.assertEqual(load.score(build="other/mock.x86_64",
+                                    build_weight=2.0), 3.0)
+        self.assertEqual(load.score(build="real.x86_64", build_weight=2.0), 1.0)
+
+    def test_processes_without_build(self):
+        load = QueueLoad("a", "23402", [process("x")], latency=0.0)
+        self.assertEqual(load.score(build="mock.x86_64"), load.score())
+
+    def test_owner_and_latency(self):
+        load = QueueLoad("a", "23402", [process("x"), process("y")],
+                         latency=0.01)
+        self.assertAlmostEqual(load.score(owner="x"), 4.0)
+
+    def test_spread(self):
+        busy = QueueLoad("a", "23402", [process("x")], latency=0.0)
+        free = QueueLoad("b", "23402", [], latency=0.0)
+        down = QueueLoad("c", "23402", error="no reply")
+        placements = tdw_queues.spread([busy, free, down], 3)
+        self.assertEqual([load.host for load in placements], ["b", "b", "a"])
+
+    def test_parse_queues(self):
+        self.assertEqual(tdw_queues.parse_queues(["a", "b:1", ("c", 2)], "9"),
+                         [("a", "9"), ("b", "1"), ("c", "2")])
+
+
+if __name__ == "__main__":
+    unittest.main()
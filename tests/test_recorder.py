@@ -0,0 +1,58 @@
+import os, sys, shutil, tempfile, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from tdw_recorder import TrajectoryRecorder, TrajectoryReader, INDEX_FILE
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, steps, **kwargs):
+        out = np.zeros((4, 4, 3), np.uint8)
+        with TrajectoryRecorder(self.directory, **kwargs) as recorder:
+            for step in range(steps):
+                # a writable output array, overwritten every step
+                out[:] = step
+                depth = np.full((2, 2), step, np.float32)
+                recorder.record({"info": {"step": step}, "images": out,
+                                 "depth": depth})
+        return recorder
+
+    def test_round_trip(self):
+        self.record(5, shard_steps=2)
+        self.assertEqual(len([d for d in os.listdir(self.directory)
+                              if d.startswith("shard_")]), 3)
+        reader = TrajectoryReader(self.directory)
+        self.assertEqual(len(reader), 5)
+        self.assertEqual(reader.frame_names, ["depth", "images"])
+        obs = reader[3]
+        self.assertEqual(obs["info"], {"step": 3})
+        np.testing.assert_array_equal(obs["images"], np.full((4, 4, 3), 3))
+        self.assertEqual(obs["depth"].dtype, np.float32)
+        self.assertEqual(reader.frames("images", [0, 4]).shape, (2, 4, 4, 3))
+        self.assertEqual(list(reader.steps), range(5))
+
+    def test_cut_short(self):
+        self.record(3)
+        index = os.path.join(self.directory, "shard_00000", INDEX_FILE)
+        with open(index, "a") as f:
+            f.write('{"step": 3, "ti')
+        self.assertEqual(len(TrajectoryReader(self.directory)), 3)
+
+    def test_new_shards_follow_old_ones(self):
+        self.record(2)
+        self.record(2)
+        reader = TrajectoryReader(self.directory)
+        self.assertEqual(len(reader), 4)
+        self.assertEqual(list(reader.shards), [0, 0, 1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
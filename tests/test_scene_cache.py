@@ -0,0 +1,60 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from tdw_scene_cache import SceneCache, SceneSnapshot, freeze, thaw
+
+
+class SceneSnapshotTest(unittest.TestCase):
+
+    def test_apply(self):
+        scene = freeze({"a": {"x": 1, "y": [1, 2]}, "b": {"z": 3}})
+        new = scene.apply({"version": 2,
+                           "set": [[["a", "x"], 5], [["c"], {"w": 1}]],
+                           "remove": [["a", "y"]]})
+        self.assertEqual(thaw(new), {"a": {"x": 5}, "b": {"z": 3},
+                                     "c": {"w": 1}})
+        self.assertEqual(new.version, 2)
+        # untouched parts are shared, the old snapshot is unchanged
+        self.assertIs(new["b"], scene["b"])
+        self.assertEqual(thaw(scene), {"a": {"x": 1, "y": [1, 2]},
+                                       "b": {"z": 3}})
+
+    def test_immutable(self):
+        scene = freeze({"a": [1, {"b": 2}]})
+        self.assertIsInstance(scene["a"][1], SceneSnapshot)
+        with self.assertRaises(TypeError):
+            scene["a"] = 1
+
+
+class SceneCacheTest(unittest.TestCase):
+
+    def test_update(self):
+        cache = SceneCache()
+        config = {"environment_scene": "x"}
+        self.assertIsNone(cache.version(1071, config))
+        cache.update(1071, config, {"scene_info": {"a": 1}, "scene_version": 1})
+        self.assertEqual(cache.version("1071", config), 1)
+
+        snapshot = cache.update(1071, config, {"scene_delta": {
+            "base": 1, "version": 2, "set": [[["b"], 2]]}})
+        self.assertEqual(thaw(snapshot), {"a": 1, "b": 2})
+        # a delta overtaken by a later reply changes nothing
+        cache.update(1071, config, {"scene_delta": {
+            "base": 1, "version": 2, "set": [[["b"], 3]]}})
+        self.assertEqual(thaw(cache.get(1071, config)), {"a": 1, "b": 2})
+        self.assertEqual((cache.full_updates, cache.delta_updates), (1, 2))
+
+    def test_delta_without_base(self):
+        cache = SceneCache()
+        cache.update(1071, None, {"scene_info": {"a": 1}, "scene_version": 1})
+        self.assertIsNone(cache.update(1071, None, {"scene_delta": {
+            "base": 4, "version": 5, "set": []}}))
+        self.assertIsNone(cache.get(1071))
+        self.assertEqual(cache.misses, 1)
+        # other configs of the same port are cached apart
+        self.assertIsNone(cache.get(1071, {"environment_scene": "y"}))
+
+
+if __name__ == "__main__":
+    unittest.main()